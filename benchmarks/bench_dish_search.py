@@ -0,0 +1,86 @@
+"""Бенчмарк поиска блюда при наборе: 2000 блюд в 40 категориях.
+
+Замеряет построение DishSearchIndex (один раз на версию меню) и поиск
+на каждое нажатие клавиши: запрос набирается по букве, как в поле
+поиска экрана заказа. БД и окно не нужны.
+
+Запуск: python benchmarks/bench_dish_search.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import DishSearchIndex  # noqa: E402
+
+DISHES = 2000
+CATEGORIES = 40
+QUERIES = 200
+
+WORDS = [
+    "борщ", "суп", "салат", "цезарь", "стейк", "рибай", "паста", "карбонара", "пицца", "маргарита",
+    "пельмени", "вареники", "блины", "сырники", "котлета", "пожарская", "плов", "шашлык", "лосось",
+    "судак", "греческий", "оливье", "солянка", "уха", "жаркое", "грибной", "куриный", "говяжий",
+    "сливочный", "томатный", "чизкейк", "тирамису", "морс", "компот", "чай", "кофе", "латте",
+]
+
+
+def make_dishes(seed=7):
+    rng = random.Random(seed)
+    categories = [f"{rng.choice(WORDS).capitalize()} {number}" for number in range(CATEGORIES)]
+    return [
+        {
+            "id": dish_id,
+            "name": " ".join(rng.sample(WORDS, rng.randint(1, 3))).capitalize() + f" №{dish_id}",
+            "price": rng.randint(100, 2000),
+            "quantity": rng.randint(1, 50),
+            "category": rng.choice(categories),
+        }
+        for dish_id in range(1, DISHES + 1)
+    ]
+
+
+def measure(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main():
+    dishes = make_dishes()
+    build = lambda: DishSearchIndex(dishes)  # noqa: E731
+    index = build()
+
+    # Каждый префикс запроса - отдельное нажатие клавиши; бывают и опечатки
+    rng = random.Random(1)
+    keystrokes = []
+    for _ in range(QUERIES):
+        query = " ".join(rng.sample(WORDS, rng.randint(1, 2)))
+        if rng.random() < 0.1:
+            position = rng.randrange(len(query))
+            query = query[:position] + "ы" + query[position + 1:]
+        keystrokes.extend(query[:length] for length in range(1, len(query) + 1))
+    pending = iter(keystrokes * 2)
+
+    # Результат - блюда с id, и каждое содержит все слова запроса
+    for dish in index.search("борщ гриб"):
+        text = f"{dish['name']} {dish['category']}".lower()
+        assert "борщ" in text and "гриб" in text, dish
+
+    print(f"Блюд: {DISHES}, категорий: {CATEGORIES}, нажатий клавиш: {len(keystrokes)}")
+    for name, fn, repeats in (
+        ("построение", build, 20),
+        ("нажатие", lambda: index.search(next(pending)), len(keystrokes)),
+    ):
+        median, p95 = measure(fn, repeats)
+        print(f"{name:12} медиана {median:8.3f} мс   p95 {p95:8.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""Бенчмарк экранов без окна: загрузка данных, подготовка строк и отрисовка отдельно.
+
+Работает с локальным PostgreSQL (параметры из main.DB_CONFIG) в отдельной базе
+BENCH_DB, которую при первом запуске создает и заполняет синтетическими данными:
+столы, официанты, клиенты, меню, брони и заказы за несколько месяцев.
+Рабочую базу ресторана не трогает. Число столов и броней в день задают --tables
+и --reservations-per-day; база с другим объемом заполняется заново.
+
+Для каждого экрана (update_tables_view, update_sales_stats, update_sessions_stats,
+generate_receipt) замеряются фазы:
+    load   - запросы к БД (те же функции запросов, что и в приложении);
+    shape  - превращение строк БД в строки экрана / текст чека;
+    render - вставка в Treeview (только если есть дисплей и не указан --headless).
+Печатаются p50/p95 в мс. С --save результаты пишутся в JSON, с --baseline
+сравниваются с сохраненными: рост p95 больше чем на --tolerance дает код выхода 1.
+
+bench_screens_baseline.json - базовая линия, снятая на этой схеме (SCHEMA_SQL
+приложения поверх BASE_SCHEMA, PostgreSQL 18, локально, --headless --repeats 100).
+Времена зависят от машины: перед сравнением на своей снимите собственную
+базовую линию с --save. При 30 повторах p95 шумит сильнее допуска 20%.
+
+Обновление экрана столов в большом зале (500 столов, 5000 броней в день) -
+bench_screens_500x5000.json:
+    python benchmarks/bench_screens.py --tables 500 --reservations-per-day 5000 \
+        --headless --repeats 100 --baseline benchmarks/bench_screens_500x5000.json
+
+Запуск: python benchmarks/bench_screens.py [--reseed] [--headless] [--repeats N]
+        [--tables N] [--reservations-per-day N] [--save bench.json] [--baseline bench.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, time as dtime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2  # noqa: E402
+import psycopg2.extras  # noqa: E402
+
+import main  # noqa: E402
+from main import (  # noqa: E402
+    RECEIPT_ITEMS_SQL, RECEIPT_ORDER_SQL, Database, RestaurantService, TreeviewSync, build_floor_rows,
+    build_sales_rows, build_session_rows, floor_status_query, format_receipt,
+    sales_stats_query, sessions_query,
+)
+
+BENCH_DB = os.environ.get("BENCH_DB", "restaurant_bench")
+REPEATS = 30
+
+# Объем синтетических данных
+TABLES = 200
+WAITERS = 40
+CLIENTS = 2000
+CATEGORIES = 8
+DISHES = 120
+DAYS = 120
+ORDERS_PER_DAY = 400
+RESERVATIONS_PER_DAY = 250
+SEED_UNTIL = date(2025, 6, 30)
+
+# Основная схема в том объеме, в котором ее использует приложение
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS roles (id serial PRIMARY KEY, name text NOT NULL);
+    CREATE TABLE IF NOT EXISTS users (
+        id serial PRIMARY KEY, login text UNIQUE NOT NULL, password text NOT NULL,
+        full_name text NOT NULL, role_id integer NOT NULL REFERENCES roles (id)
+    );
+    CREATE TABLE IF NOT EXISTS tables (
+        id serial PRIMARY KEY, capacity integer NOT NULL, status text NOT NULL DEFAULT 'free'
+    );
+    CREATE TABLE IF NOT EXISTS waiter_tables (
+        waiter_id integer NOT NULL REFERENCES users (id),
+        table_id integer NOT NULL REFERENCES tables (id)
+    );
+    CREATE TABLE IF NOT EXISTS reservations (
+        id serial PRIMARY KEY, date date NOT NULL, start_time time NOT NULL, end_time time NOT NULL,
+        guests integer NOT NULL, table_id integer NOT NULL REFERENCES tables (id),
+        client_id integer NOT NULL REFERENCES users (id), status text NOT NULL DEFAULT 'active'
+    );
+    CREATE TABLE IF NOT EXISTS dish_categories (id serial PRIMARY KEY, name text NOT NULL);
+    CREATE TABLE IF NOT EXISTS dishes (
+        id serial PRIMARY KEY, name text NOT NULL, category_id integer REFERENCES dish_categories (id),
+        price numeric(10, 2) NOT NULL, quantity integer NOT NULL DEFAULT 0, description text
+    );
+    CREATE TABLE IF NOT EXISTS orders (
+        id serial PRIMARY KEY, table_id integer NOT NULL REFERENCES tables (id),
+        client_id integer NOT NULL REFERENCES users (id), waiter_id integer REFERENCES users (id),
+        status text NOT NULL DEFAULT 'active', total numeric(12, 2) NOT NULL DEFAULT 0,
+        created_at timestamp NOT NULL DEFAULT NOW(), receipt_printed boolean NOT NULL DEFAULT FALSE
+    );
+    CREATE TABLE IF NOT EXISTS order_items (
+        id serial PRIMARY KEY, order_id integer NOT NULL REFERENCES orders (id),
+        dish_id integer NOT NULL REFERENCES dishes (id),
+        quantity integer NOT NULL, price numeric(10, 2) NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS shifts (
+        id serial PRIMARY KEY, waiter_id integer NOT NULL REFERENCES users (id),
+        start_time timestamp NOT NULL, end_time timestamp, tips numeric(10, 2) DEFAULT 0
+    );
+"""
+
+BENCH_TABLES = (
+    "shifts", "order_items", "orders", "dishes", "dish_categories",
+    "reservations", "waiter_tables", "tables", "users", "roles",
+)
+
+
+def ensure_database():
+    """Создает базу BENCH_DB, если ее нет, и направляет на нее main.DB_CONFIG"""
+    admin_config = dict(main.DB_CONFIG, dbname="postgres")
+    conn = psycopg2.connect(**admin_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (BENCH_DB,))
+            if not cursor.fetchone():
+                cursor.execute(f'CREATE DATABASE "{BENCH_DB}"')
+    finally:
+        conn.close()
+    main.DB_CONFIG["dbname"] = BENCH_DB
+
+
+def day_reservations(rng, day, tables, per_day, client_ids):
+    """Брони одного дня: per_day штук по случайным столам. День стола (9:00-24:00)
+    делится на равные окна по числу его броней, бронь лежит внутри своего окна,
+    поэтому брони стола не пересекаются (reservations_no_overlap) при любой плотности"""
+    per_table = defaultdict(int)
+    for table_id in rng.choices(range(1, tables + 1), k=per_day):
+        per_table[table_id] += 1
+    reservations = []
+    for table_id, count in per_table.items():
+        window = (24 - 9) * 60 // count
+        for slot in range(count):
+            duration = min(rng.choice([60, 90, 120]), window - 1)
+            start = 9 * 60 + slot * window + rng.randint(0, window - 1 - duration)
+            end = start + duration
+            reservations.append((
+                day, dtime(*divmod(start, 60)), dtime(*divmod(end, 60)), rng.randint(1, 6),
+                table_id, rng.choice(client_ids), "active",
+            ))
+    return reservations
+
+
+def seed(db, reseed=False, seed_value=42, tables=TABLES, reservations_per_day=RESERVATIONS_PER_DAY):
+    """Заполняет базу синтетическими данными (если она пуста, другого объема или reseed)"""
+    rng = random.Random(seed_value)
+    with db.transaction() as cursor:
+        cursor.execute(BASE_SCHEMA)
+        if not reseed:
+            cursor.execute(
+                "SELECT (SELECT COUNT(*) FROM tables), (SELECT COUNT(*) FROM reservations WHERE date = %s)",
+                (SEED_UNTIL,)
+            )
+            seeded_tables, seeded_reservations = cursor.fetchone()
+            reseed = seeded_tables not in (0, tables) or (seeded_tables and seeded_reservations != reservations_per_day)
+        if reseed:
+            # Дневные итоги продаж ensure_schema заполнит заново из новых заказов
+            cursor.execute("DROP TRIGGER IF EXISTS order_items_daily_sales ON order_items")
+            cursor.execute("DROP TABLE IF EXISTS daily_dish_sales")
+            cursor.execute(f"TRUNCATE {', '.join(BENCH_TABLES)} RESTART IDENTITY CASCADE")
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM orders)")
+        if cursor.fetchone()[0]:
+            return False
+
+        execute_values = psycopg2.extras.execute_values
+        execute_values(cursor, "INSERT INTO roles (id, name) VALUES %s",
+                       [(1, "admin"), (2, "waiter"), (3, "client")])
+        users = [("admin", "admin", "Администратор", 1)]
+        users += [(f"waiter{i}", "x", f"Официант {i}", 2) for i in range(1, WAITERS + 1)]
+        users += [(f"client{i}", "x", f"Клиент {i}", 3) for i in range(1, CLIENTS + 1)]
+        execute_values(cursor, "INSERT INTO users (login, password, full_name, role_id) VALUES %s", users)
+        waiter_ids = list(range(2, WAITERS + 2))
+        client_ids = list(range(WAITERS + 2, WAITERS + CLIENTS + 2))
+
+        execute_values(cursor, "INSERT INTO tables (capacity) VALUES %s",
+                       [(rng.choice([2, 4, 6, 8]),) for _ in range(tables)])
+        execute_values(cursor, "INSERT INTO waiter_tables (waiter_id, table_id) VALUES %s",
+                       [(rng.choice(waiter_ids), table_id) for table_id in range(1, tables + 1)])
+
+        execute_values(cursor, "INSERT INTO dish_categories (name) VALUES %s",
+                       [(f"Категория {i}",) for i in range(1, CATEGORIES + 1)])
+        prices = [round(rng.uniform(150, 2500), 2) for _ in range(DISHES)]
+        execute_values(
+            cursor,
+            "INSERT INTO dishes (name, category_id, price, quantity, description) VALUES %s",
+            [(f"Блюдо {i + 1}", rng.randint(1, CATEGORIES), prices[i], 10 ** 6, "") for i in range(DISHES)],
+        )
+
+        first_day = SEED_UNTIL - timedelta(days=DAYS - 1)
+        reservations, orders, shifts = [], [], []
+        for offset in range(DAYS):
+            day = first_day + timedelta(days=offset)
+            reservations += day_reservations(rng, day, tables, reservations_per_day, client_ids)
+            for _ in range(ORDERS_PER_DAY):
+                created_at = datetime.combine(day, dtime(rng.randint(10, 22), rng.randint(0, 59)))
+                orders.append((
+                    rng.randint(1, tables), rng.choice(client_ids), rng.choice(waiter_ids),
+                    rng.choice(["paid", "paid", "paid", "closed"]), created_at,
+                ))
+            for waiter_id in waiter_ids:
+                start = datetime.combine(day, dtime(10))
+                shifts.append((waiter_id, start, start + timedelta(hours=12), round(rng.uniform(0, 3000), 2)))
+
+        execute_values(
+            cursor,
+            "INSERT INTO reservations (date, start_time, end_time, guests, table_id, client_id, status) VALUES %s",
+            reservations, page_size=5000,
+        )
+        execute_values(cursor, "INSERT INTO shifts (waiter_id, start_time, end_time, tips) VALUES %s",
+                       shifts, page_size=5000)
+        order_ids = execute_values(
+            cursor,
+            "INSERT INTO orders (table_id, client_id, waiter_id, status, created_at) VALUES %s RETURNING id",
+            orders, page_size=5000, fetch=True,
+        )
+        items = []
+        for (order_id,) in order_ids:
+            for dish_index in rng.sample(range(DISHES), rng.randint(1, 5)):
+                items.append((order_id, dish_index + 1, rng.randint(1, 3), prices[dish_index]))
+        execute_values(cursor, "INSERT INTO order_items (order_id, dish_id, quantity, price) VALUES %s",
+                       items, page_size=5000)
+        cursor.execute("""
+            UPDATE orders o SET total = s.total
+            FROM (SELECT order_id, SUM(price * quantity) AS total FROM order_items GROUP BY order_id) s
+            WHERE s.order_id = o.id
+        """)
+    return True
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Screen:
+    """Сценарий экрана: load(rng) -> данные БД, shape(данные) -> строки, render(строки)"""
+
+    def __init__(self, name, load, shape, render=None):
+        self.name = name
+        self.load = load
+        self.shape = shape
+        self.render = render
+
+
+def make_screens(db, tree_factory):
+    """Сценарии в том виде, в каком их выполняют методы RestaurantApp"""
+    fetch = lambda query, params: db.run(query, params, fetch=True)  # noqa: E731
+    paid_orders = [row[0] for row in fetch("SELECT id FROM orders WHERE status = 'paid' ORDER BY id", None)]
+    last_day = SEED_UNTIL
+
+    def load_tables(rng):
+        moment = datetime.combine(last_day - timedelta(days=rng.randrange(DAYS)), dtime(rng.randint(11, 22), 0))
+        return fetch(*floor_status_query(moment))
+
+    def load_sales(rng):
+        month = rng.choice([(d.month, d.year) for d in (last_day, last_day - timedelta(days=40))])
+        return fetch(*sales_stats_query(*month))
+
+    def load_sessions(rng):
+        end = last_day - timedelta(days=rng.randrange(DAYS - 7))
+        return fetch(*sessions_query(end - timedelta(days=7), end))
+
+    def load_receipt(rng):
+        order_id = rng.choice(paid_orders)
+        order = fetch(RECEIPT_ORDER_SQL, (order_id,))
+        return order[0], fetch(RECEIPT_ITEMS_SQL, (order_id,))
+
+    # Повторная печать: чек оплаченного заказа читается из receipts по ключу
+    service = RestaurantService(db)
+    reprinted = paid_orders[:100]
+    for order_id in reprinted:
+        service.generate_receipt(order_id)
+
+    def load_cached_receipt(rng):
+        return service.generate_receipt(rng.choice(reprinted))
+
+    def tree_renderer(columns, synced=False):
+        if tree_factory is None:
+            return None
+        tree = tree_factory(columns)
+        sync = TreeviewSync(tree) if synced else None
+
+        def render(rows):
+            if sync is not None:
+                sync.apply(rows)
+            else:
+                tree.delete(*tree.get_children())
+                for row in rows:
+                    tree.insert("", "end", values=row)
+            tree.update_idletasks()
+        return render
+
+    return [
+        Screen("update_tables_view", load_tables, build_floor_rows, tree_renderer(5, synced=True)),
+        Screen("update_sales_stats", load_sales, build_sales_rows, tree_renderer(4)),
+        Screen("update_sessions_stats", load_sessions, build_session_rows, tree_renderer(5)),
+        Screen("generate_receipt", load_receipt, lambda data: format_receipt(*data)),
+        Screen("generate_receipt (кэш)", load_cached_receipt, lambda body: body),
+    ]
+
+
+def make_tree_factory(headless):
+    """Treeview для фазы render, если есть дисплей"""
+    if headless:
+        return None
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        root = tk.Tk()
+    except Exception:
+        return None
+    root.withdraw()
+
+    def factory(column_count):
+        columns = [f"c{i}" for i in range(column_count)]
+        tree = ttk.Treeview(root, columns=columns, show="headings")
+        tree.pack()
+        return tree
+    return factory
+
+
+def run_screen(screen, repeats, rng):
+    timings = {"load": [], "shape": [], "render": []}
+    for _ in range(repeats):
+        started = time.perf_counter()
+        data = screen.load(rng)
+        loaded = time.perf_counter()
+        rows = screen.shape(data)
+        shaped = time.perf_counter()
+        timings["load"].append((loaded - started) * 1000)
+        timings["shape"].append((shaped - loaded) * 1000)
+        if screen.render is not None:
+            screen.render(rows)
+            timings["render"].append((time.perf_counter() - shaped) * 1000)
+    return {
+        phase: {"p50": percentile(samples, 0.5), "p95": percentile(samples, 0.95)}
+        for phase, samples in timings.items() if samples
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Сообщения о фазах, чей p95 вырос больше чем на tolerance относительно baseline"""
+    regressions = []
+    for screen, phases in results.items():
+        for phase, stats in phases.items():
+            before = baseline.get(screen, {}).get(phase)
+            # Доли миллисекунды шумят сильнее, чем любой допуск
+            if before and stats["p95"] > max(before["p95"] * (1 + tolerance), before["p95"] + 0.5):
+                regressions.append(f"{screen}.{phase}: p95 {before['p95']:.2f} -> {stats['p95']:.2f} мс")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reseed", action="store_true", help="пересоздать синтетические данные")
+    parser.add_argument("--headless", action="store_true", help="не замерять отрисовку в Treeview")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--tables", type=int, default=TABLES, help="столов в зале")
+    parser.add_argument("--reservations-per-day", type=int, default=RESERVATIONS_PER_DAY, help="броней в день")
+    parser.add_argument("--save", help="записать результаты в JSON")
+    parser.add_argument("--baseline", help="сравнить с ранее сохраненным JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p95 (доля)")
+    args = parser.parse_args()
+
+    ensure_database()
+    db = Database(dispatch=lambda callback, *callback_args: callback(*callback_args))
+    try:
+        if seed(db, args.reseed, tables=args.tables, reservations_per_day=args.reservations_per_day):
+            print(f"База {BENCH_DB} заполнена синтетическими данными")
+        db.ensure_schema()
+        db.run("ANALYZE")
+
+        rng = random.Random(7)
+        screens = make_screens(db, make_tree_factory(args.headless))
+        results = {}
+        print(f"База {BENCH_DB}: столов {args.tables}, броней в день {args.reservations_per_day}, "
+              f"повторов: {args.repeats}")
+        print(f"{'экран':24} {'фаза':7} {'p50, мс':>10} {'p95, мс':>10}")
+        for screen in screens:
+            screen.load(rng)  # прогрев: PREPARE, кэш страниц
+            results[screen.name] = run_screen(screen, args.repeats, rng)
+            for phase, stats in results[screen.name].items():
+                print(f"{screen.name:24} {phase:7} {stats['p50']:10.2f} {stats['p95']:10.2f}")
+    finally:
+        db.close()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"РЕГРЕССИЯ {message}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
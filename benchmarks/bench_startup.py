@@ -0,0 +1,125 @@
+"""Бенчмарк холодного запуска терминала: от старта процесса до окна и до связи с БД.
+
+Каждый запуск - отдельный процесс Python (как при включении терминала).
+Замеряются моменты от запуска процесса:
+    python - интерпретатор поднялся и начал выполнять скрипт;
+    import - импортированы tkinter и main (psycopg2 и прочие зависимости);
+    window - окно с экраном входа нарисовано и отвечает;
+    db     - фоновое подключение, служебная схема и прогрев меню завершились
+             (успехом или отказом - смотрите статус в выводе).
+С --host можно подставить недоступный адрес (например, 10.255.255.1), чтобы
+проверить, что окно не ждет подключения. Нужен дисплей.
+С --save результаты пишутся в JSON, с --baseline сравниваются с сохраненными:
+рост p95 больше чем на --tolerance дает код выхода 1.
+
+Запуск: python benchmarks/bench_startup.py [--runs N] [--host HOST]
+        [--save startup.json] [--baseline startup.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 10
+DB_WAIT_S = 30  # дольше этого фоновое подключение не ждем
+PHASES = ("python", "import", "window", "db")
+
+
+def child(launched, host):
+    """Один запуск приложения; печатает моменты фаз (с) одной строкой JSON"""
+    marks = {"python": time.time() - launched}
+    sys.path.insert(0, ROOT)
+    import tkinter as tk
+    import main
+    if host:
+        main.DB_CONFIG["host"] = host
+    marks["import"] = time.time() - launched
+
+    root = tk.Tk()
+    app = main.RestaurantApp(root)
+    root.update()
+    marks["window"] = time.time() - launched
+
+    deadline = time.time() + DB_WAIT_S
+    while app.db_status == "connecting" and time.time() < deadline:
+        root.update()
+        time.sleep(0.005)
+    marks["db"] = time.time() - launched
+    marks["status"] = app.db_status
+    app.on_close()
+    print(json.dumps(marks))
+
+
+def launch(host):
+    # Свой рабочий каталог на запуск: журнал и офлайн-очередь не копятся между запусками
+    with tempfile.TemporaryDirectory() as workdir:
+        command = [sys.executable, os.path.abspath(__file__), "--child", repr(time.time())]
+        if host:
+            command += ["--host", host]
+        output = subprocess.run(command, cwd=workdir, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def compare(results, baseline, tolerance):
+    """Сообщения о фазах, чей p95 вырос больше чем на tolerance относительно baseline"""
+    regressions = []
+    for phase, stats in results.items():
+        before = baseline.get(phase)
+        if before and stats["p95"] > max(before["p95"] * (1 + tolerance), before["p95"] + 20):
+            regressions.append(f"{phase}: p95 {before['p95']:.0f} -> {stats['p95']:.0f} мс")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--host", help="адрес PostgreSQL вместо main.DB_CONFIG['host']")
+    parser.add_argument("--save", help="записать результаты в JSON")
+    parser.add_argument("--baseline", help="сравнить с ранее сохраненным JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p95 (доля)")
+    parser.add_argument("--child", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child, args.host)
+        return
+
+    launch(args.host)  # прогрев файлового кэша: холодным считаем запуск процесса, а не диска
+    runs = [launch(args.host) for _ in range(args.runs)]
+    statuses = sorted({run["status"] for run in runs})
+    results = {
+        phase: {
+            "p50": percentile([run[phase] * 1000 for run in runs], 0.5),
+            "p95": percentile([run[phase] * 1000 for run in runs], 0.95),
+        }
+        for phase in PHASES
+    }
+
+    print(f"Запусков: {args.runs}, состояние БД после запуска: {', '.join(statuses)}")
+    print(f"{'фаза':8} {'p50, мс':>10} {'p95, мс':>10}")
+    for phase, stats in results.items():
+        print(f"{phase:8} {stats['p50']:10.0f} {stats['p95']:10.0f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"РЕГРЕССИЯ {message}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,86 @@
+"""Бенчмарк подбора стола (TableAllocator): 500 столов, 5000 броней за день.
+
+Замеряет построение подборщика (один раз на дату) и ранжирование столов
+(на каждое нажатие клавиши в форме брони). БД и окно не нужны.
+
+Запуск: python benchmarks/bench_table_allocator.py
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, time as dtime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import TableAllocator  # noqa: E402
+
+TABLES = 500
+RESERVATIONS = 5000
+REPEATS = 200
+
+
+def make_data(seed=42):
+    """Синтетический зал: столы (id, вместимость), брони на день, столы с активным заказом"""
+    rng = random.Random(seed)
+    day = date(2025, 6, 1)
+    tables = [(table_id, rng.choice([2, 4, 6, 8])) for table_id in range(1, TABLES + 1)]
+    reservations = []
+    for res_id in range(1, RESERVATIONS + 1):
+        start_hour = rng.randint(10, 21)
+        start_minute = rng.choice([0, 15, 30, 45])
+        end_hour = min(start_hour + rng.randint(1, 2), 23)
+        reservations.append((
+            res_id,
+            rng.randint(1, TABLES),
+            day,
+            dtime(start_hour, start_minute),
+            dtime(end_hour, start_minute),
+        ))
+    busy_tables = set(rng.sample(range(1, TABLES + 1), TABLES // 10))
+    return day, tables, reservations, busy_tables
+
+
+def measure(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main():
+    day, tables, reservations, busy_tables = make_data()
+    build = lambda: TableAllocator(day, tables, reservations, busy_tables)  # noqa: E731
+    allocator = build()
+
+    rng = random.Random(1)
+    requests = []
+    for _ in range(REPEATS):
+        start = datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randrange(10 * 60, 22 * 60, 15))
+        requests.append((rng.randint(1, 8), start, start + timedelta(minutes=rng.choice([60, 90, 120]))))
+    pending = iter(requests * 2)
+
+    def rank():
+        guests, start, end = next(pending)
+        allocator.rank(guests, start, end)
+
+    # Лучший стол не должен терять мест больше, чем любой другой подходящий
+    for guests, start, end in requests[:20]:
+        ranked = allocator.rank(guests, start, end)
+        if ranked:
+            assert ranked[0][1] - guests == min(capacity - guests for _, capacity in ranked)
+
+    print(f"Столов: {len(tables)}, броней за день: {len(reservations)}")
+    for name, fn, repeats in (
+        ("построение", build, 20),
+        ("ранжирование", rank, REPEATS),
+    ):
+        median, p95 = measure(fn, repeats)
+        print(f"{name:14} медиана {median:8.2f} мс   p95 {p95:8.2f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,2419 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
-from datetime import datetime, timedelta
+from tkinter import ttk, messagebox, filedialog
+from datetime import date, datetime, timedelta
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import psycopg2.extras
 from collections import defaultdict
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from decimal import Decimal
+import csv
+import hashlib
+import heapq
+import inspect
+import io
+import json
+import queue
+import select
+import sqlite3
+import threading
+import time
+import uuid
 import sys
 import logging
 
 logging.basicConfig(filename='app.log', level=logging.ERROR)
 
+# Параметры подключения к PostgreSQL
+DB_CONFIG = {
+    "dbname": "restaurant_db",
+    "user": "postgres",
+    "password": "123",
+    "host": "localhost",
+    "port": "5432",
+    "client_encoding": "WIN1251",  # Указываем кодировку соединения
+    "connect_timeout": 5,  # секунд; без него недоступный сервер держит подключение минутами
+}
+
+# Пул соединений для фоновых запросов
+DB_POOL_MIN = 1
+DB_POOL_MAX = 4
+
+# Как часто UI-поток забирает результаты фоновых запросов (мс)
+UI_POLL_MS = 30
+
+# Подключение при запуске идет в фоне; без связи оно повторяется с такой паузой (мс)
+STARTUP_RETRY_MS = 10000
+STATUS_POLL_MS = 2000  # как часто обновляется индикатор связи с БД
+
+# Основные экраны строятся один раз за сессию и при переходе только поднимаются.
+# Данные спрятанного экрана перечитываются при возврате, только если он устарел:
+# пришло изменение одной из его таблиц или он старше SCREEN_MAX_AGE_S
+SCREEN_MAX_AGE_S = 300
+SCREEN_SOURCES = {  # экран -> таблицы БД, изменения которых (NOTIFY) делают его устаревшим
+    "tables": ("orders", "reservations", "waiter_tables"),
+    "orders": ("orders",),
+    "menu": ("dishes", "dish_categories"),
+}
+
+# Служебная строка таблицы, пока данные загружаются
+LOADING_IID = "__loading__"
+
+# Сколько заказов подгружать за раз в списке администратора
+ORDERS_PAGE_SIZE = 100
+
+# История чеков читается серверным курсором пачками по столько заказов
+RECEIPTS_CHUNK_SIZE = 200
+
+# Канал PostgreSQL NOTIFY, по которому терминалы узнают об изменениях друг друга
+NOTIFY_CHANNEL = "pos_events"
+LISTEN_RETRY_S = 5  # пауза перед переподключением слушателя
+EVENT_COALESCE_MS = 100  # события за это время объединяются в один запрос
+
+# Остаток свободного времени стола короче этого уже не продать как бронь (мин)
+MIN_BOOKING_MINUTES = 60
+
+# Порции в корзине резервируются на складе; брошенная корзина отдает их обратно
+CART_HOLD_MINUTES = 30  # столько живет резерв корзины после последнего добавления
+HOLD_SWEEP_MS = 60000  # как часто терминал возвращает на склад истекшие резервы
+
+# Офлайн-очередь: заказы, оплаты и смены, принятые без связи с БД, хранятся
+# на терминале (SQLite) и досылаются в фоне, когда связь восстановится
+OFFLINE_QUEUE_PATH = "offline_queue.db"
+OFFLINE_RETRY_S = 10  # пауза между попытками дослать очередь
+OFFLINE_BATCH_SIZE = 50  # операций в одной транзакции досылки
+# Методы RestaurantService, которые можно отложить
+OFFLINE_OPERATIONS = ("save_order", "add_items_to_order", "pay_order", "close_order", "start_shift", "end_shift")
+
+# Телеметрия запросов: время, число строк и вызывающий экран для каждого запроса.
+# Выключена по умолчанию; включается на экране "Запросы" у администратора
+QUERY_TELEMETRY = False
+SLOW_QUERY_MS = 200  # запросы дольше этого порога пишутся в SLOW_QUERY_LOG
+SLOW_QUERY_LOG = "slow_queries.log"
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Операция из офлайн-очереди, уже выполненная в БД, и id созданной ею строки.
+# Повторная досылка того же ключа (например, после обрыва до подтверждения) пропускается
+APPLIED_OPERATIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS applied_operations (
+        key text PRIMARY KEY,
+        operation text NOT NULL,
+        result_id integer,
+        applied_at timestamp NOT NULL DEFAULT NOW()
+    )
+"""
+
+# Объекты БД, которые нужны приложению поверх основной схемы.
+# Выполняются при подключении; каждая команда идемпотентна
+SCHEMA_SQL = [
+    # Постраничная выборка заказов по ключу (created_at, id)
+    "CREATE INDEX IF NOT EXISTS orders_created_at_id_idx ON orders (created_at DESC, id DESC)",
+    # Занятость столов активными заказами (экран столов, подбор стола, бронь)
+    "CREATE INDEX IF NOT EXISTS orders_active_table_idx ON orders (table_id) WHERE status = 'active'",
+    # Диапазонные выборки статистики официантов за месяц
+    "CREATE INDEX IF NOT EXISTS orders_waiter_created_at_idx ON orders (waiter_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS shifts_waiter_start_time_idx ON shifts (waiter_id, start_time)",
+    # Готовые чеки оплаченных и закрытых заказов; изменение позиций заказа
+    # удаляет его чек (триггеры order_items_total_*)
+    """
+    CREATE TABLE IF NOT EXISTS receipts (
+        order_id integer PRIMARY KEY REFERENCES orders (id) ON DELETE CASCADE,
+        body text NOT NULL,
+        created_at timestamp NOT NULL DEFAULT NOW()
+    )
+    """,
+    # История чеков клиента за период
+    "CREATE INDEX IF NOT EXISTS orders_client_created_at_idx ON orders (client_id, created_at, id)",
+    # Бронь как интервал времени: [начало, конец), конец до начала - бронь через полночь.
+    # Пересечения активных броней одного стола запрещает сама БД
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    """
+    CREATE OR REPLACE FUNCTION reservation_period(d date, s time, e time) RETURNS tsrange AS $$
+        SELECT tsrange(d + s, d + e + CASE WHEN e < s THEN interval '1 day' ELSE interval '0' END, '[)')
+    $$ LANGUAGE sql IMMUTABLE
+    """,
+    """
+    ALTER TABLE reservations ADD COLUMN IF NOT EXISTS period tsrange
+        GENERATED ALWAYS AS (reservation_period(date, start_time, end_time)) STORED
+    """,
+    # Бронь нулевой длины запрещена. Раньше такая бронь считалась суточной:
+    # UPDATE один раз пересчитывает period у уже сохраненных
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'reservations_not_empty') THEN
+            UPDATE reservations SET end_time = end_time WHERE start_time = end_time;
+            ALTER TABLE reservations ADD CONSTRAINT reservations_not_empty
+                CHECK (start_time <> end_time) NOT VALID;
+        END IF;
+    END
+    $$
+    """,
+    # Ограничение не создать, пока в данных есть пересечения: ошибка перечисляет их,
+    # чтобы администратор отменил лишние брони (%% - из-за подстановки параметров psycopg2)
+    """
+    DO $$
+    DECLARE
+        conflicts text;
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'reservations_no_overlap') THEN
+            SELECT string_agg(format('стол %%s: брони #%%s и #%%s', a.table_id, a.id, b.id), '; ' ORDER BY a.id, b.id)
+            INTO conflicts
+            FROM reservations a
+            JOIN reservations b ON b.table_id = a.table_id AND b.id > a.id AND b.period && a.period
+            WHERE a.status = 'active' AND b.status = 'active';
+            IF conflicts IS NOT NULL THEN
+                RAISE EXCEPTION 'Запрет пересечения броней не включен, пересекаются: %%', conflicts;
+            END IF;
+            ALTER TABLE reservations ADD CONSTRAINT reservations_no_overlap
+                EXCLUDE USING gist (table_id WITH =, period WITH &&) WHERE (status = 'active');
+        END IF;
+    END
+    $$
+    """,
+    # Уведомления об изменениях строк: {"table", "op", "id", "table_id", "old_table_id", "stock"}.
+    # stock - новый остаток, если у блюда изменилось только количество (резерв, заказ):
+    # терминалы обновляют его в каталоге, не перечитывая меню
+    """
+    CREATE OR REPLACE FUNCTION pos_notify() RETURNS trigger AS $$
+    DECLARE
+        new_row jsonb := CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE to_jsonb(NEW) END;
+        old_row jsonb := CASE WHEN TG_OP = 'INSERT' THEN NULL ELSE to_jsonb(OLD) END;
+        cur_row jsonb := COALESCE(new_row, old_row);
+    BEGIN
+        PERFORM pg_notify('""" + NOTIFY_CHANNEL + """', jsonb_strip_nulls(jsonb_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', cur_row -> 'id',
+            'table_id', cur_row -> 'table_id',
+            'old_table_id', old_row -> 'table_id',
+            'stock', CASE WHEN TG_TABLE_NAME = 'dishes' AND TG_OP = 'UPDATE'
+                               AND new_row - 'quantity' = old_row - 'quantity'
+                          THEN new_row -> 'quantity' END
+        ))::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+] + [
+    # Триггер создается один раз: DROP/CREATE на каждом запуске брал бы
+    # ACCESS EXCLUSIVE на самые нагруженные таблицы
+    f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger WHERE tgname = '{table}_notify' AND tgrelid = '{table}'::regclass
+        ) THEN
+            CREATE TRIGGER {table}_notify
+                AFTER INSERT OR UPDATE OR DELETE ON {table}
+                FOR EACH ROW EXECUTE PROCEDURE pos_notify();
+        END IF;
+    END
+    $$
+    """
+    for table in ("orders", "reservations", "waiter_tables", "dishes", "dish_categories")
+] + [
+    # Продажи блюд по дням: экран статистики читает их вместо всей истории order_items
+    """
+    CREATE TABLE IF NOT EXISTS daily_dish_sales (
+        day date NOT NULL,
+        dish_id integer NOT NULL,
+        quantity bigint NOT NULL DEFAULT 0,
+        revenue numeric(14, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, dish_id)
+    )
+    """,
+    # Каждая вставка/изменение/удаление позиции заказа сдвигает итоги своего дня
+    """
+    CREATE OR REPLACE FUNCTION daily_dish_sales_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO daily_dish_sales AS s (day, dish_id, quantity, revenue)
+            SELECT o.created_at::date, OLD.dish_id, -OLD.quantity, -OLD.quantity * OLD.price
+            FROM orders o WHERE o.id = OLD.order_id
+            ON CONFLICT (day, dish_id) DO UPDATE
+            SET quantity = s.quantity + EXCLUDED.quantity,
+                revenue = s.revenue + EXCLUDED.revenue;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO daily_dish_sales AS s (day, dish_id, quantity, revenue)
+            SELECT o.created_at::date, NEW.dish_id, NEW.quantity, NEW.quantity * NEW.price
+            FROM orders o WHERE o.id = NEW.order_id
+            ON CONFLICT (day, dish_id) DO UPDATE
+            SET quantity = s.quantity + EXCLUDED.quantity,
+                revenue = s.revenue + EXCLUDED.revenue;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # Заказ, удаленный вместе с позициями (ON DELETE CASCADE), снимается с итогов
+    # до удаления: триггер позиций его строку в orders уже не найдет
+    """
+    CREATE OR REPLACE FUNCTION daily_dish_sales_forget_order() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO daily_dish_sales AS s (day, dish_id, quantity, revenue)
+        SELECT OLD.created_at::date, oi.dish_id, -SUM(oi.quantity), -SUM(oi.quantity * oi.price)
+        FROM order_items oi WHERE oi.order_id = OLD.id
+        GROUP BY oi.dish_id
+        ON CONFLICT (day, dish_id) DO UPDATE
+        SET quantity = s.quantity + EXCLUDED.quantity,
+            revenue = s.revenue + EXCLUDED.revenue;
+        RETURN OLD;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # Заполнение из истории и триггеры - один раз и под одной блокировкой,
+    # чтобы ни одна позиция не попала в итоги дважды или не потерялась
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'order_items_daily_sales') THEN
+            LOCK TABLE order_items IN SHARE ROW EXCLUSIVE MODE;
+            DELETE FROM daily_dish_sales;
+            INSERT INTO daily_dish_sales (day, dish_id, quantity, revenue)
+            SELECT o.created_at::date, oi.dish_id, SUM(oi.quantity), SUM(oi.price * oi.quantity)
+            FROM order_items oi
+            JOIN orders o ON oi.order_id = o.id
+            GROUP BY 1, 2;
+            CREATE TRIGGER order_items_daily_sales
+                AFTER INSERT OR UPDATE OR DELETE ON order_items
+                FOR EACH ROW EXECUTE PROCEDURE daily_dish_sales_apply();
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'orders_daily_sales') THEN
+            CREATE TRIGGER orders_daily_sales
+                BEFORE DELETE ON orders
+                FOR EACH ROW EXECUTE PROCEDURE daily_dish_sales_forget_order();
+        END IF;
+    END
+    $$
+    """,
+    # Одна строка на блюдо в заказе: повторное добавление блюда сливается в нее
+    # через INSERT ... ON CONFLICT. Дубли, оставшиеся от старых версий, один раз
+    # сливаются перед созданием индекса (цена - средняя, сумма строки не меняется)
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('order_items_order_dish_key') IS NULL THEN
+            LOCK TABLE order_items IN SHARE ROW EXCLUSIVE MODE;
+            WITH merged AS (
+                SELECT order_id, dish_id, MIN(id) AS keep_id, SUM(quantity) AS quantity,
+                       ROUND(SUM(quantity * price) / NULLIF(SUM(quantity), 0), 2) AS price
+                FROM order_items
+                GROUP BY order_id, dish_id
+                HAVING COUNT(*) > 1
+            ), kept AS (
+                UPDATE order_items oi
+                SET quantity = m.quantity, price = COALESCE(m.price, oi.price)
+                FROM merged m
+                WHERE oi.id = m.keep_id
+            )
+            DELETE FROM order_items oi
+            USING merged m
+            WHERE oi.order_id = m.order_id AND oi.dish_id = m.dish_id AND oi.id <> m.keep_id;
+            CREATE UNIQUE INDEX order_items_order_dish_key ON order_items (order_id, dish_id);
+        END IF;
+    END
+    $$
+    """,
+    # Сумма заказа ведется самой БД: каждая вставка/изменение/удаление позиций
+    # сдвигает orders.total на свою разницу, поэтому одновременные дозаказы
+    # с разных терминалов не теряют друг друга. Триггеры уровня оператора:
+    # один UPDATE orders (и одно уведомление) на заказ, а не на каждую позицию.
+    # Сохраненный чек заказа с измененными позициями удаляется той же транзакцией:
+    # generate_receipt соберет и сохранит его заново
+    """
+    CREATE OR REPLACE FUNCTION order_total_apply_lines() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE orders o SET total = o.total + d.delta
+            FROM (SELECT order_id, SUM(quantity * price) AS delta FROM new_lines GROUP BY order_id) d
+            WHERE o.id = d.order_id;
+            DELETE FROM receipts WHERE order_id IN (SELECT order_id FROM new_lines);
+        ELSIF TG_OP = 'UPDATE' THEN
+            UPDATE orders o SET total = o.total + d.delta
+            FROM (
+                SELECT order_id, SUM(delta) AS delta FROM (
+                    SELECT order_id, quantity * price AS delta FROM new_lines
+                    UNION ALL
+                    SELECT order_id, -quantity * price FROM old_lines
+                ) lines
+                GROUP BY order_id
+            ) d
+            WHERE o.id = d.order_id AND d.delta <> 0;
+            DELETE FROM receipts
+            WHERE order_id IN (SELECT order_id FROM new_lines UNION SELECT order_id FROM old_lines);
+        ELSE
+            UPDATE orders o SET total = o.total - d.delta
+            FROM (SELECT order_id, SUM(quantity * price) AS delta FROM old_lines GROUP BY order_id) d
+            WHERE o.id = d.order_id;
+            DELETE FROM receipts WHERE order_id IN (SELECT order_id FROM old_lines);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # Сверка сумм с позициями и триггеры - один раз и под блокировкой, чтобы ни одна
+    # позиция не попала в сумму дважды или не потерялась. Построчный триггер прежней
+    # версии уже держал суммы верными: он просто заменяется
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'order_items_total_insert') THEN
+            LOCK TABLE order_items IN SHARE ROW EXCLUSIVE MODE;
+            IF EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'order_items_order_total') THEN
+                DROP TRIGGER order_items_order_total ON order_items;
+                DROP FUNCTION IF EXISTS order_total_apply();
+            ELSE
+                UPDATE orders o
+                SET total = COALESCE(lines.total, 0)
+                FROM orders o2
+                LEFT JOIN (
+                    SELECT order_id, SUM(price * quantity) AS total FROM order_items GROUP BY order_id
+                ) lines ON lines.order_id = o2.id
+                WHERE o.id = o2.id AND o.total IS DISTINCT FROM COALESCE(lines.total, 0);
+            END IF;
+            CREATE TRIGGER order_items_total_insert
+                AFTER INSERT ON order_items REFERENCING NEW TABLE AS new_lines
+                FOR EACH STATEMENT EXECUTE PROCEDURE order_total_apply_lines();
+            CREATE TRIGGER order_items_total_update
+                AFTER UPDATE ON order_items REFERENCING OLD TABLE AS old_lines NEW TABLE AS new_lines
+                FOR EACH STATEMENT EXECUTE PROCEDURE order_total_apply_lines();
+            CREATE TRIGGER order_items_total_delete
+                AFTER DELETE ON order_items REFERENCING OLD TABLE AS old_lines
+                FOR EACH STATEMENT EXECUTE PROCEDURE order_total_apply_lines();
+        END IF;
+    END
+    $$
+    """,
+    # Ключи операций, досланных из офлайн-очередей терминалов
+    APPLIED_OPERATIONS_SQL,
+    # Резерв порций под корзину, еще не ставшую заказом: порции уже списаны
+    # с dishes.quantity и возвращаются, если корзину отменили или она истекла
+    """
+    CREATE TABLE IF NOT EXISTS stock_holds (
+        cart_id text NOT NULL,
+        dish_id integer NOT NULL REFERENCES dishes (id) ON DELETE CASCADE,
+        quantity integer NOT NULL CHECK (quantity > 0),
+        expires_at timestamp NOT NULL,
+        PRIMARY KEY (cart_id, dish_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS stock_holds_expires_at_idx ON stock_holds (expires_at)",
+    # Последняя линия защиты от ухода склада в минус; старые строки не перепроверяются
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'dishes_quantity_nonnegative') THEN
+            ALTER TABLE dishes ADD CONSTRAINT dishes_quantity_nonnegative CHECK (quantity >= 0) NOT VALID;
+        END IF;
+    END
+    $$
+    """,
+]
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Соединение, которое помнит имена уже подготовленных на нем запросов"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def positional_sql(query):
+    """Плейсхолдеры psycopg2 (%s) -> $1, $2, ... для PREPARE"""
+    parts = query.split("%s")
+    sql = parts[0]
+    for number, part in enumerate(parts[1:], 1):
+        sql += f"${number}{part}"
+    return sql.replace("%%", "%")
+
+
+# Служебные методы, через которые проходит запрос; вызывающим считается первый кадр вне них
+TELEMETRY_PASSTHROUGH = {
+    "Database.execute", "Database.run", "Database.submit", "Database._run_on", "Database._run_pooled",
+    "Database.transaction", "RestaurantApp.execute_query", "RestaurantApp.execute_query_async",
+    "RestaurantApp.call_service", "RestaurantApp.run_or_defer", "RestaurantService.fetch",
+}
+
+
+def calling_screen(depth=2):
+    """Имя метода приложения, из которого пришел запрос (например, RestaurantApp.save_order)"""
+    frame = sys._getframe(depth)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename == __file__:
+            caller = getattr(code, "co_qualname", None)
+            if caller is None:
+                # До Python 3.11 co_qualname нет: класс берем у self метода
+                owner = frame.f_locals.get("self")
+                caller = f"{type(owner).__name__}.{code.co_name}" if owner is not None else code.co_name
+            caller = caller.split(".<locals>")[0]
+            if caller not in TELEMETRY_PASSTHROUGH:
+                return caller
+        frame = frame.f_back
+    return "?"
+
+
+class QueryTelemetry:
+    """Гистограммы времени выполнения по запросам и журнал медленных запросов.
+    Пока enabled ложно, Database не вызывает record и не ищет вызывающего"""
+
+    def __init__(self, enabled=QUERY_TELEMETRY, slow_ms=SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        # Ключ запроса -> {"label", "name", "count", "total_ms", "max_ms", "rows", "buckets", "callers"}
+        self.statements = {}
+        self._lock = threading.Lock()
+        self._slow_log = None
+
+    @staticmethod
+    def label(query, name=None):
+        """(ключ, подпись) запроса. Именованный запрос - по имени. Остальные - по хэшу
+        всего текста без лишних пробелов, чтобы запросы с общим началом не сливались
+        в одну гистограмму; подпись - начало текста и короткий хэш"""
+        if name:
+            return name, name
+        text = " ".join(query.split())
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        return digest, f"{text[:80]} #{digest[:8]}"
+
+    def record(self, query, name, caller, elapsed_ms, rows):
+        key, label = self.label(query, name)
+        bucket = bisect_right(LATENCY_BUCKETS_MS, elapsed_ms)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = {
+                    "label": label, "name": name, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0,
+                    "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1), "callers": defaultdict(int),
+                }
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["rows"] += max(rows, 0)
+            stats["buckets"][bucket] += 1
+            stats["callers"][caller] += 1
+        if elapsed_ms >= self.slow_ms:
+            self.slow_log().warning(
+                "%.1f ms, rows=%s, caller=%s, statement=%s\n%s", elapsed_ms, rows, caller, label, query
+            )
+
+    def slow_log(self):
+        # Отдельный файл, чтобы медленные запросы не терялись среди ошибок app.log
+        if self._slow_log is None:
+            logger = logging.getLogger("restaurant.slow_queries")
+            if not logger.handlers:
+                handler = logging.FileHandler(SLOW_QUERY_LOG, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                logger.addHandler(handler)
+            logger.setLevel(logging.WARNING)
+            logger.propagate = False
+            self._slow_log = logger
+        return self._slow_log
+
+    @staticmethod
+    def percentile(buckets, total, max_ms, fraction):
+        """Оценка перцентиля по гистограмме: верхняя граница корзины (для последней - максимум)"""
+        threshold = total * fraction
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, buckets):
+            seen += count
+            if seen >= threshold:
+                return min(bound, max_ms)
+        return max_ms
+
+    def snapshot(self):
+        """Сводка для экрана: [(подпись, имя именованного запроса или None, вызывающие,
+        число, p50, p95, макс, среднее, строк в среднем, гистограмма)]"""
+        with self._lock:
+            items = [
+                (stats["label"], stats["name"], dict(stats["callers"]), stats["count"], stats["total_ms"],
+                 stats["max_ms"], stats["rows"], list(stats["buckets"]))
+                for stats in self.statements.values()
+            ]
+        result = []
+        for label, name, callers, count, total_ms, max_ms, rows, buckets in items:
+            result.append((
+                label,
+                name,
+                ", ".join(sorted(callers, key=callers.get, reverse=True)),
+                count,
+                self.percentile(buckets, count, max_ms, 0.5),
+                self.percentile(buckets, count, max_ms, 0.95),
+                max_ms,
+                total_ms / count,
+                rows / count,
+                buckets,
+            ))
+        result.sort(key=lambda row: row[3] * row[7], reverse=True)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+
+
+class Database:
+    """Работа с PostgreSQL: основное соединение UI-потока и пул фоновых воркеров.
+    Запросы с именем (name=...) готовятся через PREPARE один раз на соединение
+    и дальше выполняются через EXECUTE без повторного разбора и планирования"""
+
+    def __init__(self, dispatch):
+        # dispatch(callback, *args) передает результат фонового запроса в UI-поток
+        self.dispatch = dispatch
+        self.connection = None
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db-worker")
+        # Реестр именованных запросов: имя -> {"sql", "prepares", "executions"}
+        self.statements = {}
+        self._statements_lock = threading.Lock()
+        self.telemetry = QueryTelemetry()
+        self._closing = threading.Event()
+        self._transaction_depth = 0  # вложенность transaction() на основном соединении
+        self._connect_lock = threading.Lock()
+        self.schema_errors = []  # ошибки последнего ensure_schema, показываются администратору
+        self.schema_ready = False  # ensure_schema хоть раз прошел до конца
+
+    def connect(self):
+        """Открывает основное соединение, если оно еще не открыто (ошибки пробрасываются
+        вызывающему). Можно вызывать из воркера: UI-поток дождется того же подключения"""
+        with self._connect_lock:
+            if not self.is_connected():
+                self.connection = psycopg2.connect(connection_factory=PreparingConnection, **DB_CONFIG)
+            return self.connection
+
+    def ensure_schema(self):
+        """Создает недостающие служебные объекты БД (SCHEMA_SQL) на соединении пула,
+        не занимая основное. Ошибка в одной команде (например, нет прав) не мешает остальным,
+        но попадает в schema_errors"""
+        errors = []
+        for statement in SCHEMA_SQL:
+            try:
+                self._run_pooled(statement, None, False, None)
+            except Exception as e:
+                logging.error(f"Schema statement failed: {statement}\nError: {str(e)}")
+                diag = getattr(e, "diag", None)
+                errors.append(getattr(diag, "message_primary", None) or str(e))
+        self.schema_errors = errors
+        self.schema_ready = True
+
+    def warm_up(self, queries=()):
+        """Подключение при запуске (из воркера): основное соединение, служебная схема
+        и результаты queries для прогрева кэшей. Ошибка подключения пробрасывается"""
+        self.connect()
+        self.ensure_schema()
+        return [self._run_pooled(query, None, True, None) for query in queries]
+
+    def is_connected(self):
+        return self.connection is not None and not self.connection.closed
+
+    def get_connection(self):
+        """Возвращает основное соединение, переподключаясь при необходимости"""
+        if not self.is_connected():
+            self.connect()
+        return self.connection
+
+    def run(self, query, params=None, fetch=False, name=None):
+        """Выполняет запрос в основном соединении и фиксирует транзакцию
+        (внутри блока transaction() - становится частью его транзакции)"""
+        conn = self.get_connection()
+        try:
+            result = self._run_on(conn, query, params, fetch, name)
+            if not self._transaction_depth:
+                conn.commit()
+            return result
+        except Exception:
+            if not self._transaction_depth and not conn.closed:
+                conn.rollback()
+            raise
+
+    @contextmanager
+    def transaction(self):
+        """Курсор основного соединения: все запросы внутри блока - одна транзакция.
+        Вложенный блок не фиксирует и не откатывает ее - это делает внешний"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        outermost = not self._transaction_depth
+        self._transaction_depth += 1
+        try:
+            yield cursor
+            if outermost:
+                conn.commit()
+        except Exception:
+            if outermost and not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self._transaction_depth -= 1
+            cursor.close()
+
+    def submit(self, query, params=None, fetch=True, callback=None, errback=None, name=None):
+        """Выполняет запрос в фоновом потоке, результат приходит в UI-поток через dispatch"""
+        # В воркере стек уже не содержит экрана, поэтому вызывающего запоминаем здесь
+        caller = calling_screen() if self.telemetry.enabled else None
+        return self.run_in_background(
+            lambda: self._run_pooled(query, params, fetch, name, caller), callback, errback, query
+        )
+
+    def run_in_background(self, work, callback=None, errback=None, description=None):
+        """Выполняет work() на воркере; результат или ошибка приходят в UI-поток через dispatch"""
+        future = self._executor.submit(work)
+
+        def done(f):
+            error = f.exception()
+            if error is not None:
+                logging.error(f"Error executing background query: {description or work}\nError: {str(error)}")
+                if errback:
+                    self.dispatch(errback, error)
+            elif callback:
+                self.dispatch(callback, f.result())
+
+        future.add_done_callback(done)
+        return future
+
+    def stream(self, query, params=None, chunk_size=RECEIPTS_CHUNK_SIZE):
+        """Строки запроса пачками через серверный курсор на соединении пула.
+        В памяти одновременно только одна пачка; вызывать из воркера"""
+        pool = self._get_pool()
+        conn = pool.getconn()
+        try:
+            with conn.cursor(name=f"stream_{threading.get_ident()}") as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            # Только чтение: откат закрывает курсор и транзакцию, даже если чтение прервано
+            if not conn.closed:
+                conn.rollback()
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def submit_stream(self, query, params, on_chunk, on_done=None, errback=None, cancelled=None):
+        """Читает результат в фоне и отдает его в UI-поток пачками: on_chunk(rows), затем
+        on_done(число строк). Следующая пачка отправляется, только когда UI обработал
+        предыдущую; cancelled (threading.Event) прерывает чтение"""
+        cancelled = cancelled or threading.Event()
+
+        def work():
+            consumed = threading.Semaphore(1)
+            total = 0
+
+            def deliver(rows):
+                try:
+                    on_chunk(rows)
+                finally:
+                    consumed.release()
+
+            with closing(self.stream(query, params)) as chunks:
+                for rows in chunks:
+                    while not consumed.acquire(timeout=0.5):
+                        if cancelled.is_set() or self._closing.is_set():
+                            return total
+                    if cancelled.is_set() or self._closing.is_set():
+                        return total
+                    self.dispatch(deliver, rows)
+                    total += len(rows)
+            return total
+
+        return self.run_in_background(work, on_done, errback, query)
+
+    def execute(self, cursor, query, params=None, name=None, caller=None):
+        """Выполняет запрос на курсоре; именованный - через PREPARE/EXECUTE.
+        При включенной телеметрии замеряет время и число строк"""
+        telemetry = self.telemetry
+        if not telemetry.enabled:
+            return self._execute(cursor, query, params, name)
+        
+        if caller is None:
+            caller = calling_screen()
+        started = time.perf_counter()
+        try:
+            self._execute(cursor, query, params, name)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            telemetry.record(query, name, caller, elapsed_ms, cursor.rowcount)
+
+    def _execute(self, cursor, query, params=None, name=None):
+        if name is None:
+            cursor.execute(query, params or ())
+            return
+        
+        with self._statements_lock:
+            stats = self.statements.setdefault(name, {"sql": query, "prepares": 0, "executions": 0})
+        if stats["sql"] != query:
+            raise ValueError(f"Имя запроса {name} уже занято другим текстом запроса")
+        
+        conn = cursor.connection
+        prepared_now = name not in conn.prepared
+        if prepared_now:
+            cursor.execute(f"PREPARE {name} AS {positional_sql(query)}")
+            conn.prepared.add(name)
+        
+        params = tuple(params or ())
+        args = f" ({', '.join(['%s'] * len(params))})" if params else ""
+        try:
+            cursor.execute(f"EXECUTE {name}{args}", params)
+        except psycopg2.Error as e:
+            # Сервер забыл запрос (например, сессию сбросили) - подготовим заново в следующий раз
+            if e.pgcode == "26000":
+                conn.prepared.discard(name)
+            raise
+        
+        with self._statements_lock:
+            stats["executions"] += 1
+            if prepared_now:
+                stats["prepares"] += 1
+
+    def statement_stats(self):
+        """Счетчики именованных запросов: [(имя, подготовок, повторных использований)]"""
+        with self._statements_lock:
+            return sorted(
+                (name, stats["prepares"], stats["executions"] - stats["prepares"])
+                for name, stats in self.statements.items()
+            )
+
+    def close(self):
+        """Закрывает пул, воркеры и основное соединение"""
+        self._closing.set()
+        self._executor.shutdown(wait=False)
+        with self._pool_lock:
+            if self._pool:
+                self._pool.closeall()
+                self._pool = None
+        if self.is_connected():
+            self.connection.close()
+
+    def _get_pool(self):
+        # Пул создается лениво, при первом фоновом запросе
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, connection_factory=PreparingConnection, **DB_CONFIG
+                )
+            return self._pool
+
+    def _run_pooled(self, query, params, fetch, name, caller=None):
+        pool = self._get_pool()
+        conn = pool.getconn()
+        try:
+            result = self._run_on(conn, query, params, fetch, name, caller)
+            conn.commit()
+            return result
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def _run_on(self, conn, query, params, fetch, name=None, caller=None):
+        cursor = conn.cursor()
+        try:
+            self.execute(cursor, query, params, name, caller)
+            return cursor.fetchall() if fetch else True
+        finally:
+            cursor.close()
+
+
+class DatabaseListener:
+    """Отдельное соединение с LISTEN на канал NOTIFY.
+    Каждое событие (JSON) передается в UI-поток через dispatch(callback, event);
+    при обрыве связи слушатель переподключается сам"""
+
+    def __init__(self, channel, dispatch, callback):
+        self.channel = channel
+        self.dispatch = dispatch
+        self.callback = callback
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen_forever, name="db-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _listen_forever(self):
+        failing = False
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**DB_CONFIG)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {self.channel}")
+                failing = False
+                while not self._stopped.is_set():
+                    # Ждем данных на сокете не дольше секунды, чтобы вовремя заметить stop()
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            event = json.loads(notify.payload)
+                        except ValueError:
+                            continue
+                        self.dispatch(self.callback, event)
+            except Exception as e:
+                # Пока БД недоступна, в лог пишется только первая ошибка
+                if not failing:
+                    logging.error(f"Database listener error: {str(e)}")
+                    failing = True
+                self._stopped.wait(LISTEN_RETRY_S)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+
+class Deferred:
+    """Результат операции, отложенной в офлайн-очередь: ее ключ идемпотентности.
+    Можно передать аргументом следующей отложенной операции (id смены из
+    отложенного start_shift в end_shift) - при досылке он заменится настоящим id"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def __repr__(self):
+        return f"Deferred({self.key!r})"
+
+
+def offline_encode(value):
+    """default для json.dumps аргументов отложенной операции"""
+    if isinstance(value, Deferred):
+        return {"$ref": value.key}
+    if isinstance(value, Decimal):
+        # Цена и суммы - без двоичной плавающей точки по пути в numeric
+        return {"$decimal": str(value)}
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Не сохраняется в офлайн-очередь: {value!r}")
+
+
+def offline_decode(obj):
+    """object_hook для json.loads: ссылки на отложенные операции снова становятся
+    Deferred, сохраненные Decimal - снова Decimal"""
+    if set(obj) == {"$ref"}:
+        return Deferred(obj["$ref"])
+    if set(obj) == {"$decimal"}:
+        return Decimal(obj["$decimal"])
+    return obj
+
+
+class OfflineQueue:
+    """Очередь операций RestaurantService в SQLite на терминале; переживает
+    перезапуск приложения. Каждая запись фиксируется сразу. put() вызывается
+    из UI-потока, досылка (OfflineReplayer) читает очередь из своего потока"""
+
+    def __init__(self, path=OFFLINE_QUEUE_PATH):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS operations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                operation TEXT NOT NULL,
+                arguments TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',  -- pending или rejected
+                error TEXT
+            )
+        """)
+
+    def put(self, operation, arguments):
+        """Добавляет вызов operation(**arguments), возвращает Deferred"""
+        if operation not in OFFLINE_OPERATIONS:
+            raise ValueError(f"Операцию нельзя отложить: {operation}")
+        key = uuid.uuid4().hex
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO operations (key, operation, arguments, created_at) VALUES (?, ?, ?, ?)",
+                (key, operation, json.dumps(arguments, default=offline_encode), datetime.now().isoformat())
+            )
+        return Deferred(key)
+
+    def pending(self, limit=OFFLINE_BATCH_SIZE):
+        """Первые limit ждущих операций в порядке поступления: [(key, operation, arguments)]"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key, operation, arguments FROM operations WHERE status = 'pending' ORDER BY seq LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(key, operation, json.loads(arguments, object_hook=offline_decode)) for key, operation, arguments in rows]
+
+    def pending_count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM operations WHERE status = 'pending'").fetchone()[0]
+
+    def rejected(self):
+        """Отклоненные операции: [(key, operation, arguments, created_at, error)]"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key, operation, arguments, created_at, error FROM operations "
+                "WHERE status = 'rejected' ORDER BY seq"
+            ).fetchall()
+        return [
+            (key, operation, json.loads(arguments, object_hook=offline_decode), created_at, error)
+            for key, operation, arguments, created_at, error in rows
+        ]
+
+    def rejected_count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM operations WHERE status = 'rejected'").fetchone()[0]
+
+    def retry(self, keys):
+        """Возвращает отклоненные операции в очередь; они досылаются на своих местах (по seq)"""
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE operations SET status = 'pending', error = NULL WHERE key = ? AND status = 'rejected'",
+                [(key,) for key in keys]
+            )
+
+    def discard(self, keys):
+        """Удаляет отклоненные операции насовсем"""
+        with self._lock:
+            self.conn.executemany(
+                "DELETE FROM operations WHERE key = ? AND status = 'rejected'", [(key,) for key in keys]
+            )
+
+    def finish(self, applied, rejected):
+        """Убирает дошедшие до БД операции; отклоненные остаются с текстом ошибки"""
+        with self._lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("DELETE FROM operations WHERE key = ?", [(key,) for key in applied])
+            self.conn.executemany(
+                "UPDATE operations SET status = 'rejected', error = ? WHERE key = ?",
+                [(error, key) for key, error in rejected.items()]
+            )
+            self.conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def describe_offline_operation(operation, arguments):
+    """Операция офлайн-очереди для человека: что именно не дошло до БД"""
+    def ref(value):
+        return "(создан без связи)" if isinstance(value, Deferred) else f"№{value}"
+    
+    items = arguments.get("items") or []
+    portions = sum(item["quantity"] for item in items)
+    if operation == "save_order":
+        return f"Новый заказ, стол №{arguments['table_id']}: {len(items)} блюд, {portions} порций"
+    if operation == "add_items_to_order":
+        return f"Дозаказ к заказу {ref(arguments['order_id'])}: {len(items)} блюд, {portions} порций"
+    if operation == "pay_order":
+        return f"Оплата заказа {ref(arguments['order_id'])}"
+    if operation == "close_order":
+        return f"Закрытие заказа {ref(arguments['order_id'])}"
+    if operation == "start_shift":
+        return "Начало смены"
+    return "Окончание смены"
+
+
+class OfflineReplayer:
+    """Досылает OfflineQueue в БД из фонового потока, пачками по OFFLINE_BATCH_SIZE
+    в одной транзакции на своем соединении. Ключ каждой операции пишется в
+    applied_operations той же транзакцией, что и сама операция, поэтому уже
+    дошедшая операция при повторной досылке пропускается. Операция, отклоненная
+    БД или бизнес-правилами, откатывается до своей точки сохранения и остается
+    в очереди со статусом rejected; итог пачки передается в UI-поток:
+    dispatch(callback, {key: результат}, {key: текст ошибки})"""
+
+    def __init__(self, offline_queue, dispatch, callback):
+        self.queue = offline_queue
+        self.dispatch = dispatch
+        self.callback = callback
+        self.db = Database(dispatch)
+        self.service = RestaurantService(self.db)
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._replay_forever, name="offline-replayer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def wake(self):
+        """Попробовать дослать очередь, не дожидаясь OFFLINE_RETRY_S"""
+        self._wakeup.set()
+
+    def _replay_forever(self):
+        failing = False
+        while not self._stopped.is_set():
+            try:
+                while not self._stopped.is_set() and self.replay_batch():
+                    pass
+                failing = False
+            except Exception as e:
+                # Пока БД недоступна, в лог пишется только первая ошибка
+                if not failing:
+                    logging.error(f"Offline queue replay error: {str(e)}")
+                    failing = True
+            self._wakeup.wait(OFFLINE_RETRY_S)
+            self._wakeup.clear()
+        self.db.close()
+
+    def replay_batch(self):
+        """Досылает одну пачку. False - очередь пуста"""
+        batch = self.queue.pending(OFFLINE_BATCH_SIZE)
+        if not batch:
+            return False
+        applied, rejected = {}, {}
+        with self.db.transaction() as cursor:
+            cursor.execute(APPLIED_OPERATIONS_SQL)
+            for key, operation, arguments in batch:
+                cursor.execute("SAVEPOINT offline_operation")
+                try:
+                    result = self.apply(cursor, key, operation, arguments, applied)
+                except Exception as e:
+                    # Обрыв связи прерывает всю пачку: она будет дослана целиком позже.
+                    # Любая другая ошибка (в том числе KeyError/TypeError от устаревших
+                    # аргументов) отклоняет только эту операцию, иначе она навсегда
+                    # заперла бы очередь за собой
+                    if not self.db.is_connected():
+                        raise
+                    cursor.execute("ROLLBACK TO SAVEPOINT offline_operation")
+                    if isinstance(e, (ServiceError, psycopg2.Error)):
+                        rejected[key] = str(e)
+                    else:
+                        rejected[key] = f"Некорректная операция ({type(e).__name__}: {e})"
+                    logging.error(f"Offline operation {operation} {key} rejected: {rejected[key]}")
+                else:
+                    cursor.execute("RELEASE SAVEPOINT offline_operation")
+                    applied[key] = result
+        self.queue.finish(applied, rejected)
+        self.dispatch(self.callback, applied, rejected)
+        return True
+
+    def apply(self, cursor, key, operation, arguments, applied):
+        """Выполняет одну операцию, если ее ключа еще нет в applied_operations"""
+        cursor.execute("""
+            INSERT INTO applied_operations (key, operation) VALUES (%s, %s)
+            ON CONFLICT (key) DO NOTHING
+            RETURNING key
+        """, (key, operation))
+        if cursor.fetchone() is None:
+            cursor.execute("SELECT result_id FROM applied_operations WHERE key = %s", (key,))
+            return cursor.fetchone()[0]
+        
+        arguments = {name: self.resolve(cursor, value, applied) for name, value in arguments.items()}
+        try:
+            result = getattr(self.service, operation)(**arguments)
+        except ActiveOrderExists as e:
+            # Пока терминал был без связи, у гостя на этом столе уже появился заказ
+            result = self.service.add_items_to_order(e.order_id, arguments["items"], arguments.get("cart_id"))
+        
+        cursor.execute(
+            "UPDATE applied_operations SET result_id = %s WHERE key = %s",
+            (result if isinstance(result, int) else None, key)
+        )
+        return result
+
+    def resolve(self, cursor, value, applied):
+        """Deferred -> id, созданный отложенной операцией (в этой пачке или раньше)"""
+        if not isinstance(value, Deferred):
+            return value
+        if value.key in applied:
+            return applied[value.key]
+        cursor.execute("SELECT result_id FROM applied_operations WHERE key = %s", (value.key,))
+        row = cursor.fetchone()
+        if row is None or row[0] is None:
+            raise ServiceError("Не выполнена операция, от которой зависит эта")
+        return row[0]
+
+
+class TreeviewSync:
+    """Инкрементальное обновление строк Treeview по ключу.
+    Трогаются только добавленные, изменившиеся и исчезнувшие строки,
+    поэтому прокрутка и выделение переживают обновление"""
+
+    def __init__(self, tree, key=lambda values: values[0]):
+        self.tree = tree
+        self.key = key
+        self.rows = {}  # iid -> values, как они сейчас показаны
+
+    def apply(self, rows):
+        """Приводит таблицу к rows (кортежи values в нужном порядке)"""
+        tree = self.tree
+        if tree.exists(LOADING_IID):
+            tree.delete(LOADING_IID)
+        
+        new_rows = {}
+        order = []
+        for values in rows:
+            iid = str(self.key(values))
+            new_rows[iid] = tuple(values)
+            order.append(iid)
+        
+        for iid in self.rows:
+            if iid not in new_rows and tree.exists(iid):
+                tree.delete(iid)
+        
+        for index, iid in enumerate(order):
+            values = new_rows[iid]
+            if not tree.exists(iid):
+                tree.insert("", index, iid=iid, values=values)
+            elif self.rows.get(iid) != values:
+                tree.item(iid, values=values)
+        
+        # Переставляем строки, только если порядок действительно изменился
+        if list(tree.get_children()) != order:
+            for index, iid in enumerate(order):
+                tree.move(iid, "", index)
+        
+        self.rows = new_rows
+
+    def upsert(self, values, index=tk.END):
+        """Обновляет одну строку или добавляет ее в позицию index"""
+        tree = self.tree
+        iid = str(self.key(values))
+        values = tuple(values)
+        if tree.exists(iid):
+            if self.rows.get(iid) != values:
+                tree.item(iid, values=values)
+        else:
+            tree.insert("", index, iid=iid, values=values)
+        self.rows[iid] = values
+
+    def remove(self, key):
+        """Удаляет строку с ключом key, если она есть"""
+        iid = str(key)
+        if self.tree.exists(iid):
+            self.tree.delete(iid)
+        self.rows.pop(iid, None)
+
+
+class ReservationIndex:
+    """Брони, сгруппированные по столам в отсортированные интервалы [начало, конец).
+    Интервалы строятся как reservation_period в БД: конец раньше начала - бронь
+    через полночь. Время каждой брони разбирается один раз при построении,
+    а проверка "есть ли бронь на момент" - бинарный поиск по началам интервалов"""
+
+    def __init__(self, reservations):
+        by_table = defaultdict(list)
+        for res_id, table_id, res_date, start_time, end_time in reservations:
+            try:
+                start = self.parse_moment(res_date, start_time)
+                end = self.parse_moment(res_date, end_time)
+            except ValueError as e:
+                print(f"Ошибка при обработке времени бронирования: {e}")
+                continue
+            if end == start:
+                continue  # пустая бронь ничего не занимает
+            if end < start:
+                end += timedelta(days=1)
+            by_table[table_id].append((start, end, res_id))
+        
+        # Для каждого стола: начала интервалов, накопленный максимум окончаний, интервалы
+        self.tables = {}
+        for table_id, intervals in by_table.items():
+            intervals.sort()
+            max_ends = []
+            latest = None
+            for interval in intervals:
+                latest = interval[1] if latest is None or interval[1] > latest else latest
+                max_ends.append(latest)
+            self.tables[table_id] = ([i[0] for i in intervals], max_ends, intervals)
+
+    @staticmethod
+    def parse_moment(res_date, value):
+        """Дата брони + время (строка или time) -> datetime с точностью до минут"""
+        if isinstance(value, str):
+            # Берем только часы и минуты
+            return datetime.strptime(f"{res_date} {value[:5]}", "%Y-%m-%d %H:%M")
+        if isinstance(res_date, str):
+            res_date = datetime.strptime(res_date, "%Y-%m-%d").date()
+        if value.second or value.microsecond:
+            value = value.replace(second=0, microsecond=0)
+        return datetime.combine(res_date, value)
+
+    def active_at(self, table_id, moment):
+        """Бронь стола, действующая в момент moment: (начало, конец, id) или None"""
+        entry = self.tables.get(table_id)
+        if not entry:
+            return None
+        starts, max_ends, intervals = entry
+        i = bisect_right(starts, moment) - 1
+        # Идем назад, пока хоть один из более ранних интервалов может еще длиться
+        while i >= 0 and max_ends[i] >= moment:
+            if intervals[i][1] >= moment:
+                return intervals[i]
+            i -= 1
+        return None
+
+    def free_gap(self, table_id, start, end, opening, closing):
+        """Свободный промежуток стола, в который целиком попадает [start, end):
+        (начало, конец) в пределах [opening, closing) или None, если окно пересекает бронь"""
+        entry = self.tables.get(table_id)
+        if not entry:
+            return min(opening, start), max(closing, end)
+        starts, max_ends, intervals = entry
+        # Брони, начавшиеся до конца окна; окно свободно, если все они закончились к его началу
+        k = bisect_left(starts, end)
+        if k and max_ends[k - 1] > start:
+            return None
+        gap_start = max(opening, max_ends[k - 1]) if k else opening
+        gap_end = min(closing, starts[k]) if k < len(starts) else closing
+        return min(gap_start, start), max(gap_end, end)
+
+
+class TableAllocator:
+    """Подбор стола под бронь на один день.
+    Свободные столы ранжируются по тому, сколько мест пропадет (вместимость - гости),
+    затем по тому, сколько времени стола останется обрывками короче MIN_BOOKING_MINUTES
+    до и после брони. Данные дня загружаются один раз, ранжирование - в памяти,
+    поэтому его можно вызывать на каждое нажатие клавиши"""
+
+    def __init__(self, day, tables, reservations, occupied=()):
+        """reservations - брони, чьи интервалы задевают day и следующие сутки
+        (вчерашние через полночь и завтрашние ранние тоже)"""
+        self.day = day
+        self.tables = sorted(tables)  # (id, вместимость)
+        self.index = ReservationIndex(reservations)
+        self.occupied = set(occupied)  # столы с активным заказом
+
+    def rank(self, guests, start, end):
+        """Подходящие столы [(id, вместимость)], лучший первым"""
+        if end == start:
+            return []
+        if end < start:
+            # Как и reservation_period в БД: конец раньше начала - бронь через полночь
+            end += timedelta(days=1)
+        opening = datetime.combine(self.day, datetime.min.time())
+        closing = opening + timedelta(days=1)
+        min_slot = timedelta(minutes=MIN_BOOKING_MINUTES)
+        
+        ranked = []
+        for table_id, capacity in self.tables:
+            if capacity < guests or table_id in self.occupied:
+                continue
+            gap = self.index.free_gap(table_id, start, end, opening, closing)
+            if gap is None:
+                continue
+            stranded = sum(
+                (piece for piece in (start - gap[0], gap[1] - end) if timedelta(0) < piece < min_slot),
+                timedelta(0)
+            )
+            ranked.append((capacity - guests, stranded, table_id, capacity))
+        ranked.sort()
+        return [(table_id, capacity) for _, _, table_id, capacity in ranked]
+
+    def best(self, guests, start, end):
+        """Лучший стол (id, вместимость) или None"""
+        ranked = self.rank(guests, start, end)
+        return ranked[0] if ranked else None
+
+
+def month_range(month, year):
+    """Полуинтервал [первое число месяца, первое число следующего) для sargable-фильтров"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def available_tables_query(res_date, start_time, end_time):
+    """Запрос столов [(id, вместимость)], свободных от броней на интервал и от активных заказов.
+    Пересечение броней ищется по индексу ограничения reservations_no_overlap"""
+    query = """
+        SELECT t.id, t.capacity
+        FROM tables t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM reservations r
+            WHERE r.table_id = t.id AND r.status = 'active'
+            AND r.period && reservation_period(%s, %s, %s)
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM orders o
+            WHERE o.table_id = t.id AND o.status = 'active'
+        )
+        ORDER BY t.id
+    """
+    return query, (res_date, start_time, end_time)
+
+
+def floor_status_query(moment, table_ids=None):
+    """Запрос состояния зала на момент moment: весь зал или только столы table_ids.
+    Строки: (№ стола, вместимость, есть активный заказ, id брони, конец брони, официант)"""
+    query = """
+        SELECT t.id,
+               t.capacity,
+               EXISTS (
+                   SELECT 1 FROM orders o
+                   WHERE o.table_id = t.id AND o.status = 'active'
+               ) AS occupied,
+               r.id,
+               r.end_time,
+               (SELECT u.full_name
+                FROM waiter_tables wt
+                JOIN users u ON wt.waiter_id = u.id
+                WHERE wt.table_id = t.id
+                LIMIT 1) AS waiter
+        FROM tables t
+        LEFT JOIN LATERAL (
+            SELECT r.id, r.end_time
+            FROM reservations r
+            WHERE r.table_id = t.id AND r.status = 'active'
+            AND r.period @> %(moment)s::timestamp
+            ORDER BY lower(r.period) DESC
+            LIMIT 1
+        ) r ON TRUE
+    """
+    # По period: видна и вчерашняя бронь, которая идет через полночь
+    params = {"moment": moment.replace(second=0, microsecond=0)}
+    if table_ids is not None:
+        query += " WHERE t.id = ANY(%(table_ids)s)"
+        params["table_ids"] = list(table_ids)
+    query += " ORDER BY t.id"
+    return query, params
+
+
+def build_floor_rows(floor_status):
+    """Строки экрана столов из fetch_floor_status: (№, вместимость, статус, бронь, официант)"""
+    rows = []
+    for table_id, capacity, occupied, res_id, res_end, waiter_name in floor_status:
+        reservation_info = ""
+        if res_id is not None:
+            end_time_str = res_end[:5] if isinstance(res_end, str) else res_end.strftime("%H:%M")
+            reservation_info = f"Бронь #{res_id} до {end_time_str}"
+        
+        # Определяем статус стола
+        if occupied:
+            status = "занят (заказ)"
+        elif reservation_info:
+            status = "занят (бронь)"
+        else:
+            status = "свободен"
+        
+        rows.append((
+            table_id,
+            capacity,
+            status,
+            reservation_info,
+            waiter_name or ""
+        ))
+    return rows
+
+
+def sales_stats_query(month, year):
+    """Запрос продаж блюд за месяц из дневных итогов (daily_dish_sales), по диапазону дат.
+    Строки: (категория, блюдо, количество, сумма)"""
+    query = """
+        SELECT dc.name, d.name, SUM(s.quantity), SUM(s.revenue)
+        FROM daily_dish_sales s
+        JOIN dishes d ON s.dish_id = d.id
+        JOIN dish_categories dc ON d.category_id = dc.id
+        WHERE s.day >= %s AND s.day < %s
+        GROUP BY dc.name, d.name
+        HAVING SUM(s.quantity) <> 0
+        ORDER BY dc.name, d.name
+    """
+    return query, month_range(month, year)
+
+
+def build_sales_rows(stats):
+    """Строки вкладки "Продажи блюд": (категория, блюдо, количество, сумма)"""
+    return [
+        (category, dish, quantity, f"{total} руб.")
+        for category, dish, quantity, total in stats
+    ]
+
+
+def sessions_query(start_date, end_date):
+    """Запрос сессий (активных броней) за период.
+    Строки: (клиент, № стола, начало, конец, длительность в минутах)"""
+    query = """
+        SELECT 
+            u.full_name as client,
+            t.id as table_id,
+            r.date + r.start_time as start_time,
+            r.date + r.end_time as end_time,
+            EXTRACT(EPOCH FROM (r.end_time - r.start_time))/60 as duration_min
+        FROM reservations r
+        JOIN users u ON r.client_id = u.id
+        JOIN tables t ON r.table_id = t.id
+        WHERE r.date BETWEEN %s AND %s
+        AND r.status = 'active'
+        ORDER BY r.date DESC, r.start_time DESC
+    """
+    return query, (start_date, end_date)
+
+
+def build_session_rows(stats):
+    """Строки экрана сессий: (клиент, стол, начало, конец, длительность)"""
+    rows = []
+    for client, table, start, end, duration in stats:
+        duration_str = f"{int(duration//60)}ч {int(duration%60)}м" if duration else "0м"
+        rows.append((
+            client,
+            f"№{table}",
+            start.strftime("%Y-%m-%d %H:%M") if isinstance(start, datetime) else start,
+            end.strftime("%Y-%m-%d %H:%M") if isinstance(end, datetime) else end,
+            duration_str
+        ))
+    return rows
+
+
+# Шапка чека: (№ заказа, № стола, клиент, итог, время создания, статус)
+RECEIPT_ORDER_SQL = """
+    SELECT o.id, t.id, c.full_name, o.total, o.created_at, o.status
+    FROM orders o
+    JOIN tables t ON o.table_id = t.id
+    JOIN users c ON o.client_id = c.id
+    WHERE o.id = %s
+"""
+
+# Позиции чека, одинаковые блюда по одной цене сложены: (блюдо, цена, количество, сумма)
+RECEIPT_ITEMS_SQL = """
+    SELECT d.name, oi.price, SUM(oi.quantity) as quantity, 
+        SUM(oi.price * oi.quantity) as total
+    FROM order_items oi
+    JOIN dishes d ON oi.dish_id = d.id
+    WHERE oi.order_id = %s
+    GROUP BY d.name, oi.price
+    ORDER BY d.name
+"""
+
+
+def format_receipt(order, items):
+    """Текст чека из строки RECEIPT_ORDER_SQL и строк RECEIPT_ITEMS_SQL"""
+    receipt = f"""
+            Ресторан "Гурман"
+            ----------------------------
+            Чек №{order[0]}
+            Стол: №{order[1]}
+            Клиент: {order[2]}
+            Дата: {order[4].strftime('%Y-%m-%d %H:%M') if isinstance(order[4], datetime) else order[4]}
+            ----------------------------
+        """
+    
+    for item in items:
+        receipt += f"{item[0]} - {item[1]} руб. x {item[2]} = {item[3]} руб.\n"
+    
+    receipt += f"""
+            ----------------------------
+            Итого: {order[3]} руб.
+            Спасибо за посещение!
+        """
+    
+    return receipt
+
+
+def receipt_history_query(client_id, start_date, end_date):
+    """Заказы клиента за период [start_date, end_date] с составом одной строкой.
+    Строки: (№ заказа, время, сумма, блюда). Состав собирается для каждого заказа
+    отдельно (LATERAL), поэтому строки отдаются по мере чтения, без общей группировки"""
+    query = """
+        SELECT o.id, o.created_at, o.total, items.list
+        FROM orders o
+        CROSS JOIN LATERAL (
+            SELECT STRING_AGG(d.name || ' (' || oi.quantity || 'x' || oi.price || ' руб.)', ', ') AS list
+            FROM order_items oi
+            JOIN dishes d ON oi.dish_id = d.id
+            WHERE oi.order_id = o.id
+        ) items
+        WHERE o.client_id = %s
+        AND o.created_at >= %s AND o.created_at < %s
+        AND items.list IS NOT NULL
+        ORDER BY o.created_at, o.id
+    """
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
+    return query, (client_id, start, end)
+
+
+def format_receipt_history(orders):
+    """Текст истории чеков для пачки строк receipt_history_query"""
+    return "".join(
+        f"Заказ №{order_id} от {created_at.strftime('%Y-%m-%d %H:%M')}\n"
+        f"Блюда: {items}\n"
+        f"Сумма: {total:.2f} руб.\n"
+        + "-" * 50 + "\n"
+        for order_id, created_at, total, items in orders
+    )
+
+
+# Возврат на склад резерва одной корзины
+RELEASE_CART_SQL = """
+    WITH released AS (
+        DELETE FROM stock_holds WHERE cart_id = %s
+        RETURNING dish_id, quantity
+    )
+    UPDATE dishes d
+    SET quantity = d.quantity + released.quantity
+    FROM released
+    WHERE d.id = released.dish_id
+"""
+
+# Возврат на склад всех истекших резервов; строка удаляется один раз,
+# поэтому одновременная уборка с нескольких терминалов ничего не удваивает
+RELEASE_EXPIRED_HOLDS_SQL = """
+    WITH expired AS (
+        DELETE FROM stock_holds WHERE expires_at < LOCALTIMESTAMP
+        RETURNING dish_id, quantity
+    ), per_dish AS (
+        SELECT dish_id, SUM(quantity) AS quantity FROM expired GROUP BY dish_id
+    )
+    UPDATE dishes d
+    SET quantity = d.quantity + per_dish.quantity
+    FROM per_dish
+    WHERE d.id = per_dish.dish_id
+"""
+
+
+MENU_DISHES_SQL = """
+    SELECT d.id, d.name, d.price, d.quantity, d.description, d.category_id, dc.name
+    FROM dishes d
+    JOIN dish_categories dc ON d.category_id = dc.id
+    ORDER BY d.name
+"""
+MENU_CATEGORIES_SQL = "SELECT id, name FROM dish_categories"
+
+
+class MenuCatalog:
+    """Меню в памяти процесса: блюда по id и по названию, категории.
+    Загружается при первом обращении (или заранее, при запуске) и сбрасывается,
+    когда блюда меняются (на этом терминале или, через NOTIFY, на другом)"""
+
+    def __init__(self, execute_query):
+        self.execute_query = execute_query
+        self.loaded = False
+        self.by_id = {}
+        self.by_name = {}
+        self.categories = {}  # название категории -> id
+        self.index = None  # DishSearchIndex, строится при первом поиске
+        self.version = 0  # растет при каждом изменении меню извне (invalidate, update_stock)
+
+    def invalidate(self):
+        self.loaded = False
+        self.version += 1
+
+    def ensure_loaded(self):
+        """Загружает меню, если оно еще не загружено или устарело. False - БД недоступна"""
+        if self.loaded:
+            return True
+        dishes = self.execute_query(MENU_DISHES_SQL, fetch=True)
+        categories = self.execute_query(MENU_CATEGORIES_SQL, fetch=True)
+        if dishes is False or categories is False:
+            return False
+        self.load(dishes, categories)
+        return True
+
+    def load(self, dishes, categories):
+        """Заполняет каталог строками MENU_DISHES_SQL и MENU_CATEGORIES_SQL"""
+        self.by_id = {}
+        for dish_id, name, price, quantity, description, category_id, category in dishes:
+            self.by_id[dish_id] = {
+                "id": dish_id,
+                "name": name,
+                "price": price,
+                "quantity": quantity,
+                "description": description,
+                "category_id": category_id,
+                "category": category,
+            }
+        self.by_name = {dish["name"]: dish for dish in self.by_id.values()}
+        self.categories = {name: category_id for category_id, name in categories}
+        self.index = None
+        self.loaded = True
+
+    def dishes(self):
+        """Все блюда в порядке названий"""
+        self.ensure_loaded()
+        return list(self.by_id.values())
+
+    def dish(self, dish_id):
+        self.ensure_loaded()
+        return self.by_id.get(dish_id)
+
+    def category_ids(self):
+        """Словарь название категории -> id"""
+        self.ensure_loaded()
+        return dict(self.categories)
+
+    def update_stock(self, remaining):
+        """Остатки {dish_id: количество}, только что полученные из БД.
+        Поисковый индекс перестраивается, только если блюдо закончилось или появилось"""
+        self.version += 1
+        for dish_id, quantity in remaining.items():
+            dish = self.by_id.get(dish_id)
+            if dish is None:
+                continue
+            if (dish["quantity"] > 0) != (quantity > 0):
+                self.index = None
+            dish["quantity"] = quantity
+
+    def search_index(self):
+        """Поисковый индекс по блюдам в наличии; перестраивается вместе с меню"""
+        self.ensure_loaded()
+        if self.index is None:
+            self.index = DishSearchIndex(dish for dish in self.by_id.values() if dish["quantity"] > 0)
+        return self.index
+
+
+def search_key(text):
+    """Текст для поиска: без учета регистра и разницы между е/ё"""
+    return (text or "").lower().replace("ё", "е")
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class DishSearchIndex:
+    """Поиск блюд по мере набора. Слова названий и категорий лежат
+    в отсортированном списке (префикс находится бинарным поиском),
+    триграммы слов дают совпадения в середине слова и поиск с опечатками.
+    Меньший ранг - выше в выдаче: начало названия, слово названия,
+    слово категории, подстрока, похожее слово"""
+
+    def __init__(self, dishes):
+        self.dishes = {dish["id"]: dish for dish in dishes}
+        self.names = {dish_id: search_key(dish["name"]) for dish_id, dish in self.dishes.items()}
+        self.order = sorted(self.dishes, key=lambda dish_id: self.names[dish_id])
+        self.position = {dish_id: position for position, dish_id in enumerate(self.order)}
+
+        words = set()
+        self.texts = {}
+        self.by_trigram = defaultdict(set)
+        for dish_id, dish in self.dishes.items():
+            category = search_key(dish["category"])
+            self.texts[dish_id] = f"{self.names[dish_id]} {category}"
+            for rank, text in ((1, self.names[dish_id]), (2, category)):
+                for word in text.split():
+                    words.add((word, rank, dish_id))
+                    for gram in trigrams(word):
+                        self.by_trigram[gram].add(dish_id)
+        self.words = sorted(words)
+        self.keys = [word for word, _, _ in self.words]
+
+    def __len__(self):
+        return len(self.dishes)
+
+    def matches(self, term):
+        """id блюда -> ранг для одного слова запроса"""
+        found = {}
+        start = bisect_left(self.keys, term)
+        stop = bisect_left(self.keys, term + "\uffff", start)
+        for _, rank, dish_id in self.words[start:stop]:
+            if rank < found.get(dish_id, 3):
+                found[dish_id] = rank
+        grams = trigrams(term)
+        if grams:
+            candidates = set.intersection(*(self.by_trigram.get(gram, set()) for gram in grams))
+            for dish_id in candidates:
+                if dish_id not in found and term in self.texts[dish_id]:
+                    found[dish_id] = 3
+        return found
+
+    def similar(self, terms):
+        """Запасной поиск по доле общих триграмм, когда точных совпадений нет"""
+        grams = set().union(*(trigrams(term) for term in terms))
+        hits = defaultdict(int)
+        for gram in grams:
+            for dish_id in self.by_trigram.get(gram, ()):
+                hits[dish_id] += 1
+        threshold = max(1, len(grams) // 2)
+        return {dish_id: 4 + len(grams) - count for dish_id, count in hits.items() if count >= threshold}
+
+    def search(self, text, limit=50):
+        """Блюда, подходящие под набранный текст, лучшие первыми"""
+        query = search_key(text).strip()
+        terms = query.split()
+        if not terms:
+            return [self.dishes[dish_id] for dish_id in self.order[:limit]]
+
+        # Блюдо должно подходить под каждое слово запроса
+        scores = self.matches(terms[0])
+        for term in terms[1:]:
+            found = self.matches(term)
+            scores = {dish_id: rank + found[dish_id] for dish_id, rank in scores.items() if dish_id in found}
+        if not scores:
+            scores = self.similar(terms)
+
+        for dish_id in scores:
+            if self.names[dish_id].startswith(query):
+                scores[dish_id] = 0
+        best = heapq.nsmallest(limit, scores, key=lambda dish_id: (scores[dish_id], self.position[dish_id]))
+        return [self.dishes[dish_id] for dish_id in best]
+
+
+class ServiceError(Exception):
+    """Операция отклонена по бизнес-правилам; текст можно показать пользователю"""
+
+
+class ActiveOrderExists(ServiceError):
+    """На столе уже есть активный заказ этого же пользователя: его можно дополнить"""
+
+    def __init__(self, order_id):
+        super().__init__("У вас уже есть активный заказ на этот стол")
+        self.order_id = order_id
+
+
+class RestaurantService:
+    """Бизнес-операции ресторана без интерфейса.
+    Принимают обычные значения, возвращают результат или бросают исключение:
+    ServiceError - нарушено правило, ошибки psycopg2 - проблема с БД.
+    Экраны RestaurantApp вызывают их же; годятся для скриптов и пакетных задач"""
+
+    def __init__(self, db, menu=None):
+        self.db = db
+        self.menu = menu or MenuCatalog(db.run)
+
+    def fetch(self, query, params=None, name=None):
+        return self.db.run(query, params, fetch=True, name=name)
+
+    # Пользователи и смены
+
+    def authenticate(self, login, password):
+        """Пользователь {"id", "name", "role"} по логину и паролю"""
+        result = self.fetch("""
+            SELECT u.id, u.full_name, r.name as role 
+            FROM users u
+            JOIN roles r ON u.role_id = r.id
+            WHERE u.login = %s AND u.password = %s
+        """, (login, password), name="login_user")
+        if not result:
+            raise ServiceError("Неверный логин или пароль")
+        user_id, full_name, role = result[0]
+        return {"id": user_id, "name": full_name, "role": role}
+
+    def register_client(self, full_name, login, password):
+        """Регистрирует пользователя с ролью "client" (id=3)"""
+        if self.fetch("SELECT id FROM users WHERE login = %s", (login,)):
+            raise ServiceError("Пользователь с таким логином уже существует")
+        result = self.fetch("""
+            INSERT INTO users (login, password, full_name, role_id) 
+            VALUES (%s, %s, %s, 3)
+            RETURNING id
+        """, (login, password, full_name))
+        return result[0][0]
+
+    def start_shift(self, waiter_id, at=None):
+        """Открывает смену, возвращает ее id. at - время начала (по умолчанию сейчас)"""
+        result = self.fetch("""
+            INSERT INTO shifts (waiter_id, start_time) 
+            VALUES (%s, COALESCE(%s::timestamp, LOCALTIMESTAMP))
+            RETURNING id
+        """, (waiter_id, at))
+        return result[0][0]
+
+    def end_shift(self, waiter_id, shift_id, at=None):
+        """Закрывает смену и начисляет чаевые (10% от оплаченных за смену заказов).
+        Возвращает сумму чаевых. at - время окончания (по умолчанию сейчас)"""
+        result = self.fetch("""
+            UPDATE shifts s
+            SET end_time = v.at,
+                tips = (
+                    SELECT COALESCE(SUM(o.total * 0.1), 0)
+                    FROM orders o
+                    WHERE o.waiter_id = %s
+                    AND o.created_at BETWEEN s.start_time AND v.at
+                    AND o.status = 'paid'
+                )
+            FROM (SELECT COALESCE(%s::timestamp, LOCALTIMESTAMP) AS at) v
+            WHERE s.id = %s
+            RETURNING s.tips
+        """, (waiter_id, at, shift_id))
+        if not result:
+            raise ServiceError("Смена не найдена")
+        return float(result[0][0] or 0)
+
+    def waiters(self):
+        """Официанты: [(id, имя)] по алфавиту"""
+        return self.fetch("""
+            SELECT u.id, u.full_name 
+            FROM users u
+            WHERE u.role_id = 2  -- Официанты
+            ORDER BY u.full_name
+        """)
+
+    def assign_waiter(self, table_id, waiter_id):
+        """Закрепляет за столом одного официанта вместо прежних"""
+        with self.db.transaction() as cursor:
+            cursor.execute("DELETE FROM waiter_tables WHERE table_id = %s", (table_id,))
+            cursor.execute(
+                "INSERT INTO waiter_tables (waiter_id, table_id) VALUES (%s, %s)",
+                (waiter_id, table_id)
+            )
+
+    # Бронирования
+
+    def available_tables(self, res_date, start_time, end_time):
+        """Столы [(id, вместимость)], свободные от броней на интервал и от активных заказов"""
+        query, params = available_tables_query(res_date, start_time, end_time)
+        return self.fetch(query, params, name="available_tables")
+
+    def table_allocator(self, res_date):
+        """TableAllocator на дату res_date (date или "ГГГГ-ММ-ДД"): столы, брони дня и занятые столы"""
+        if isinstance(res_date, str):
+            res_date = datetime.strptime(res_date, "%Y-%m-%d").date()
+        tables = self.fetch("""
+            SELECT t.id, t.capacity,
+                   EXISTS (
+                       SELECT 1 FROM orders o
+                       WHERE o.table_id = t.id AND o.status = 'active'
+                   )
+            FROM tables t
+        """, name="tables_with_occupancy")
+        # Брони, задевающие сутки res_date и следующие: вчерашние через полночь
+        # и ранние завтрашние, на которые может наехать бронь через полночь
+        reservations = self.fetch("""
+            SELECT id, table_id, date, start_time, end_time
+            FROM reservations
+            WHERE status = 'active'
+            AND period && tsrange(%s::timestamp, %s::timestamp + interval '2 days')
+        """, (res_date, res_date), name="reservations_around_day")
+        return TableAllocator(
+            res_date,
+            [(table_id, capacity) for table_id, capacity, _ in tables],
+            reservations,
+            occupied=[table_id for table_id, _, occupied in tables if occupied],
+        )
+
+    def make_reservation(self, client_id, res_date, start_time, end_time, guests, table_id):
+        """Бронирует стол с проверкой вместимости и занятости, возвращает id брони.
+        Проверки и вставка - один запрос; одновременную бронь того же стола с другого
+        терминала отсекает ограничение reservations_no_overlap"""
+        try:
+            result = self.fetch("""
+                WITH t AS (
+                    SELECT id, capacity FROM tables WHERE id = %(table_id)s
+                ), busy AS (
+                    SELECT
+                        EXISTS (
+                            SELECT 1 FROM reservations r
+                            WHERE r.table_id = %(table_id)s AND r.status = 'active'
+                            AND r.period && reservation_period(%(date)s, %(start)s, %(end)s)
+                        ) AS reserved,
+                        EXISTS (
+                            SELECT 1 FROM orders o
+                            WHERE o.table_id = %(table_id)s AND o.status = 'active'
+                        ) AS occupied
+                ), ins AS (
+                    INSERT INTO reservations 
+                    (date, start_time, end_time, guests, table_id, client_id, status) 
+                    SELECT %(date)s::date, %(start)s::time, %(end)s::time, %(guests)s, t.id, %(client_id)s, 'active'
+                    FROM t, busy
+                    WHERE t.capacity >= %(guests)s AND NOT busy.reserved AND NOT busy.occupied
+                    RETURNING id
+                )
+                SELECT (SELECT id FROM ins), (SELECT capacity FROM t), busy.reserved, busy.occupied
+                FROM busy
+            """, {
+                "table_id": table_id, "date": res_date, "start": start_time, "end": end_time,
+                "guests": guests, "client_id": client_id,
+            })
+        except psycopg2.Error as e:
+            # Бронь с другого терминала успела раньше
+            if e.pgcode == "23P01":
+                raise ServiceError("Стол уже забронирован на это время") from e
+            if e.pgcode == "23514" and e.diag.constraint_name == "reservations_not_empty":
+                raise ServiceError("Время окончания брони совпадает со временем начала") from e
+            raise
+        
+        reservation_id, capacity, reserved, occupied = result[0]
+        if reservation_id is not None:
+            return reservation_id
+        if capacity is None:
+            raise ServiceError("Стол не найден")
+        if guests > capacity:
+            raise ServiceError(f"Стол №{table_id} вмещает только {capacity} гостей")
+        if reserved:
+            raise ServiceError("Стол уже забронирован на это время")
+        raise ServiceError("Стол занят активным заказом")
+
+    def import_reservations(self, records, default_client_id=None):
+        """Массовый импорт броней: записи [(№ строки, dict)] из read_reservation_file.
+        Строки загружаются во временную таблицу через COPY, проверяются одним
+        проходом против reservations и друг против друга и вставляются одной
+        транзакцией. Возвращает {"inserted": число, "rejected": [(№ строки, причина)]}"""
+        rejected = []
+        staged = io.StringIO()
+        writer = csv.writer(staged)
+        for line, record in records:
+            try:
+                writer.writerow((line,) + parse_reservation_record(record, default_client_id))
+            except ValueError as e:
+                rejected.append((line, str(e)))
+        staged.seek(0)
+        
+        with self.db.transaction() as cursor:
+            # Новые брони с терминалов подождут конца импорта: проверки остаются верными до вставки
+            cursor.execute("LOCK TABLE reservations IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute("""
+                CREATE TEMP TABLE reservation_import (
+                    line integer PRIMARY KEY,
+                    date date NOT NULL,
+                    start_time time NOT NULL,
+                    end_time time NOT NULL,
+                    guests integer NOT NULL,
+                    table_id integer NOT NULL,
+                    client_id integer NOT NULL,
+                    period tsrange GENERATED ALWAYS AS (reservation_period(date, start_time, end_time)) STORED,
+                    reason text
+                ) ON COMMIT DROP
+            """)
+            cursor.copy_expert("""
+                COPY reservation_import (line, date, start_time, end_time, guests, table_id, client_id)
+                FROM STDIN WITH (FORMAT csv)
+            """, staged)
+            cursor.execute("CREATE INDEX ON reservation_import USING gist (table_id, period)")
+            cursor.execute("ANALYZE reservation_import")
+            
+            # Проверки против справочников и существующих броней
+            cursor.execute("""
+                UPDATE reservation_import i
+                SET reason = CASE
+                    WHEN t.id IS NULL THEN 'стол не найден'
+                    WHEN u.id IS NULL THEN 'клиент не найден'
+                    WHEN i.guests > t.capacity THEN 'стол вмещает только ' || t.capacity || ' гостей'
+                    WHEN EXISTS (
+                        SELECT 1 FROM reservations r
+                        WHERE r.table_id = i.table_id AND r.status = 'active'
+                        AND r.period && i.period
+                    ) THEN 'стол уже забронирован на это время'
+                END
+                FROM reservation_import s
+                LEFT JOIN tables t ON t.id = s.table_id
+                LEFT JOIN users u ON u.id = s.client_id
+                WHERE s.line = i.line
+            """)
+            # Пересечения внутри файла: строки разбираются по порядку, и каждая
+            # сравнивается только с уже принятыми - отклоненная строка не тянет
+            # за собой следующие, которые пересекались только с ней
+            cursor.execute("""
+                SELECT line, table_id, lower(period), upper(period)
+                FROM reservation_import
+                WHERE reason IS NULL
+                ORDER BY line
+            """)
+            conflicts = self.import_conflicts(cursor.fetchall())
+            if conflicts:
+                psycopg2.extras.execute_values(cursor, """
+                    UPDATE reservation_import i
+                    SET reason = 'пересекается со строкой ' || c.first_line
+                    FROM (VALUES %s) AS c (line, first_line)
+                    WHERE i.line = c.line
+                """, conflicts)
+            
+            cursor.execute("""
+                INSERT INTO reservations 
+                (date, start_time, end_time, guests, table_id, client_id, status) 
+                SELECT date, start_time, end_time, guests, table_id, client_id, 'active'
+                FROM reservation_import
+                WHERE reason IS NULL
+                ORDER BY line
+            """)
+            inserted = cursor.rowcount
+            cursor.execute("SELECT line, reason FROM reservation_import WHERE reason IS NOT NULL")
+            rejected.extend(cursor.fetchall())
+        
+        rejected.sort()
+        return {"inserted": inserted, "rejected": rejected}
+
+    @staticmethod
+    def import_conflicts(rows):
+        """Жадный отбор броней файла: rows [(строка, стол, начало, конец)] по порядку
+        строк; бронь принимается, если не пересекает уже принятые на том же столе.
+        Возвращает [(строка, первая принятая строка, с которой она пересекается)]"""
+        kept = defaultdict(list)  # стол -> принятые брони [(начало, конец, строка)] по началу
+        conflicts = []
+        for line, table_id, start, end in rows:
+            intervals = kept[table_id]
+            # Принятые брони не пересекаются между собой: с новой могут пересечься
+            # только предыдущая по началу и идущие следом, начатые до ее конца
+            position = bisect_left(intervals, (start,))
+            overlapping = []
+            if position and intervals[position - 1][1] > start:
+                overlapping.append(intervals[position - 1][2])
+            for other_start, _, other in intervals[position:]:
+                if other_start >= end:
+                    break
+                overlapping.append(other)
+            if overlapping:
+                conflicts.append((line, min(overlapping)))
+            else:
+                intervals.insert(position, (start, end, line))
+        return conflicts
+
+    # Заказы
+
+    def save_order(self, user, table_id, items, cart_id=None, at=None):
+        """Создает заказ user на столе table_id из позиций items
+        ({"dish_id", "quantity", "price"}), возвращает id заказа.
+        cart_id - корзина, под которую порции уже зарезервированы (hold_stock),
+        at - время приема заказа (по умолчанию сейчас).
+        Если у user уже есть активный заказ на этом столе - ActiveOrderExists"""
+        if not items:
+            raise ServiceError("Добавьте хотя бы одно блюдо")
+        table = self.fetch("SELECT capacity FROM tables WHERE id = %s", (table_id,), name="table_capacity")
+        if not table:
+            raise ServiceError("Стол не найден")
+        
+        # Стол не должен быть занят другим заказом
+        active_order = self.fetch("""
+            SELECT id, client_id FROM orders 
+            WHERE table_id = %s AND status = 'active'
+        """, (table_id,), name="active_order_owner")
+        if active_order:
+            # Свой активный заказ на этом столе можно дополнить
+            if active_order[0][1] != user["id"]:
+                raise ServiceError("Стол уже занят другим заказом")
+            raise ActiveOrderExists(active_order[0][0])
+        
+        # Стол, забронированный сейчас, клиент может занять только по своей брони
+        active_reservation = self.fetch("""
+            SELECT id FROM reservations 
+            WHERE table_id = %s AND status = 'active'
+            AND date = CURRENT_DATE
+            AND start_time <= CURRENT_TIME AND end_time >= CURRENT_TIME
+        """, (table_id,), name="current_reservation")
+        if active_reservation and user["role"] == "client":
+            owner_reservation = self.fetch("""
+                SELECT id FROM reservations 
+                WHERE table_id = %s AND status = 'active'
+                AND date = CURRENT_DATE
+                AND start_time <= CURRENT_TIME AND end_time >= CURRENT_TIME
+                AND client_id = %s
+            """, (table_id, user["id"]), name="current_reservation_of_client")
+            if not owner_reservation:
+                raise ServiceError("Стол забронирован другим клиентом")
+        
+        if user["role"] == "client":
+            # Для клиента - официант, закрепленный за столом
+            waiter = self.fetch("""
+                SELECT waiter_id FROM waiter_tables 
+                WHERE table_id = %s LIMIT 1
+            """, (table_id,), name="table_waiter")
+            if not waiter:
+                raise ServiceError("Не найден официант для этого стола")
+            waiter_id = waiter[0][0]
+        else:
+            # Официант/админ обслуживает заказ сам
+            waiter_id = user["id"]
+        
+        # Заказ, его позиции и списание со склада - одна транзакция.
+        # Сумму заказа набирают триггеры order_items_total_* (order_total_apply_lines)
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO orders 
+                (table_id, client_id, waiter_id, status, total, created_at) 
+                VALUES (%s, %s, %s, 'active', 0, COALESCE(%s::timestamp, LOCALTIMESTAMP))
+                RETURNING id
+            """, (table_id, user["id"], waiter_id, at))
+            order_id = cursor.fetchone()[0]
+            self.write_order_lines(cursor, order_id, items)
+            self.claim_stock(cursor, cart_id, items)
+        return order_id
+
+    def add_items_to_order(self, order_id, items, cart_id=None):
+        """Добавляет позиции к активному заказу; сумму пересчитывает триггер в БД.
+        Оплаченный или закрытый заказ (например, другим терминалом, пока операция
+        ждала в офлайн-очереди) не меняется: операция отклоняется"""
+        with self.db.transaction() as cursor:
+            # Блокировка строки заказа: оплата с другого терминала дождется конца добавления
+            cursor.execute("SELECT status FROM orders WHERE id = %s FOR UPDATE", (order_id,))
+            current = cursor.fetchone()
+            if current is None:
+                raise ServiceError(f"Заказ №{order_id} не найден")
+            if current[0] != "active" or not self.write_order_lines(cursor, order_id, items):
+                raise ServiceError(f"Заказ №{order_id} уже в статусе {current[0]}: позиции не добавлены")
+            self.claim_stock(cursor, cart_id, items)
+        return order_id
+
+    def write_order_lines(self, cursor, order_id, items):
+        """Записывает позиции заказа одной многострочной вставкой на любую длину
+        корзины; блюдо, уже имеющееся в заказе, прибавляется к своей строке.
+        Возвращает число записанных строк (0 - заказа нет или он уже не активен).
+        Склад списывает claim_stock"""
+        lines = {}
+        for item in items:
+            if item["dish_id"] in lines:
+                lines[item["dish_id"]][2] += item["quantity"]
+            else:
+                lines[item["dish_id"]] = [order_id, item["dish_id"], item["quantity"], item["price"]]
+        rows = [tuple(line) for line in lines.values()]
+        if not rows:
+            return 0
+        
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO order_items AS oi (order_id, dish_id, quantity, price)
+            SELECT v.order_id, v.dish_id, v.quantity, v.price
+            FROM (VALUES %s) AS v (order_id, dish_id, quantity, price)
+            JOIN orders o ON o.id = v.order_id AND o.status = 'active'
+            ON CONFLICT (order_id, dish_id) DO UPDATE
+            SET quantity = oi.quantity + EXCLUDED.quantity
+        """, rows, page_size=len(rows))
+        return cursor.rowcount
+
+    # Склад
+
+    def take_stock(self, cursor, lines):
+        """Списывает со склада порции {dish_id: количество} одним запросом.
+        Строка блюда уменьшается, только если порций хватает, поэтому два терминала
+        не продадут последние порции дважды. Не хватило хотя бы одного блюда -
+        ServiceError, и транзакция откатывает списание целиком. Возвращает {dish_id: остаток}"""
+        if not lines:
+            return {}
+        psycopg2.extras.execute_values(cursor, """
+            WITH v (dish_id, quantity) AS (VALUES %s),
+            taken AS (
+                UPDATE dishes d
+                SET quantity = d.quantity - v.quantity
+                FROM v
+                WHERE d.id = v.dish_id AND d.quantity >= v.quantity
+                RETURNING d.id, d.quantity
+            )
+            SELECT v.dish_id, d.name, d.quantity, taken.quantity
+            FROM v
+            LEFT JOIN dishes d ON d.id = v.dish_id
+            LEFT JOIN taken ON taken.id = v.dish_id
+        """, sorted(lines.items()), page_size=len(lines))
+        rows = cursor.fetchall()
+        
+        shortages = [
+            f"'{name}' (доступно: {available})" if name is not None else f"блюдо №{dish_id} не найдено"
+            for dish_id, name, available, remaining in rows if remaining is None
+        ]
+        if shortages:
+            raise ServiceError("Недостаточно порций: " + ", ".join(shortages))
+        return {dish_id: remaining for dish_id, _, _, remaining in rows}
+
+    def hold_stock(self, cart_id, items):
+        """Резервирует порции под корзину cart_id: они сразу списываются со склада
+        и числятся в stock_holds еще CART_HOLD_MINUTES. Возвращает {dish_id: остаток}"""
+        lines = cart_lines(items)
+        with self.db.transaction() as cursor:
+            remaining = self.take_stock(cursor, lines)
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO stock_holds AS h (cart_id, dish_id, quantity, expires_at)
+                SELECT v.cart_id, v.dish_id, v.quantity, LOCALTIMESTAMP
+                FROM (VALUES %s) AS v (cart_id, dish_id, quantity)
+                ON CONFLICT (cart_id, dish_id) DO UPDATE
+                SET quantity = h.quantity + EXCLUDED.quantity
+            """, [(cart_id, dish_id, quantity) for dish_id, quantity in lines.items()], page_size=len(lines))
+            # Пока с корзиной работают, резерв продлевается целиком
+            cursor.execute(
+                "UPDATE stock_holds SET expires_at = LOCALTIMESTAMP + %s * interval '1 minute' WHERE cart_id = %s",
+                (CART_HOLD_MINUTES, cart_id)
+            )
+        self.menu.update_stock(remaining)
+        return remaining
+
+    def claim_stock(self, cursor, cart_id, items):
+        """Списание под заказ внутри его транзакции: резерв корзины переходит
+        в заказ, недостающее (резерв истек или его не было) списывает take_stock,
+        лишнее возвращается на склад"""
+        lines = cart_lines(items)
+        held = {}
+        if cart_id is not None:
+            cursor.execute("DELETE FROM stock_holds WHERE cart_id = %s RETURNING dish_id, quantity", (cart_id,))
+            held = dict(cursor.fetchall())
+        
+        surplus = [
+            (dish_id, quantity - lines.get(dish_id, 0))
+            for dish_id, quantity in held.items() if quantity > lines.get(dish_id, 0)
+        ]
+        if surplus:
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE dishes d
+                SET quantity = d.quantity + v.quantity
+                FROM (VALUES %s) AS v (dish_id, quantity)
+                WHERE d.id = v.dish_id
+            """, surplus, page_size=len(surplus))
+        self.take_stock(cursor, {
+            dish_id: quantity - held.get(dish_id, 0)
+            for dish_id, quantity in lines.items() if quantity > held.get(dish_id, 0)
+        })
+        # Остатки в каталоге меню устарели
+        self.menu.invalidate()
+
+    def release_stock(self, cart_id):
+        """Возвращает на склад резерв брошенной корзины"""
+        self.db.run(RELEASE_CART_SQL, (cart_id,))
+        self.menu.invalidate()
+
+    def release_expired_holds(self):
+        """Возвращает на склад резервы корзин, с которыми давно не работали"""
+        self.db.run(RELEASE_EXPIRED_HOLDS_SQL)
+        self.menu.invalidate()
+
+    def set_order_status(self, order_id, status, expected_status=None):
+        """Оплачивает или закрывает заказ; в той же транзакции сохраняет его чек.
+        expected_status - статус, который видел оператор: если заказ тем временем
+        изменили (например, пока операция ждала в офлайн-очереди), она отклоняется"""
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE orders SET status = %(status)s
+                WHERE id = %(id)s AND (%(expected)s::text IS NULL OR status = %(expected)s)
+                RETURNING id
+            """, {"status": status, "id": order_id, "expected": expected_status})
+            if not cursor.fetchone():
+                cursor.execute("SELECT status FROM orders WHERE id = %s", (order_id,))
+                current = cursor.fetchone()
+                if current is None:
+                    raise ServiceError(f"Заказ №{order_id} не найден")
+                raise ServiceError(f"Заказ №{order_id} уже в статусе {current[0]}: операция устарела")
+            self.render_receipt(cursor, order_id)
+
+    def pay_order(self, order_id, expected_status="active"):
+        self.set_order_status(order_id, "paid", expected_status)
+
+    def close_order(self, order_id, expected_status=None):
+        self.set_order_status(order_id, "closed", expected_status)
+
+    def render_receipt(self, cursor, order_id):
+        """Собирает чек из заказа и позиций; чек оплаченного/закрытого заказа
+        записывается в receipts (до изменения его позиций). None - заказа нет"""
+        cursor.execute(RECEIPT_ORDER_SQL, (order_id,))
+        order = cursor.fetchone()
+        if order is None:
+            return None
+        cursor.execute(RECEIPT_ITEMS_SQL, (order_id,))
+        body = format_receipt(order, cursor.fetchall())
+        if order[5] in ("paid", "closed"):
+            cursor.execute(
+                "INSERT INTO receipts (order_id, body) VALUES (%s, %s) ON CONFLICT (order_id) DO NOTHING",
+                (order_id, body)
+            )
+        return body
+
+    def generate_receipt(self, order_id):
+        """Текст чека или None, если заказа нет.
+        Для оплаченного/закрытого заказа - одно чтение из receipts по ключу"""
+        cached = self.fetch("SELECT body FROM receipts WHERE order_id = %s", (order_id,), name="receipt_by_order")
+        if cached:
+            return cached[0][0]
+        # Активный заказ или заказ, оплаченный до появления кэша
+        with self.db.transaction() as cursor:
+            return self.render_receipt(cursor, order_id)
+
+    def mark_receipt_printed(self, order_id):
+        self.db.run("UPDATE orders SET receipt_printed = TRUE WHERE id = %s", (order_id,))
+
+    # Меню
+
+    def add_dish(self, name, category_id, price, quantity, description=""):
+        validate_dish(name, category_id, price, quantity)
+        self.db.run("""
+            INSERT INTO dishes 
+            (name, category_id, price, quantity, description) 
+            VALUES (%s, %s, %s, %s, %s)
+        """, (name, category_id, price, quantity, description))
+        self.menu.invalidate()
+
+    def update_dish(self, dish_id, name, category_id, price, quantity, description=""):
+        validate_dish(name, category_id, price, quantity)
+        self.db.run("""
+            UPDATE dishes 
+            SET name = %s, category_id = %s, price = %s, 
+                quantity = %s, description = %s
+            WHERE id = %s
+        """, (name, category_id, price, quantity, description, dish_id))
+        self.menu.invalidate()
+
+    def delete_dish(self, dish_id):
+        """Удаляет блюдо, если его нет ни в одном заказе"""
+        result = self.fetch("SELECT COUNT(*) FROM order_items WHERE dish_id = %s", (dish_id,))
+        if result and result[0][0] > 0:
+            raise ServiceError("Блюдо нельзя удалить, так как оно есть в заказах")
+        self.db.run("DELETE FROM dishes WHERE id = %s", (dish_id,))
+        self.menu.invalidate()
+
+
+def cart_lines(items):
+    """Позиции корзины -> {dish_id: суммарное количество}"""
+    lines = defaultdict(int)
+    for item in items:
+        lines[item["dish_id"]] += item["quantity"]
+    return dict(lines)
+
+
+def validate_dish(name, category_id, price, quantity):
+    if not name or price <= 0 or quantity < 0:
+        raise ServiceError("Заполните все обязательные поля корректно")
+    if not category_id:
+        raise ServiceError("Выберите корректную категорию")
+
+
+# Поля файла импорта броней (заголовок CSV или ключи объектов JSON)
+RESERVATION_IMPORT_FIELDS = ("date", "start_time", "end_time", "guests", "table_id", "client_id")
+
+
+def read_reservation_file(path):
+    """Записи файла броней: CSV с заголовком или JSON-массив объектов.
+    Возвращает [(№ строки файла, dict)] - номер попадает в отчет об отказах"""
+    try:
+        if path.lower().endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                records = json.load(f)
+            if not isinstance(records, list):
+                raise ServiceError("JSON должен содержать массив броней")
+            return list(enumerate(records, 1))
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            # Строка 1 - заголовок
+            return list(enumerate(csv.DictReader(f), 2))
+    except (OSError, ValueError, csv.Error) as e:
+        raise ServiceError(f"Не удалось прочитать файл: {e}") from e
+
+
+def parse_reservation_record(record, default_client_id=None):
+    """Запись файла -> (дата, начало, конец, гостей, стол, клиент); ValueError с причиной"""
+    if not isinstance(record, dict):
+        raise ValueError("запись должна быть объектом")
+    values = {field: str(record.get(field) or "").strip() for field in RESERVATION_IMPORT_FIELDS}
+    missing = [field for field in RESERVATION_IMPORT_FIELDS[:5] if not values[field]]
+    if missing:
+        raise ValueError(f"не заполнено: {', '.join(missing)}")
+    try:
+        res_date = datetime.strptime(values["date"], "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"некорректная дата {values['date']!r}") from None
+    try:
+        start_time = datetime.strptime(values["start_time"][:5], "%H:%M").time()
+        end_time = datetime.strptime(values["end_time"][:5], "%H:%M").time()
+    except ValueError:
+        raise ValueError("некорректное время") from None
+    if start_time == end_time:
+        raise ValueError("время окончания совпадает со временем начала")
+    try:
+        guests = int(values["guests"])
+        table_id = int(values["table_id"])
+        client_id = int(values["client_id"]) if values["client_id"] else default_client_id
+    except ValueError:
+        raise ValueError("гости, стол и клиент должны быть числами") from None
+    if guests <= 0:
+        raise ValueError("число гостей должно быть положительным")
+    if client_id is None:
+        raise ValueError("не указан клиент")
+    return res_date, start_time, end_time, guests, table_id, client_id
+
+
+def write_rejection_report(path, rejected):
+    """Отчет об отказах импорта: CSV (строка файла, причина)"""
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("line", "reason"))
+        writer.writerows(rejected)
+
 
 class RestaurantApp:
     def __init__(self, root):
@@ -18,14 +2424,99 @@ class RestaurantApp:
         # Глобальная обработка исключений
         sys.excepthook = lambda e, v, t: self.handle_exception(e, v, t)
         
-        # Подключение к БД
-        self.db_connection = self.connect_to_db()
+        # Результаты фоновых запросов возвращаются в UI-поток через очередь
+        self.ui_queue = queue.Queue()
+        self.pending_requests = {}  # виджет -> токен последнего фонового запроса
+        self.root.after(UI_POLL_MS, self.process_ui_queue)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Подключение к БД - в фоне, после того как окно нарисовано
+        self.db = Database(self.post_to_ui)
+        self.menu = MenuCatalog(self.execute_query)
+        self.service = RestaurantService(self.db, self.menu)
+        self.db_status = "connecting"  # connecting / online / offline
+        self.warming_up = False  # идет фоновое подключение (connect_in_background)
         self.current_user = None
         self.current_order = None
         self.current_shift = None  # Текущая смена для официанта
         
+        # Изменения с других терминалов приходят через LISTEN/NOTIFY
+        self.tables_refresh_ids = set()
+        self.menu_refresh_pending = False
+        self.listener = DatabaseListener(NOTIFY_CHANNEL, self.post_to_ui, self.on_db_event)
+        self.listener.start()
+        
+        # Операции, принятые без связи с БД, досылаются в фоне
+        self.offline = OfflineQueue()
+        self.replayer = OfflineReplayer(self.offline, self.post_to_ui, self.on_offline_replayed)
+        self.replayer.start()
+        self.root.after(HOLD_SWEEP_MS, self.sweep_stock_holds)
+        
         self.create_widgets()
         self.show_login_screen()
+        self.connect_in_background()
+        self.root.after(STATUS_POLL_MS, self.poll_connection_status)
+    
+    def connect_in_background(self):
+        """Подключение к БД, служебная схема и прогрев меню - на воркере.
+        Окно уже работает, индикатор внизу показывает состояние связи"""
+        if self.warming_up:
+            return
+        self.warming_up = True
+        self.set_db_status("connecting")
+        menu_version = self.menu.version
+        self.db.run_in_background(
+            lambda: self.db.warm_up((MENU_DISHES_SQL, MENU_CATEGORIES_SQL)),
+            lambda warmed: self.on_db_ready(warmed, menu_version), self.on_db_unavailable, "startup warm-up"
+        )
+    
+    def on_db_ready(self, warmed, menu_version):
+        self.warming_up = False
+        dishes, categories = warmed
+        # Меню, изменившееся после чтения (NOTIFY), каталог загрузит сам при обращении
+        if self.menu.version == menu_version:
+            self.menu.load(dishes, categories)
+        self.set_db_status("online")
+        self.replayer.wake()
+        if self.db.schema_errors:
+            # Без этих объектов часть гарантий (например, запрет пересечения броней) не действует
+            messagebox.showwarning("Схема БД", "Не удалось подготовить базу данных:\n\n"
+                                   + "\n\n".join(self.db.schema_errors)
+                                   + "\n\nПодробности - в app.log.")
+    
+    def on_db_unavailable(self, error):
+        # Без модального окна: терминал работает офлайн и пробует снова
+        self.warming_up = False
+        self.set_db_status("offline")
+        self.root.after(STARTUP_RETRY_MS, self.connect_in_background)
+    
+    def set_db_status(self, status):
+        self.db_status = status
+        self.update_status_bar()
+    
+    def poll_connection_status(self):
+        """Обрыв основного соединения замечается по его флагу, без запросов к БД"""
+        if self.db_status != "connecting":
+            self.db_status = "online" if self.db.is_connected() else "offline"
+        self.update_status_bar()
+        self.root.after(STATUS_POLL_MS, self.poll_connection_status)
+    
+    def update_status_bar(self):
+        text, color = {
+            "connecting": ("● БД: подключение...", "gray"),
+            "online": ("● БД: на связи", "green"),
+            "offline": ("● БД: нет связи", "red"),
+        }[self.db_status]
+        pending = self.offline.pending_count()
+        if pending:
+            text += f"   Не отправлено операций: {pending}"
+        rejected = self.offline.rejected_count()
+        if rejected:
+            text += f"   Отклонено операций: {rejected} (нажмите, чтобы разобрать)"
+            color = "red"
+        if self.db.schema_errors:
+            text += f"   Ошибок схемы БД: {len(self.db.schema_errors)} (см. app.log)"
+        self.status_bar.config(text=text, foreground=color)
     
     def handle_exception(self, exc, val, tb):
         """Глобальный обработчик исключений"""
@@ -34,18 +2525,118 @@ class RestaurantApp:
         import traceback
         traceback.print_exception(exc, val, tb)
 
+    def on_close(self):
+        """Закрывает соединения с БД и окно приложения"""
+        if self.current_order and self.current_order["items"]:
+            try:
+                self.service.release_stock(self.current_order["cart_id"])
+            except Exception as e:
+                logging.error(f"Error releasing cart on close: {str(e)}")
+        self.listener.stop()
+        self.replayer.stop()
+        self.db.close()
+        self.root.destroy()
+
+    def post_to_ui(self, callback, *args):
+        """Ставит вызов в очередь UI-потока (можно вызывать из любого потока)"""
+        self.ui_queue.put((callback, args))
+
+    def process_ui_queue(self):
+        """Выполняет в UI-потоке колбэки, пришедшие из фоновых запросов"""
+        try:
+            while True:
+                callback, args = self.ui_queue.get_nowait()
+                callback(*args)
+        except queue.Empty:
+            pass
+        finally:
+            self.root.after(UI_POLL_MS, self.process_ui_queue)
+
+    def on_db_event(self, event):
+        """Изменение данных на другом терминале: точечно обновляет открытый экран"""
+        table = event.get("table")
+        # Каталог меню живет и до входа (его прогревает запуск)
+        if table == "dishes" and "stock" in event:
+            # Изменился только остаток: каталог и поиск остаются в памяти
+            self.menu.update_stock({event["id"]: event["stock"]})
+        elif table in ("dishes", "dish_categories"):
+            self.menu.invalidate()
+        if not self.current_user:
+            return
+        # Спрятанные экраны не обновляются, а помечаются устаревшими
+        self.mark_screens_stale(table)
+        if table in ("orders", "reservations", "waiter_tables") and self.is_visible("tables_tree"):
+            for table_id in (event.get("table_id"), event.get("old_table_id")):
+                if table_id is not None:
+                    self.schedule_tables_refresh(table_id)
+        if table == "orders" and event.get("id") is not None and self.is_visible("orders_tree"):
+            self.refresh_order_row(event["id"], event.get("op"))
+        if table in ("dishes", "dish_categories") and self.is_visible("menu_tree"):
+            if "stock" in event:
+                self.refresh_menu_row(event["id"])
+            else:
+                self.schedule_menu_refresh()
+        if table in ("reservations", "orders") and self.is_visible("res_table_combobox"):
+            # Подбор стола пересчитается по свежим броням
+            self.res_allocator = None
+            self.update_available_tables()
+    
+    def is_visible(self, widget_name):
+        """Открыт ли экран, которому принадлежит виджет (экран, спрятанный в кэше, - нет)"""
+        widget = getattr(self, widget_name, None)
+        return (widget is not None and widget.winfo_exists()
+                and str(widget).startswith(str(self.content_area) + "."))
+    
+    def schedule_tables_refresh(self, table_id):
+        """Копит столы для обновления, чтобы пачку событий обработать одним запросом"""
+        if not self.tables_refresh_ids:
+            self.root.after(EVENT_COALESCE_MS, self.flush_tables_refresh)
+        self.tables_refresh_ids.add(table_id)
+    
+    def schedule_menu_refresh(self):
+        """Пачка правок меню перерисовывает таблицу один раз, а не на каждое событие"""
+        if not self.menu_refresh_pending:
+            self.menu_refresh_pending = True
+            self.root.after(EVENT_COALESCE_MS, self.flush_menu_refresh)
+    
+    def flush_menu_refresh(self):
+        self.menu_refresh_pending = False
+        if self.is_visible("menu_tree"):
+            self.update_menu_view()
+    
+    def refresh_menu_row(self, dish_id):
+        """Изменился только остаток блюда: обновляет одну строку таблицы меню"""
+        dish = self.menu.by_id.get(dish_id) if self.menu.loaded else None
+        if dish is None or self.menu_refresh_pending:
+            return  # строку перерисует уже запланированное полное обновление
+        self.menu_sync.upsert((dish["id"], dish["name"], dish["category"], dish["price"], dish["quantity"]))
+    
+    def flush_tables_refresh(self):
+        """Перечитывает состояние накопленных столов и обновляет только их строки"""
+        table_ids, self.tables_refresh_ids = self.tables_refresh_ids, set()
+        if not table_ids or not self.is_visible("tables_tree"):
+            return
+        moment = self.tables_filter_datetime(show_errors=False)
+        if moment is None:
+            return
+        
+        def apply_rows(floor_status):
+            if not self.is_visible("tables_tree"):
+                return
+            rows = build_floor_rows(floor_status)
+            for row in rows:
+                self.tables_sync.upsert(row)
+            # Столы, которых больше нет в БД
+            for table_id in table_ids - {row[0] for row in rows}:
+                self.tables_sync.remove(table_id)
+        
+        query, params = floor_status_query(moment, table_ids)
+        self.execute_query_async(query, params, apply_rows)
+    
     def connect_to_db(self):
         """Устанавливает соединение с PostgreSQL"""
         try:
-            conn = psycopg2.connect(
-                dbname="restaurant_db",
-                user="postgres",
-                password="123",
-                host="localhost",
-                port="5432",
-                client_encoding='WIN1251'  # Указываем кодировку соединения
-            )
-            return conn
+            return self.db.connect()
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось подключиться к БД: {str(e)}")
             logging.error(f"Database connection error: {str(e)}")
@@ -71,40 +2662,184 @@ class RestaurantApp:
                                     "Закрыть заказ?"):
                 return
         
-        query = "UPDATE orders SET status = 'closed' WHERE id = %s"
-        if self.execute_query(query, (order_id,)):
-            messagebox.showinfo("Успех", f"Заказ №{order_id} успешно закрыт")
-            self.show_orders_screen()
-        else:
-            messagebox.showerror("Ошибка", "Не удалось закрыть заказ")
+        result = self.call_service(self.service.close_order, order_id, status, defer=True)
+        if result is not False:
+            messagebox.showinfo("Успех", f"Заказ №{order_id} успешно закрыт{self.deferred_note(result)}")
+            self.update_orders_view()
     
-    def execute_query(self, query, params=None, fetch=False):
+    def call_service(self, operation, *args, defer=False):
+        """Выполняет операцию RestaurantService и показывает ее ошибку пользователю.
+        Возвращает результат операции или False, если она не удалась.
+        defer=True - без связи с БД операция откладывается (run_or_defer)"""
         try:
-            logging.info(f"Executing query: {query} with params: {params}")
-            if not self.db_connection or self.db_connection.closed:
-                self.db_connection = self.connect_to_db()
-                if not self.db_connection:
-                    return False
-            
-            cursor = self.db_connection.cursor()
-            cursor.execute(query, params or ())
+            if defer:
+                return self.run_or_defer(operation, *args)
+            return operation(*args)
+        except ServiceError as e:
+            messagebox.showerror("Ошибка", str(e))
+        except Exception as e:
+            logging.error(f"Service error in {operation.__name__}: {str(e)}")
+            messagebox.showerror("Ошибка БД", f"Ошибка при выполнении запроса: {str(e)}")
+        return False
+    
+    def run_or_defer(self, operation, *args):
+        """Выполняет операцию RestaurantService, а если БД недоступна - кладет ее
+        в офлайн-очередь и возвращает Deferred. Пока очередь не досылана, новые
+        операции тоже встают в нее, чтобы попасть в БД в порядке приема"""
+        if not self.offline.pending_count():
+            try:
+                return operation(*args)
+            except psycopg2.Error as e:
+                if not self.db_unreachable(e):
+                    raise
+                logging.error(f"Database unavailable, deferring {operation.__name__}: {str(e)}")
+        
+        signature = inspect.signature(operation)
+        arguments = signature.bind(*args).arguments
+        if "at" in signature.parameters and arguments.get("at") is None:
+            arguments["at"] = datetime.now()
+        deferred = self.offline.put(operation.__name__, dict(arguments))
+        self.replayer.wake()
+        return deferred
+    
+    def db_unreachable(self, error):
+        """Ошибка - обрыв или отсутствие связи с БД, а не ошибка самого запроса"""
+        return isinstance(error, psycopg2.InterfaceError) or (
+            isinstance(error, psycopg2.OperationalError) and not self.db.is_connected()
+        )
+    
+    def deferred_note(self, result):
+        """Приписка к сообщению об успехе, если операция ушла в офлайн-очередь"""
+        if isinstance(result, Deferred):
+            return "\n\nНет связи с БД: операция сохранена на терминале и будет отправлена автоматически"
+        return ""
+    
+    def on_offline_replayed(self, applied, rejected):
+        """Пачка офлайн-очереди дослана в БД"""
+        if isinstance(self.current_shift, Deferred) and self.current_shift.key in applied:
+            self.current_shift = applied[self.current_shift.key]
+        self.update_status_bar()
+        if rejected:
+            messagebox.showerror(
+                "Офлайн-очередь",
+                f"БД отклонила отложенные операции ({len(rejected)}):\n" + "\n".join(rejected.values())
+                + "\n\nОни сохранены на терминале: нажмите на строку состояния внизу окна,"
+                  " чтобы повторить или удалить их."
+            )
+    
+    def show_rejected_operations(self):
+        """Окно отклоненных операций офлайн-очереди: повторить или удалить"""
+        rejected = self.offline.rejected()
+        if not rejected:
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("Отклоненные операции")
+        window.geometry("900x400")
+        
+        columns = ("created", "operation", "error")
+        tree = ttk.Treeview(window, columns=columns, show="headings")
+        tree.heading("created", text="Принята")
+        tree.heading("operation", text="Операция")
+        tree.heading("error", text="Причина отказа")
+        tree.column("created", width=140)
+        tree.column("operation", width=330)
+        tree.column("error", width=400)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        def fill():
+            tree.delete(*tree.get_children())
+            for key, operation, arguments, created_at, error in self.offline.rejected():
+                tree.insert("", tk.END, iid=key, values=(
+                    created_at[:16].replace("T", " "), describe_offline_operation(operation, arguments), error
+                ))
+            self.update_status_bar()
+        
+        def retry():
+            keys = tree.selection()
+            if not keys:
+                messagebox.showerror("Ошибка", "Выберите операции", parent=window)
+                return
+            self.offline.retry(keys)
+            self.replayer.wake()
+            fill()
+        
+        def discard():
+            keys = tree.selection()
+            if not keys:
+                messagebox.showerror("Ошибка", "Выберите операции", parent=window)
+                return
+            if not messagebox.askyesno("Подтверждение",
+                                       f"Удалить операции ({len(keys)}) без отправки в БД?", parent=window):
+                return
+            self.offline.discard(keys)
+            fill()
+        
+        fill()
+        btn_frame = ttk.Frame(window)
+        btn_frame.pack(pady=10)
+        ttk.Button(btn_frame, text="Повторить", command=retry).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Удалить", command=discard).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Закрыть", command=window.destroy).pack(side=tk.LEFT, padx=5)
+    
+    def execute_query(self, query, params=None, fetch=False, name=None):
+        """Выполняет запрос в UI-потоке. name - имя для подготовленного запроса (горячие пути)"""
+        try:
+            if not self.db.is_connected() and not self.connect_to_db():
+                return False
             
-            if fetch:
-                result = cursor.fetchall()
-                cursor.close()
-                return result
-            else:
-                self.db_connection.commit()
-                cursor.close()
-                return True
+            return self.db.run(query, params, fetch, name)
                 
         except Exception as e:
             logging.error(f"Error executing query: {query}\nError: {str(e)}")
-            if self.db_connection:
-                self.db_connection.rollback()
             messagebox.showerror("Ошибка БД", f"Ошибка при выполнении запроса: {str(e)}")
             return False
     
+    def execute_query_async(self, query, params=None, callback=None, fetch=True, widget=None, name=None,
+                            done=None):
+        """Выполняет запрос в фоне; callback(result) вызывается в UI-потоке.
+        Если передан widget, результат отбрасывается, когда виджет уже уничтожен
+        (экран сменился) или для него запущен более новый запрос.
+        done() вызывается в UI-потоке после любого исхода: результата, ошибки или отбрасывания"""
+        token = object()
+        if widget is not None:
+            self.pending_requests[str(widget)] = token
+        
+        def alive():
+            if widget is None:
+                return True
+            return widget.winfo_exists() and self.pending_requests.get(str(widget)) is token
+        
+        def on_result(result):
+            try:
+                if alive() and callback:
+                    callback(result)
+            finally:
+                if done:
+                    done()
+        
+        def on_error(error):
+            try:
+                if widget is not None and alive():
+                    self.clear_loading(widget)
+                messagebox.showerror("Ошибка БД", f"Ошибка при выполнении запроса: {str(error)}")
+            finally:
+                if done:
+                    done()
+        
+        return self.db.submit(query, params, fetch, on_result, on_error, name)
+    
+    def show_loading(self, tree):
+        """Очищает таблицу и показывает строку "Загрузка..." до прихода данных"""
+        for item in tree.get_children():
+            tree.delete(item)
+        tree.insert("", tk.END, iid=LOADING_IID, values=("Загрузка...",))
+    
+    def clear_loading(self, tree):
+        """Убирает строку загрузки из таблицы"""
+        if tree.exists(LOADING_IID):
+            tree.delete(LOADING_IID)
+    
     def create_widgets(self):
         """Создание интерфейса приложения"""
         self.main_container = ttk.Frame(self.root)
@@ -119,19 +2854,29 @@ class RestaurantApp:
         self.menu_btn = ttk.Button(self.nav_frame, text="Меню", command=self.show_menu_screen)
         self.stats_btn = ttk.Button(self.nav_frame, text="Статистика", command=self.show_stats_screen)
         self.sessions_btn = ttk.Button(self.nav_frame, text="Сессии", command=self.show_sessions_screen)
+        self.queries_btn = ttk.Button(self.nav_frame, text="Запросы", command=self.show_query_stats_screen)
         self.shift_btn = ttk.Button(self.nav_frame, text="Начать смену", command=self.start_shift)
         self.end_shift_btn = ttk.Button(self.nav_frame, text="Закончить смену", command=self.end_shift)
         self.login_btn = ttk.Button(self.nav_frame, text="Вход", command=self.show_login_screen)
         self.logout_btn = ttk.Button(self.nav_frame, text="Выход", command=self.logout)
         
-        # Область контента
-        self.content_area = ttk.Frame(self.main_container)
-        self.content_area.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        # Индикатор связи с БД и офлайн-очереди
+        self.status_bar = ttk.Label(self.main_container, anchor=tk.W)
+        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=2)
+        self.status_bar.bind("<Button-1>", lambda event: self.show_rejected_operations())
+        
+        # Область контента: в ней лежат фреймы экранов, виден только текущий
+        self.content_host = ttk.Frame(self.main_container)
+        self.content_host.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.content_area = ttk.Frame(self.content_host)
+        self.content_area.pack(fill=tk.BOTH, expand=True)
+        self.screens = {}  # имя -> {"frame", "refresh", "max_age", "loaded_at", "stale"}
+        self.current_screen = None  # имя экрана из кэша или None для временного экрана
     
     def hide_nav_buttons(self):
         """Скрывает кнопки навигации (до входа)"""
         for btn in [self.tables_btn, self.reserve_btn, self.orders_btn, 
-                   self.menu_btn, self.stats_btn, self.sessions_btn,
+                   self.menu_btn, self.stats_btn, self.sessions_btn, self.queries_btn,
                    self.shift_btn, self.end_shift_btn, self.logout_btn]:
             btn.pack_forget()
     
@@ -152,6 +2897,7 @@ class RestaurantApp:
         if role == "admin":
             self.stats_btn.pack(side=tk.LEFT, padx=5)
             self.sessions_btn.pack(side=tk.LEFT, padx=5)
+            self.queries_btn.pack(side=tk.LEFT, padx=5)
             
         if role == "waiter":
             self.shift_btn.pack(side=tk.LEFT, padx=5)
@@ -162,13 +2908,84 @@ class RestaurantApp:
         self.nav_frame.pack(fill=tk.X, padx=5, pady=5)
     
     def clear_content_area(self):
-        """Очищает область контента"""
-        for widget in self.content_area.winfo_children():
-            widget.destroy()
+        """Очищает область контента под временный экран (форму, вход):
+        экран из кэша прячется, прежний временный уничтожается"""
+        self.release_cart()
+        self.hide_current_screen()
+        self.content_area = ttk.Frame(self.content_host)
+        self.content_area.pack(fill=tk.BOTH, expand=True)
+    
+    def hide_current_screen(self):
+        if self.current_screen is not None:
+            self.content_area.pack_forget()
+            self.current_screen = None
+        else:
+            self.content_area.destroy()
+    
+    def show_cached_screen(self, name, build, refresh, max_age=SCREEN_MAX_AGE_S):
+        """Показывает экран из кэша. Первый раз build() строит его в self.content_area
+        (и загружает данные), дальше фрейм только поднимается, а refresh() перечитывает
+        данные, если экран устарел"""
+        if self.current_screen == name:
+            refresh()
+            self.screens[name]["loaded_at"] = time.monotonic()
+            return
+        self.release_cart()
+        self.hide_current_screen()
+        screen = self.screens.get(name)
+        if screen is None:
+            self.content_area = ttk.Frame(self.content_host)
+            self.content_area.pack(fill=tk.BOTH, expand=True)
+            self.current_screen = name
+            build()
+            self.screens[name] = {
+                "frame": self.content_area,
+                "refresh": refresh,
+                "max_age": max_age,
+                "loaded_at": time.monotonic(),
+                "stale": False,
+            }
+            return
+        
+        self.content_area = screen["frame"]
+        self.content_area.pack(fill=tk.BOTH, expand=True)
+        self.current_screen = name
+        if screen["stale"] or time.monotonic() - screen["loaded_at"] > screen["max_age"]:
+            refresh()
+            screen["loaded_at"] = time.monotonic()
+            screen["stale"] = False
+    
+    def mark_screens_stale(self, *tables):
+        """Экраны, показывающие эти таблицы БД, перечитают данные при следующем показе"""
+        for name, screen in self.screens.items():
+            if name != self.current_screen and set(tables) & set(SCREEN_SOURCES.get(name, ())):
+                screen["stale"] = True
+    
+    def drop_screen_cache(self):
+        """Кэш экранов - на одну сессию: у другого пользователя другие кнопки и данные"""
+        self.hide_current_screen()
+        for screen in self.screens.values():
+            screen["frame"].destroy()
+        self.screens = {}
+        self.content_area = ttk.Frame(self.content_host)
+        self.content_area.pack(fill=tk.BOTH, expand=True)
+    
+    def release_cart(self):
+        """Уход с экрана заказа без сохранения: резерв корзины возвращается на склад в фоне"""
+        if self.current_order and self.current_order["items"]:
+            self.db.submit(RELEASE_CART_SQL, (self.current_order["cart_id"],), fetch=False)
+        self.current_order = None
+    
+    def sweep_stock_holds(self):
+        """Периодически возвращает на склад резервы брошенных корзин (в том числе с других терминалов)"""
+        if self.db.is_connected():
+            self.db.submit(RELEASE_EXPIRED_HOLDS_SQL, fetch=False)
+        self.root.after(HOLD_SWEEP_MS, self.sweep_stock_holds)
     
     def show_login_screen(self):
         """Показывает экран входа"""
-        self.clear_content_area()
+        self.release_cart()
+        self.drop_screen_cache()
         self.current_user = None
         self.current_shift = None
         self.hide_nav_buttons()
@@ -230,36 +3047,22 @@ class RestaurantApp:
             messagebox.showerror("Ошибка", "Введите логин и пароль")
             return
         
-        try:
-            if not self.db_connection or self.db_connection.closed:
-                self.db_connection = self.connect_to_db()
-                if not self.db_connection:
-                    messagebox.showerror("Ошибка", "Нет соединения с базой данных")
-                    return
-                
-            query = """
-                SELECT u.id, u.full_name, r.name as role 
-                FROM users u
-                JOIN roles r ON u.role_id = r.id
-                WHERE u.login = %s AND u.password = %s
-            """
-            result = self.execute_query(query, (login, password), fetch=True)
-            
-            if result and len(result) > 0:
-                user_data = result[0]
-                self.current_user = {
-                    "id": user_data[0],
-                    "name": user_data[1],
-                    "role": user_data[2]
-                }
-                self.show_nav_buttons(self.current_user["role"])
-                self.show_tables_screen()
-                messagebox.showinfo("Успех", f"Добро пожаловать, {self.current_user['name']}!")
-            else:
-                messagebox.showerror("Ошибка", "Неверный логин или пароль")
-        except Exception as e:
-            messagebox.showerror("Ошибка БД", f"Ошибка при входе: {str(e)}")
-            logging.error(f"Login error: {str(e)}")
+        if not self.db.schema_ready:
+            # Без служебных таблиц (stock_holds, applied_operations) первые заказы упадут
+            self.connect_in_background()
+            messagebox.showinfo("Подключение", "База данных еще подготавливается. Повторите вход через несколько секунд")
+            return
+        
+        if not self.db.is_connected() and not self.connect_to_db():
+            messagebox.showerror("Ошибка", "Нет соединения с базой данных")
+            return
+        
+        user = self.call_service(self.service.authenticate, login, password)
+        if user:
+            self.current_user = user
+            self.show_nav_buttons(self.current_user["role"])
+            self.show_tables_screen()
+            messagebox.showinfo("Успех", f"Добро пожаловать, {self.current_user['name']}!")
     
     def register(self):
         """Регистрация нового пользователя"""
@@ -276,18 +3079,7 @@ class RestaurantApp:
             messagebox.showerror("Ошибка", "Пароли не совпадают")
             return
         
-        # Проверяем, нет ли уже такого логина
-        check_query = "SELECT id FROM users WHERE login = %s"
-        if self.execute_query(check_query, (login,), fetch=True):
-            messagebox.showerror("Ошибка", "Пользователь с таким логином уже существует")
-            return
-        
-        # Регистрируем нового пользователя с ролью "client" (id=3)
-        register_query = """
-            INSERT INTO users (login, password, full_name, role_id) 
-            VALUES (%s, %s, %s, 3)
-        """
-        if self.execute_query(register_query, (login, password, full_name)):
+        if self.call_service(self.service.register_client, full_name, login, password):
             messagebox.showinfo("Успех", "Регистрация прошла успешно! Теперь вы можете войти.")
             # Очищаем поля
             self.reg_name_entry.delete(0, tk.END)
@@ -316,16 +3108,11 @@ class RestaurantApp:
             messagebox.showerror("Ошибка", "У вас уже есть активная смена")
             return
         
-        query = """
-            INSERT INTO shifts (waiter_id, start_time) 
-            VALUES (%s, NOW())
-            RETURNING id
-        """
-        result = self.execute_query(query, (self.current_user["id"],), fetch=True)
-        
-        if result:
-            self.current_shift = result[0][0]
-            messagebox.showinfo("Успех", "Смена успешно начата")
+        shift_id = self.call_service(self.service.start_shift, self.current_user["id"], defer=True)
+        if shift_id:
+            # Отложенная смена - Deferred, до досылки id заменит on_offline_replayed
+            self.current_shift = shift_id
+            messagebox.showinfo("Успех", f"Смена успешно начата{self.deferred_note(shift_id)}")
             self.show_tables_screen()
     
     def end_shift(self):
@@ -338,49 +3125,22 @@ class RestaurantApp:
             messagebox.showerror("Ошибка", "У вас нет активной смены")
             return
         
-        try:
-            # Подсчитываем чаевые за смену (10% от суммы оплаченных заказов)
-            tips_query = """
-                SELECT COALESCE(SUM(total * 0.1), 0) as tips
-                FROM orders
-                WHERE waiter_id = %s 
-                AND created_at BETWEEN 
-                    (SELECT start_time FROM shifts WHERE id = %s) 
-                    AND NOW()
-                AND status = 'paid'
-            """
-            tips_result = self.execute_query(tips_query, (self.current_user["id"], self.current_shift), fetch=True)
-            
-            # Проверяем результат запроса
-            if not tips_result or len(tips_result) == 0 or len(tips_result[0]) == 0:
-                tips_amount = 0
-            else:
-                tips_amount = float(tips_result[0][0]) if tips_result[0][0] is not None else 0
-            
-            # Завершаем смену
-            update_query = """
-                UPDATE shifts 
-                SET end_time = NOW(), tips = %s
-                WHERE id = %s
-                RETURNING id
-            """
-            result = self.execute_query(update_query, (tips_amount, self.current_shift), fetch=True)
-            
-            if result:
-                messagebox.showinfo("Успех", f"Смена успешно завершена. Чаевые: {tips_amount:.2f} руб.")
-                self.current_shift = None
-                self.show_tables_screen()
-            else:
-                messagebox.showerror("Ошибка", "Не удалось завершить смену")
-                
-        except Exception as e:
-            messagebox.showerror("Ошибка БД", f"Ошибка при завершении смены: {str(e)}")
-            logging.error(f"Error ending shift: {str(e)}")
+        # Чаевые - 10% от суммы оплаченных за смену заказов
+        tips_amount = self.call_service(self.service.end_shift, self.current_user["id"], self.current_shift, defer=True)
+        if isinstance(tips_amount, Deferred):
+            messagebox.showinfo("Успех", f"Смена успешно завершена, чаевые начислятся после досылки"
+                                         f"{self.deferred_note(tips_amount)}")
+        elif tips_amount is not False:
+            messagebox.showinfo("Успех", f"Смена успешно завершена. Чаевые: {tips_amount:.2f} руб.")
+        if tips_amount is not False:
+            self.current_shift = None
+            self.show_tables_screen()
     
     def show_tables_screen(self):
         """Показывает экран со списком столов"""
-        self.clear_content_area()
-        
+        self.show_cached_screen("tables", self.build_tables_screen, self.refresh_tables_screen)
+    
+    def build_tables_screen(self):
         title = ttk.Label(self.content_area, text="Столы", font=('Helvetica', 16))
         title.pack(pady=10)
         
@@ -417,6 +3177,7 @@ class RestaurantApp:
         self.tables_tree.column("waiter", width=150)
         
         self.tables_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.tables_sync = TreeviewSync(self.tables_tree)
         
         self.update_tables_view()
         
@@ -430,6 +3191,15 @@ class RestaurantApp:
             if self.current_user["role"] == "admin":
                 ttk.Button(btn_frame, text="Назначить официанта", command=self.assign_waiter).pack(side=tk.LEFT, padx=5)
     
+    def refresh_tables_screen(self):
+        """Статусы столов показываются на текущий момент, а не на момент постройки экрана"""
+        now = datetime.now()
+        for entry, value in ((self.table_date_entry, now.strftime("%Y-%m-%d")),
+                             (self.table_time_entry, now.strftime("%H:%M"))):
+            entry.delete(0, tk.END)
+            entry.insert(0, value)
+        self.update_tables_view()
+    
     def assign_waiter(self):
         """Назначает официанта на стол"""
         selected_item = self.tables_tree.selection()
@@ -441,13 +3211,7 @@ class RestaurantApp:
         table_id = item["values"][0]
         
         # Получаем список официантов
-        waiters_query = """
-            SELECT u.id, u.full_name 
-            FROM users u
-            WHERE u.role_id = 2  -- Официанты
-            ORDER BY u.full_name
-        """
-        waiters = self.execute_query(waiters_query, fetch=True) or []
+        waiters = self.call_service(self.service.waiters)
         
         if not waiters:
             messagebox.showerror("Ошибка", "Нет доступных официантов")
@@ -472,118 +3236,51 @@ class RestaurantApp:
             
             waiter_id = int(waiter_str.split("ID: ")[1].rstrip(")"))
             
-            # Удаляем предыдущие назначения для этого стола
-            delete_query = "DELETE FROM waiter_tables WHERE table_id = %s"
-            self.execute_query(delete_query, (table_id,))
-            
-            # Добавляем новое назначение
-            insert_query = "INSERT INTO waiter_tables (waiter_id, table_id) VALUES (%s, %s)"
-            if self.execute_query(insert_query, (waiter_id, table_id)):
+            # Прежние назначения стола заменяются новым
+            if self.call_service(self.service.assign_waiter, table_id, waiter_id) is not False:
                 messagebox.showinfo("Успех", "Официант успешно назначен")
                 assign_window.destroy()
                 self.update_tables_view()
         
         ttk.Button(assign_window, text="Назначить", command=save_assignment).pack(pady=10)
     
-    def update_tables_view(self):
-        """Обновляет отображение столов"""
-        # Очищаем таблицу
-        for item in self.tables_tree.get_children():
-            self.tables_tree.delete(item)
-        
-        # Получаем дату и время для фильтрации
+    def tables_filter_datetime(self, show_errors=True):
+        """Дата и время из фильтра экрана столов или None, если они некорректны"""
         date_str = self.table_date_entry.get()
         time_str = self.table_time_entry.get()
         
         try:
             # Парсим дату и время с учетом возможных секунд
-            filter_datetime = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+            return datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
         except ValueError:
             try:
                 # Если не получилось, пробуем с секундами
-                filter_datetime = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M:%S")
+                return datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M:%S")
             except ValueError as e:
-                messagebox.showerror("Ошибка", f"Некорректный формат даты или времени: {str(e)}")
-                return
-        
-        # Получаем список столов из БД
-        tables_query = "SELECT id, capacity, status FROM tables"
-        tables = self.execute_query(tables_query, fetch=True) or []
-        
-        # Получаем список бронирований на выбранную дату
-        reservations_query = """
-            SELECT id, table_id, date, start_time, end_time 
-            FROM reservations 
-            WHERE date = %s AND status = 'active'
-        """
-        reservations = self.execute_query(reservations_query, (date_str,), fetch=True) or []
-        
-        # Получаем информацию о назначенных официантах
-        waiters_query = """
-            SELECT wt.table_id, u.full_name 
-            FROM waiter_tables wt
-            JOIN users u ON wt.waiter_id = u.id
-        """
-        table_waiters = self.execute_query(waiters_query, fetch=True) or []
-        waiter_dict = {table_id: name for table_id, name in table_waiters}
+                if show_errors:
+                    messagebox.showerror("Ошибка", f"Некорректный формат даты или времени: {str(e)}")
+                return None
+    
+    def update_tables_view(self):
+        """Обновляет отображение столов"""
+        # Получаем дату и время для фильтрации
+        filter_datetime = self.tables_filter_datetime()
+        if filter_datetime is None:
+            return
         
-        # Получаем активные заказы для определения занятости столов
-        active_orders_query = """
-            SELECT table_id 
-            FROM orders 
-            WHERE status = 'active'
-        """
-        active_orders = self.execute_query(active_orders_query, fetch=True) or []
-        busy_tables = {order[0] for order in active_orders}
+        # Столы, занятость, текущая бронь и официант - одним запросом
+        floor_status = self.fetch_floor_status(filter_datetime)
+        if floor_status is False:
+            return
         
         # Заполняем таблицу данными
-        for table in tables:
-            table_id, capacity, status = table
-            reservation_info = ""
-            waiter_name = waiter_dict.get(table_id, "")
-            
-            # Проверяем бронирования для этого стола
-            for res in reservations:
-                res_id, res_table_id, res_date, start_time, end_time = res
-                if res_table_id == table_id:
-                    try:
-                        # Форматируем время начала
-                        if isinstance(start_time, str):
-                            start_time_str = start_time[:5]  # Берем только часы и минуты
-                        else:
-                            start_time_str = start_time.strftime("%H:%M")
-                        
-                        # Форматируем время окончания
-                        if isinstance(end_time, str):
-                            end_time_str = end_time[:5]  # Берем только часы и минуты
-                        else:
-                            end_time_str = end_time.strftime("%H:%M")
-                        
-                        start = datetime.strptime(f"{res_date} {start_time_str}", "%Y-%m-%d %H:%M")
-                        end = datetime.strptime(f"{res_date} {end_time_str}", "%Y-%m-%d %H:%M")
-                        
-                        if start <= filter_datetime <= end:
-                            reservation_info = f"Бронь #{res_id} до {end_time_str}"
-                            break
-                    except ValueError as e:
-                        print(f"Ошибка при обработке времени бронирования: {e}")
-                        continue
-            
-            # Определяем статус стола
-            if table_id in busy_tables:
-                status = "занят (заказ)"
-            elif reservation_info:
-                status = "занят (бронь)"
-            else:
-                status = "свободен"
-            
-            self.tables_tree.insert("", tk.END, values=(
-                table_id,
-                capacity,
-                status,
-                reservation_info,
-                waiter_name
-            ))
+        rows = build_floor_rows(floor_status)
+        self.tables_sync.apply(rows)
+    
+    def fetch_floor_status(self, moment):
+        """Состояние всего зала на момент moment за один запрос"""
+        query, params = floor_status_query(moment)
+        return self.execute_query(query, params, fetch=True)
     
     def show_reservation_screen(self):
         """Показывает экран бронирования"""
@@ -624,6 +3321,14 @@ class RestaurantApp:
         ttk.Label(form_frame, text="Стол:").grid(row=4, column=0, sticky=tk.E, padx=5, pady=5)
         self.res_table_combobox = ttk.Combobox(form_frame, state="readonly")
         self.res_table_combobox.grid(row=4, column=1, sticky=tk.W, padx=5, pady=5)
+        self.res_best_label = ttk.Label(form_frame, text="")
+        self.res_best_label.grid(row=4, column=2, sticky=tk.W, padx=5, pady=5)
+        
+        # Подбор стола пересчитывается на каждое изменение формы
+        self.res_allocator = None
+        for entry in (self.res_date_entry, self.res_start_time_entry,
+                      self.res_end_time_entry, self.res_guests_entry):
+            entry.bind("<KeyRelease>", lambda event: self.update_available_tables())
         self.update_available_tables()
         
         # Кнопки
@@ -631,60 +3336,87 @@ class RestaurantApp:
         btn_frame.pack(pady=10)
         
         ttk.Button(btn_frame, text="Забронировать", command=self.make_reservation).pack(side=tk.LEFT, padx=5)
+        if self.current_user and self.current_user["role"] == "admin":
+            ttk.Button(btn_frame, text="Импорт броней...", command=self.import_reservations).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Отменить", command=self.show_tables_screen).pack(side=tk.LEFT, padx=5)
     
     def update_available_tables(self):
-        """Обновляет список доступных столов для бронирования"""
+        """Обновляет список доступных столов для бронирования: лучший по размеру стол первым"""
         try:
             date = self.res_date_entry.get()
-            start_time = self.res_start_time_entry.get()
-            end_time = self.res_end_time_entry.get()
-            
-            start_datetime = datetime.strptime(f"{date} {start_time}", "%Y-%m-%d %H:%M")
-            end_datetime = datetime.strptime(f"{date} {end_time}", "%Y-%m-%d %H:%M")
-            
-            # Получаем все столы
-            tables_query = "SELECT id, capacity FROM tables"
-            tables = self.execute_query(tables_query, fetch=True) or []
-            
-            # Получаем занятые столы на выбранное время
-            busy_tables_query = """
-                SELECT DISTINCT table_id 
-                FROM reservations 
-                WHERE date = %s AND status = 'active'
-                AND NOT (end_time <= %s OR start_time >= %s)
-            """
-            busy_tables = self.execute_query(
-                busy_tables_query, 
-                (date, start_time, end_time), 
-                fetch=True
-            ) or []
-            
-            busy_table_ids = [table[0] for table in busy_tables]
-            
-            # Получаем столы с активными заказами
-            active_orders_query = """
-                SELECT DISTINCT table_id 
-                FROM orders 
-                WHERE status = 'active'
-            """
-            active_orders = self.execute_query(active_orders_query, fetch=True) or []
-            busy_table_ids.extend([order[0] for order in active_orders])
-            
-            # Формируем список доступных столов
-            available_tables = [
-                table for table in tables 
-                if table[0] not in busy_table_ids
-            ]
+            start = datetime.strptime(f"{date} {self.res_start_time_entry.get()}", "%Y-%m-%d %H:%M")
+            end = datetime.strptime(f"{date} {self.res_end_time_entry.get()}", "%Y-%m-%d %H:%M")
+            guests = int(self.res_guests_entry.get())
+        except ValueError:
+            # Поле еще набирается
+            return
+        
+        # Брони дня загружаются только при смене даты (или после изменений с других терминалов)
+        if self.res_allocator is None or self.res_allocator.day != start.date():
+            allocator = self.call_service(self.service.table_allocator, start.date())
+            if not allocator:
+                return
+            self.res_allocator = allocator
+        ranked = self.res_allocator.rank(guests, start, end)
+        self.show_table_options(ranked)
+        
+        # Порядок предлагает подборщик, а свободен ли стол, окончательно решает БД
+        # (по индексу reservations_no_overlap): ответ придет в фоне и уберет лишние столы
+        if ranked:
+            def confirm(rows):
+                free = {table_id for table_id, _ in rows}
+                self.show_table_options([table for table in ranked if table[0] in free])
             
-            # Обновляем combobox
-            table_options = [f"№{t[0]} (мест: {t[1]})" for t in available_tables]
+            query, params = available_tables_query(date, start.time(), end.time())
+            self.execute_query_async(query, params, confirm, widget=self.res_table_combobox,
+                                     name="available_tables")
+        else:
+            # Ответ на прежний ввод уже не нужен
+            self.pending_requests.pop(str(self.res_table_combobox), None)
+    
+    def show_table_options(self, available_tables):
+        """Заполняет список столов формы брони; первый - рекомендуемый"""
+        table_options = [f"№{t[0]} (мест: {t[1]})" for t in available_tables]
+        if list(self.res_table_combobox["values"]) != table_options:
             self.res_table_combobox["values"] = table_options
             if table_options:
                 self.res_table_combobox.current(0)
+            else:
+                self.res_table_combobox.set("")
+        self.res_best_label.config(
+            text=f"Рекомендуем: {table_options[0]}" if table_options else "Нет свободных столов"
+        )
+    
+    def import_reservations(self):
+        """Импортирует брони из CSV/JSON и предлагает сохранить отчет об отказах"""
+        path = filedialog.askopenfilename(
+            title="Файл броней",
+            filetypes=[("CSV или JSON", "*.csv *.json"), ("Все файлы", "*.*")]
+        )
+        if not path:
+            return
         
-        except ValueError:
-            pass
+        # Клиент по умолчанию - тот, кто импортирует (для броней партнеров без client_id)
+        records = self.call_service(read_reservation_file, path)
+        if records is False:
+            return
+        report = self.call_service(self.service.import_reservations, records, self.current_user["id"])
+        if not report:
+            return
+        
+        rejected = report["rejected"]
+        summary = f"Импортировано броней: {report['inserted']}\nОтклонено: {len(rejected)}"
+        if not rejected:
+            messagebox.showinfo("Импорт броней", summary)
+        elif messagebox.askyesno("Импорт броней", f"{summary}\n\nСохранить отчет об отклоненных строках?"):
+            report_path = filedialog.asksaveasfilename(
+                title="Отчет об отказах", defaultextension=".csv", filetypes=[("CSV", "*.csv")]
+            )
+            if report_path:
+                self.call_service(write_rejection_report, report_path, rejected)
+        
+        self.res_allocator = None
+        self.update_available_tables()
     
     def make_reservation(self):
         """Создает бронирование с проверкой занятости стола"""
@@ -706,77 +3438,70 @@ class RestaurantApp:
             
             # Извлекаем номер стола из строки (формат: "№1 (мест: 2)")
             table_id = int(table_str.split("№")[1].split(" ")[0])
-            
-            # Проверяем вместимость стола
-            table_query = "SELECT capacity FROM tables WHERE id = %s"
-            table = self.execute_query(table_query, (table_id,), fetch=True)
-            
-            if not table:
-                messagebox.showerror("Ошибка", "Стол не найден")
-                return
-                
-            capacity = table[0][0]
-            if guests > capacity:
-                messagebox.showerror("Ошибка", f"Стол №{table_id} вмещает только {capacity} гостей")
-                return
-            
-            # Проверяем, не занят ли стол в это время
-            check_query = """
-                SELECT id FROM reservations 
-                WHERE table_id = %s AND date = %s AND status = 'active'
-                AND NOT (end_time <= %s OR start_time >= %s)
-            """
-            existing = self.execute_query(
-                check_query, 
-                (table_id, date, start_time, end_time), 
-                fetch=True
-            )
-            
-            if existing:
-                messagebox.showerror("Ошибка", "Стол уже забронирован на это время")
-                return
-            
-            # Проверяем, нет ли активного заказа на этот стол
-            order_check = """
-                SELECT id FROM orders 
-                WHERE table_id = %s AND status = 'active'
-            """
-            active_order = self.execute_query(order_check, (table_id,), fetch=True)
-            
-            if active_order:
-                messagebox.showerror("Ошибка", "Стол занят активным заказом")
-                return
-            
-            # Создаем бронирование
-            query = """
-                INSERT INTO reservations 
-                (date, start_time, end_time, guests, table_id, client_id, status) 
-                VALUES (%s, %s, %s, %s, %s, %s, 'active')
-                RETURNING id
-            """
-            result = self.execute_query(
-                query, 
-                (date, start_time, end_time, guests, table_id, self.current_user["id"]), 
-                fetch=True
-            )
-            
-            if result:
-                messagebox.showinfo("Успех", f"Стол №{table_id} успешно забронирован")
-                self.show_tables_screen()
         
         except ValueError as e:
             messagebox.showerror("Ошибка", f"Некорректные данные: {str(e)}")
+            return
+        
+        reservation_id = self.call_service(
+            self.service.make_reservation,
+            self.current_user["id"], date, start_time, end_time, guests, table_id
+        )
+        if reservation_id:
+            messagebox.showinfo("Успех", f"Стол №{table_id} успешно забронирован")
+            self.mark_screens_stale("reservations")
+            self.show_tables_screen()
+    
+    def add_items_to_existing_order(self, order_id):
+        """Добавляет блюда к существующему заказу"""
+        result = self.call_service(self.service.add_items_to_order, order_id,
+                                   self.current_order["items"], self.current_order["cart_id"], defer=True)
+        if result:
+            # Резерв корзины перешел в заказ
+            self.current_order = None
+            messagebox.showinfo("Успех", f"Блюда успешно добавлены к заказу №{order_id}{self.deferred_note(result)}")
+            self.mark_screens_stale("orders", "dishes")
+            self.show_orders_screen()
     
     def show_orders_screen(self):
         """Показывает экран заказов"""
-        self.clear_content_area()
-        
+        self.show_cached_screen("orders", self.build_orders_screen, self.update_orders_view)
+    
+    def build_orders_screen(self):
         title = ttk.Label(self.content_area, text="Заказы", font=('Helvetica', 16))
         title.pack(pady=10)
         
+        if self.current_user["role"] == "admin":
+            # Фильтры администратора применяются в SQL
+            filter_frame = ttk.Frame(self.content_area)
+            filter_frame.pack(fill=tk.X, pady=5)
+            
+            ttk.Label(filter_frame, text="Статус:").pack(side=tk.LEFT)
+            self.orders_status_filter = ttk.Combobox(filter_frame, values=["все", "active", "paid", "closed"],
+                                                     state="readonly", width=8)
+            self.orders_status_filter.pack(side=tk.LEFT, padx=5)
+            self.orders_status_filter.set("все")
+            
+            ttk.Label(filter_frame, text="Стол:").pack(side=tk.LEFT)
+            self.orders_table_filter = ttk.Entry(filter_frame, width=6)
+            self.orders_table_filter.pack(side=tk.LEFT, padx=5)
+            
+            ttk.Label(filter_frame, text="С:").pack(side=tk.LEFT)
+            self.orders_date_from = ttk.Entry(filter_frame, width=12)
+            self.orders_date_from.pack(side=tk.LEFT, padx=5)
+            
+            ttk.Label(filter_frame, text="По:").pack(side=tk.LEFT)
+            self.orders_date_to = ttk.Entry(filter_frame, width=12)
+            self.orders_date_to.pack(side=tk.LEFT, padx=5)
+            
+            ttk.Button(filter_frame, text="Применить", command=self.apply_orders_filters).pack(side=tk.LEFT, padx=10)
+        
         # Таблица заказов
+        tree_frame = ttk.Frame(self.content_area)
+        tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
         columns = ("id", "table", "status", "total", "created_at")
-        self.orders_tree = ttk.Treeview(self.content_area, columns=columns, show="headings")
+        self.orders_tree = ttk.Treeview(tree_frame, columns=columns, show="headings")
         
         self.orders_tree.heading("id", text="№ заказа")
         self.orders_tree.heading("table", text="Стол")
@@ -790,68 +3515,25 @@ class RestaurantApp:
         self.orders_tree.column("total", width=100)
         self.orders_tree.column("created_at", width=150)
         
-        self.orders_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.orders_tree.yview)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        # Проверяем, не занят ли стол другим заказом
-        order_check = """
-            SELECT id, client_id FROM orders 
-            WHERE table_id = %s AND status = 'active'
-        """
-        active_order = self.execute_query(order_check, (table_id,), fetch=True)
-
-        if active_order:
-            # Если заказ уже есть, проверяем, принадлежит ли он текущему клиенту
-            if active_order[0][1] != self.current_user["id"]:
-                messagebox.showerror("Ошибка", "Стол уже занят другим заказом")
-                return
-            else:
-                # Если заказ принадлежит текущему клиенту, разрешаем добавить блюда к существующему заказу
-                if not messagebox.askyesno("Подтверждение", 
-                                        "У вас уже есть активный заказ на этот стол. Добавить блюда к существующему заказу?"):
-                    return
-                # Получаем ID существующего заказа
-                existing_order_id = active_order[0][0]
-                # Добавляем блюда к существующему заказу
-                self.add_items_to_existing_order(existing_order_id)
-                return
-
-        # Заполняем таблицу данными из БД
-        if self.current_user["role"] == "client":
-            query = """
-                SELECT o.id, t.id, o.status, o.total, o.created_at 
-                FROM orders o
-                JOIN tables t ON o.table_id = t.id
-                WHERE o.client_id = %s 
-                ORDER BY o.created_at DESC
-            """
-            orders = self.execute_query(query, (self.current_user["id"],), fetch=True) or []
-        elif self.current_user["role"] == "waiter":
-            query = """
-                SELECT o.id, t.id, o.status, o.total, o.created_at 
-                FROM orders o
-                JOIN tables t ON o.table_id = t.id
-                WHERE o.waiter_id = %s 
-                ORDER BY o.created_at DESC
-            """
-            orders = self.execute_query(query, (self.current_user["id"],), fetch=True) or []
-        else:
-            query = """
-                SELECT o.id, t.id, o.status, o.total, o.created_at 
-                FROM orders o
-                JOIN tables t ON o.table_id = t.id
-                ORDER BY o.created_at DESC
-            """
-            orders = self.execute_query(query, fetch=True) or []
-        
-        for order in orders:
-            order_id, table_id, status, total, created_at = order
-            self.orders_tree.insert("", tk.END, values=(
-                order_id,
-                f"Стол №{table_id}",
-                status,
-                f"{total} руб.",
-                created_at.strftime("%Y-%m-%d %H:%M") if isinstance(created_at, datetime) else created_at
-            ))
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            # Администратору следующая страница подгружается у конца списка
+            if self.current_user["role"] == "admin" and float(last) > 0.95:
+                self.load_more_orders()
+        
+        self.orders_tree.configure(yscrollcommand=on_scroll)
+        self.orders_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.orders_sync = TreeviewSync(self.orders_tree)
+        self.orders_loaded = []  # загруженные строки (администратор)
+        self.orders_exhausted = False
+        self.orders_loading = False
+        # Фильтры, с которыми загружен список: страницы и точечные обновления
+        # идут с ними, пока не нажата "Применить" (поля могли уже поменять)
+        self.orders_filters = ([], [])
         
         # Кнопки действий
         btn_frame = ttk.Frame(self.content_area)
@@ -859,7 +3541,7 @@ class RestaurantApp:
         
         ttk.Button(btn_frame, text="Создать заказ", command=self.show_create_order_screen).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Просмотреть", command=self.view_order_details).pack(side=tk.LEFT, padx=5)
-        ttk.Button(btn_frame, text="Обновить", command=self.show_orders_screen).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Обновить", command=self.update_orders_view).pack(side=tk.LEFT, padx=5)
         
         # Добавляем кнопки для просмотра чеков в зависимости от роли
         if self.current_user["role"] == "client":
@@ -869,103 +3551,16 @@ class RestaurantApp:
         
         if self.current_user["role"] in ["admin", "waiter"]:
             ttk.Button(btn_frame, text="Закрыть заказ", command=self.close_order).pack(side=tk.LEFT, padx=5)
-            
-    
-
-    def add_items_to_existing_order(self, order_id):
-        """Добавляет блюда к существующему заказу"""
-        try:
-            # Получаем текущий заказ из БД для обновления общей суммы
-            order_query = "SELECT total FROM orders WHERE id = %s"
-            order = self.execute_query(order_query, (order_id,), fetch=True)
-            
-            if not order:
-                messagebox.showerror("Ошибка", "Заказ не найден")
-                return
-                
-            current_total = float(order[0][0]) if order[0][0] else 0
-            new_total = current_total + self.current_order["total"]
-            
-            # Добавляем элементы заказа
-            for item in self.current_order["items"]:
-                # Проверяем, есть ли уже это блюдо в заказе
-                item_check = """
-                    SELECT id, quantity FROM order_items 
-                    WHERE order_id = %s AND dish_id = %s
-                """
-                existing_item = self.execute_query(
-                    item_check, 
-                    (order_id, item["dish_id"]), 
-                    fetch=True
-                )
-                
-                if existing_item:
-                    # Обновляем существующую позицию
-                    update_query = """
-                        UPDATE order_items 
-                        SET quantity = quantity + %s 
-                        WHERE id = %s
-                    """
-                    self.execute_query(
-                        update_query, 
-                        (item["quantity"], existing_item[0][0])
-                    )
-                else:
-                    # Добавляем новую позицию
-                    item_query = """
-                        INSERT INTO order_items 
-                        (order_id, dish_id, quantity, price) 
-                        VALUES (%s, %s, %s, %s)
-                    """
-                    self.execute_query(
-                        item_query,
-                        (order_id, item["dish_id"], item["quantity"], item["price"])
-                    )
-                
-                # Уменьшаем количество блюд на складе
-                update_query = """
-                    UPDATE dishes 
-                    SET quantity = quantity - %s 
-                    WHERE id = %s
-                """
-                self.execute_query(update_query, (item["quantity"], item["dish_id"]))
-            
-            # Обновляем общую сумму заказа
-            update_total_query = "UPDATE orders SET total = %s WHERE id = %s"
-            self.execute_query(update_total_query, (new_total, order_id))
-            
-            messagebox.showinfo("Успех", f"Блюда успешно добавлены к заказу №{order_id}")
-            self.show_orders_screen()
-        
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось добавить блюда: {str(e)}")
-
-    def show_orders_screen(self):
-        """Показывает экран заказов"""
-        self.clear_content_area()
-        
-        title = ttk.Label(self.content_area, text="Заказы", font=('Helvetica', 16))
-        title.pack(pady=10)
-        
-        # Таблица заказов
-        columns = ("id", "table", "status", "total", "created_at")
-        self.orders_tree = ttk.Treeview(self.content_area, columns=columns, show="headings")
-        
-        self.orders_tree.heading("id", text="№ заказа")
-        self.orders_tree.heading("table", text="Стол")
-        self.orders_tree.heading("status", text="Статус")
-        self.orders_tree.heading("total", text="Сумма")
-        self.orders_tree.heading("created_at", text="Дата создания")
-        
-        self.orders_tree.column("id", width=80)
-        self.orders_tree.column("table", width=100)
-        self.orders_tree.column("status", width=100)
-        self.orders_tree.column("total", width=100)
-        self.orders_tree.column("created_at", width=150)
         
-        self.orders_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.update_orders_view()
+    
+    def update_orders_view(self):
+        """Обновляет список заказов без пересоздания экрана"""
+        if self.current_user["role"] == "admin":
+            self.reload_admin_orders()
+            return
         
-        # Заполняем таблицу данными из БД
+        # Заполняем таблицу данными из БД (в фоне, чтобы окно не зависало)
         if self.current_user["role"] == "client":
             query = """
                 SELECT o.id, t.id, o.status, o.total, o.created_at 
@@ -974,51 +3569,169 @@ class RestaurantApp:
                 WHERE o.client_id = %s 
                 ORDER BY o.created_at DESC
             """
-            orders = self.execute_query(query, (self.current_user["id"],), fetch=True) or []
-        elif self.current_user["role"] == "waiter":
-            query = """
-                SELECT o.id, t.id, o.status, o.total, o.created_at 
-                FROM orders o
-                JOIN tables t ON o.table_id = t.id
-                WHERE o.waiter_id = %s 
-                ORDER BY o.created_at DESC
-            """
-            orders = self.execute_query(query, (self.current_user["id"],), fetch=True) or []
+            params = (self.current_user["id"],)
         else:
             query = """
                 SELECT o.id, t.id, o.status, o.total, o.created_at 
                 FROM orders o
                 JOIN tables t ON o.table_id = t.id
+                WHERE o.waiter_id = %s 
                 ORDER BY o.created_at DESC
             """
-            orders = self.execute_query(query, fetch=True) or []
-        
-        for order in orders:
-            order_id, table_id, status, total, created_at = order
-            self.orders_tree.insert("", tk.END, values=(
-                order_id,
-                f"Стол №{table_id}",
-                status,
-                f"{total} руб.",
-                created_at.strftime("%Y-%m-%d %H:%M") if isinstance(created_at, datetime) else created_at
-            ))
+            params = (self.current_user["id"],)
         
-        # Кнопки действий
-        btn_frame = ttk.Frame(self.content_area)
-        btn_frame.pack(pady=10)
+        def fill_orders(orders):
+            self.orders_sync.apply([self.format_order_row(order) for order in orders])
         
-        ttk.Button(btn_frame, text="Создать заказ", command=self.show_create_order_screen).pack(side=tk.LEFT, padx=5)
-        ttk.Button(btn_frame, text="Просмотреть", command=self.view_order_details).pack(side=tk.LEFT, padx=5)
-        ttk.Button(btn_frame, text="Обновить", command=self.show_orders_screen).pack(side=tk.LEFT, padx=5)
+        # Строка загрузки нужна только при первом заполнении,
+        # при обновлении старые строки остаются на экране до прихода новых
+        if not self.orders_tree.get_children():
+            self.show_loading(self.orders_tree)
+        self.execute_query_async(query, params, fill_orders, widget=self.orders_tree)
+    
+    def orders_filter_conditions(self):
+        """Условия WHERE и параметры из полей фильтров администратора.
+        Возвращает None, если фильтры заполнены некорректно"""
+        conditions, params = [], []
+        try:
+            status = self.orders_status_filter.get()
+            if status and status != "все":
+                conditions.append("o.status = %s")
+                params.append(status)
+            
+            table_str = self.orders_table_filter.get().strip()
+            if table_str:
+                conditions.append("o.table_id = %s")
+                params.append(int(table_str.lstrip("№")))
+            
+            date_from = self.orders_date_from.get().strip()
+            if date_from:
+                conditions.append("o.created_at >= %s")
+                params.append(datetime.strptime(date_from, "%Y-%m-%d"))
+            
+            date_to = self.orders_date_to.get().strip()
+            if date_to:
+                # Включительно: все заказы до начала следующего дня
+                conditions.append("o.created_at < %s")
+                params.append(datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1))
+        except ValueError as e:
+            messagebox.showerror("Ошибка", f"Некорректный фильтр: {str(e)}")
+            return None
+        return conditions, params
+    
+    def fetch_admin_orders(self, limit, after, callback):
+        """Страница заказов для администратора: ключевая пагинация по (created_at, id).
+        after - (created_at, id) последней загруженной строки или None для первой страницы"""
+        conditions, params = list(self.orders_filters[0]), list(self.orders_filters[1])
+        if after:
+            conditions.append("(o.created_at, o.id) < (%s, %s)")
+            params.extend(after)
+        
+        query = "SELECT o.id, o.table_id, o.status, o.total, o.created_at FROM orders o"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY o.created_at DESC, o.id DESC LIMIT %s"
+        params.append(limit)
+        
+        # Флаг снимает только последний запущенный запрос: отброшенный более ранний
+        # не должен открывать подгрузку, пока новый еще в пути
+        request = object()
+        self.orders_loading = request
+        
+        def finished():
+            if self.orders_loading is request:
+                self.orders_loading = False
+        
+        self.execute_query_async(query, params, callback, widget=self.orders_tree, done=finished)
+    
+    def reload_admin_orders(self):
+        """Перечитывает уже загруженную часть списка (минимум одну страницу)"""
+        limit = max(ORDERS_PAGE_SIZE, len(self.orders_loaded))
+        
+        def on_page(orders):
+            self.orders_loaded = list(orders)
+            self.orders_exhausted = len(orders) < limit
+            self.orders_sync.apply([self.format_order_row(order) for order in self.orders_loaded])
+        
+        if not self.orders_tree.get_children():
+            self.show_loading(self.orders_tree)
+        self.fetch_admin_orders(limit, None, on_page)
+    
+    def load_more_orders(self):
+        """Подгружает следующую страницу заказов, когда список прокручен до конца"""
+        if self.orders_loading or self.orders_exhausted or not self.orders_loaded:
+            return
+        last = self.orders_loaded[-1]
         
-        # Добавляем кнопки для просмотра чеков в зависимости от роли
-        if self.current_user["role"] == "client":
-            ttk.Button(btn_frame, text="Мои чеки", command=self.show_client_receipts_for_client).pack(side=tk.LEFT, padx=5)
-        elif self.current_user["role"] in ["waiter", "admin"]:
-            ttk.Button(btn_frame, text="Чеки клиентов", command=self.show_client_receipts).pack(side=tk.LEFT, padx=5)
+        def on_page(orders):
+            self.orders_loaded.extend(orders)
+            self.orders_exhausted = len(orders) < ORDERS_PAGE_SIZE
+            self.orders_sync.apply([self.format_order_row(order) for order in self.orders_loaded])
         
-        if self.current_user["role"] in ["admin", "waiter"]:
-            ttk.Button(btn_frame, text="Закрыть заказ", command=self.close_order).pack(side=tk.LEFT, padx=5)
+        self.fetch_admin_orders(ORDERS_PAGE_SIZE, (last[4], last[0]), on_page)
+    
+    def apply_orders_filters(self):
+        """Сбрасывает список и загружает первую страницу с новыми фильтрами"""
+        filters = self.orders_filter_conditions()
+        if filters is None:
+            return
+        self.orders_filters = filters
+        self.orders_loaded = []
+        self.orders_exhausted = False
+        self.reload_admin_orders()
+    
+    def refresh_order_row(self, order_id, op):
+        """Обновляет в списке один заказ, измененный на другом терминале"""
+        if op == "DELETE":
+            self.drop_order_row(order_id)
+            return
+        
+        # Заказ должен проходить те же условия, что и весь список
+        if self.current_user["role"] == "admin":
+            conditions, params = list(self.orders_filters[0]), list(self.orders_filters[1])
+        elif self.current_user["role"] == "client":
+            conditions, params = ["o.client_id = %s"], [self.current_user["id"]]
+        else:
+            conditions, params = ["o.waiter_id = %s"], [self.current_user["id"]]
+        conditions.append("o.id = %s")
+        params.append(order_id)
+        query = ("SELECT o.id, o.table_id, o.status, o.total, o.created_at FROM orders o WHERE "
+                 + " AND ".join(conditions))
+        
+        def apply_row(orders):
+            if not self.is_visible("orders_tree"):
+                return
+            if not orders:
+                self.drop_order_row(order_id)
+                return
+            order = orders[0]
+            iid = str(order[0])
+            if self.orders_tree.exists(iid):
+                self.orders_sync.upsert(self.format_order_row(order))
+                self.orders_loaded = [order if row[0] == order[0] else row for row in self.orders_loaded]
+            elif op == "INSERT":
+                # Новые заказы - в начало списка (сортировка по дате создания по убыванию)
+                self.orders_sync.upsert(self.format_order_row(order), index=0)
+                if self.current_user["role"] == "admin":
+                    self.orders_loaded.insert(0, order)
+        
+        self.execute_query_async(query, params, apply_row)
+    
+    def drop_order_row(self, order_id):
+        """Убирает заказ из списка на экране"""
+        self.orders_sync.remove(order_id)
+        self.orders_loaded = [row for row in self.orders_loaded if row[0] != order_id]
+    
+    def format_order_row(self, order):
+        """Строка таблицы заказов из записи (id, стол, статус, сумма, дата)"""
+        order_id, table_id, status, total, created_at = order
+        return (
+            order_id,
+            f"Стол №{table_id}",
+            status,
+            f"{total} руб.",
+            created_at.strftime("%Y-%m-%d %H:%M") if isinstance(created_at, datetime) else created_at
+        )
     
     def update_current_order_view(self):
         """Обновляет отображение текущего заказа"""
@@ -1047,172 +3760,64 @@ class RestaurantApp:
         # Обновляем итоговую сумму
         self.order_total_label.config(text=f"Итого: {self.current_order['total']:.2f} руб.")
 
-        def save_order(self):
-            """Сохраняет заказ"""
-            try:
-                table_str = self.order_table_combobox.get()
-                client_name = self.order_client_entry.get()
-                
-                if not table_str or not client_name or not self.current_order["items"]:
-                    messagebox.showerror("Ошибка", "Заполните все поля и добавьте хотя бы одно блюдо")
-                    return
-                
-                # Извлекаем номер стола из строки (формат: "№1 (мест: 2)")
-                table_id = int(table_str.split("№")[1].split(" ")[0])
-                
-                # Проверяем вместимость стола
-                table_query = "SELECT capacity FROM tables WHERE id = %s"
-                table = self.execute_query(table_query, (table_id,), fetch=True)
-                
-                if not table:
-                    messagebox.showerror("Ошибка", "Стол не найден")
-                    return
-                    
-                # Проверяем, не занят ли стол другим заказом
-                order_check = """
-                    SELECT id FROM orders 
-                    WHERE table_id = %s AND status = 'active'
-                """
-                active_order = self.execute_query(order_check, (table_id,), fetch=True)
-                
-                if active_order:
-                    messagebox.showerror("Ошибка", "Стол уже занят другим заказом")
-                    return
-                
-                # Проверяем, не забронирован ли стол
-                reservation_check = """
-                    SELECT id FROM reservations 
-                    WHERE table_id = %s AND status = 'active'
-                    AND date = CURRENT_DATE
-                    AND start_time <= CURRENT_TIME AND end_time >= CURRENT_TIME
-                """
-                active_reservation = self.execute_query(reservation_check, (table_id,), fetch=True)
-                
-                if active_reservation and self.current_user["role"] == "client":
-                    # Для клиента проверяем, его ли это бронь
-                    reservation_owner_check = """
-                        SELECT id FROM reservations 
-                        WHERE table_id = %s AND status = 'active'
-                        AND date = CURRENT_DATE
-                        AND start_time <= CURRENT_TIME AND end_time >= CURRENT_TIME
-                        AND client_id = %s
-                    """
-                    owner_reservation = self.execute_query(
-                        reservation_owner_check, 
-                        (table_id, self.current_user["id"]), 
-                        fetch=True
-                    )
-                    
-                    if not owner_reservation:
-                        messagebox.showerror("Ошибка", "Стол забронирован другим клиентом")
-                        return
-                
-                # Определяем waiter_id в зависимости от роли
-                if self.current_user["role"] == "client":
-                    # Для клиента находим официанта, закрепленного за столом
-                    waiter_query = """
-                        SELECT waiter_id FROM waiter_tables 
-                        WHERE table_id = %s LIMIT 1
-                    """
-                    waiter = self.execute_query(waiter_query, (table_id,), fetch=True)
-                    if not waiter:
-                        messagebox.showerror("Ошибка", "Не найден официант для этого стола")
-                        return
-                    waiter_id = waiter[0][0]
-                else:
-                    # Для официанта/админа используем текущего пользователя
-                    waiter_id = self.current_user["id"]
-                
-                # Создаем заказ в БД
-                query = """
-                    INSERT INTO orders 
-                    (table_id, client_id, waiter_id, status, total) 
-                    VALUES (%s, %s, %s, 'active', %s)
-                    RETURNING id
-                """
-                result = self.execute_query(
-                    query,
-                    (
-                        table_id,
-                        self.current_user["id"],
-                        waiter_id,
-                        self.current_order["total"]
-                    ),
-                    fetch=True
-                )
-                
-                if not result:
-                    messagebox.showerror("Ошибка", "Не удалось создать заказ")
-                    return
-                    
-                order_id = result[0][0]
-                
-                # Добавляем элементы заказа
-                for item in self.current_order["items"]:
-                    # Добавляем элемент заказа
-                    item_query = """
-                        INSERT INTO order_items 
-                        (order_id, dish_id, quantity, price) 
-                        VALUES (%s, %s, %s, %s)
-                    """
-                    self.execute_query(
-                        item_query,
-                        (order_id, item["dish_id"], item["quantity"], item["price"])
-                    )
-                    
-                    # Уменьшаем количество блюд на складе
-                    update_query = """
-                        UPDATE dishes 
-                        SET quantity = quantity - %s 
-                        WHERE id = %s
-                    """
-                    self.execute_query(update_query, (item["quantity"], item["dish_id"]))
-                
-                messagebox.showinfo("Успех", f"Заказ №{order_id} успешно создан")
-                self.show_orders_screen()
-            
-            except ValueError as e:
-                messagebox.showerror("Ошибка", f"Ошибка при создании заказа: {str(e)}")
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Неожиданная ошибка: {str(e)}")
+    def update_dish_search(self, event=None):
+        """Обновляет результаты поиска блюда по набранному тексту"""
+        if event is not None and event.keysym in ("Return", "Down", "Up", "Tab"):
+            return
+        dishes = self.menu.search_index().search(self.order_dish_search.get())
+        self.order_dish_results_sync.apply(
+            (dish["id"], dish["name"], dish["category"], f"{dish['price']:.2f} руб.", dish["quantity"])
+            for dish in dishes
+        )
+        # Первый результат выбран сразу: Enter в поле поиска добавляет его в заказ
+        rows = self.order_dish_results.get_children()
+        if rows:
+            self.order_dish_results.selection_set(rows[0])
+            self.order_dish_results.see(rows[0])
 
     def add_dish_to_order(self):
         """Добавляет блюдо в текущий заказ"""
         try:
-            dish_str = self.order_dish_combobox.get()
+            selected = self.order_dish_results.selection()
             quantity = int(self.order_quantity_entry.get())
             
-            if not dish_str or quantity <= 0:
+            if not selected or quantity <= 0:
                 messagebox.showerror("Ошибка", "Выберите блюдо и укажите количество")
                 return
             
-            # Находим блюдо в меню
-            dish_name = dish_str.split(" (")[0]
-            query = "SELECT id, name, price, quantity FROM dishes WHERE name = %s"
-            dish = self.execute_query(query, (dish_name,), fetch=True)
+            # Строка результата хранит id блюда, само блюдо берем из каталога меню
+            dish = self.menu.dish(int(selected[0]))
             
             if not dish:
                 messagebox.showerror("Ошибка", "Блюдо не найдено")
                 return
                 
-            dish_id, name, price, available_quantity = dish[0]
+            dish_id, name, price = dish["id"], dish["name"], dish["price"]
             
-            # Проверяем доступное количество
-            if available_quantity < quantity:
-                messagebox.showerror("Ошибка", 
-                    f"Недостаточно порций блюда '{name}'. Доступно: {available_quantity}")
+            # Порции резервируются на складе сразу: проверка остатка и списание -
+            # один запрос, так что последние порции не уйдут одновременно на два терминала
+            try:
+                self.service.hold_stock(self.current_order["cart_id"], [{"dish_id": dish_id, "quantity": quantity}])
+            except ServiceError as e:
+                messagebox.showerror("Ошибка", str(e))
                 return
+            except psycopg2.Error as e:
+                if not self.db_unreachable(e):
+                    logging.error(f"Service error in hold_stock: {str(e)}")
+                    messagebox.showerror("Ошибка БД", f"Ошибка при выполнении запроса: {str(e)}")
+                    return
+                # Без связи блюдо идет в корзину без резерва по остатку из каталога;
+                # склад спишет досылка заказа тем же проверяющим запросом
+                in_cart = sum(item["quantity"] for item in self.current_order["items"] if item["dish_id"] == dish_id)
+                if dish["quantity"] < in_cart + quantity:
+                    messagebox.showerror("Ошибка", f"Недостаточно порций блюда '{name}'. Доступно: {dish['quantity']}")
+                    return
             
             # Проверяем, есть ли уже это блюдо в заказе
             existing_item = next((item for item in self.current_order["items"] 
                             if item["dish_id"] == dish_id), None)
             
             if existing_item:
-                # Проверяем, не превысит ли новое количество доступное
-                if existing_item["quantity"] + quantity > available_quantity:
-                    messagebox.showerror("Ошибка",
-                        f"Общее количество превышает доступное ({available_quantity})")
-                    return
                 # Обновляем существующую позицию
                 existing_item["quantity"] += quantity
                 existing_item["total"] = existing_item["price"] * existing_item["quantity"]
@@ -1235,6 +3840,9 @@ class RestaurantApp:
             
             self.order_quantity_entry.delete(0, tk.END)
             self.order_quantity_entry.insert(0, "1")
+            self.order_dish_search.delete(0, tk.END)
+            self.update_dish_search()
+            self.order_dish_search.focus_set()
         
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректное количество")
@@ -1251,122 +3859,34 @@ class RestaurantApp:
             
             # Извлекаем номер стола из строки (формат: "№1 (мест: 2)")
             table_id = int(table_str.split("№")[1].split(" ")[0])
-            
-            # Проверяем вместимость стола
-            table_query = "SELECT capacity FROM tables WHERE id = %s"
-            table = self.execute_query(table_query, (table_id,), fetch=True)
-            
-            if not table:
-                messagebox.showerror("Ошибка", "Стол не найден")
-                return
-                
-            # Проверяем, не занят ли стол другим заказом
-            order_check = """
-                SELECT id FROM orders 
-                WHERE table_id = %s AND status = 'active'
-            """
-            active_order = self.execute_query(order_check, (table_id,), fetch=True)
-            
-            if active_order:
-                messagebox.showerror("Ошибка", "Стол уже занят другим заказом")
-                return
-            
-            # Проверяем, не забронирован ли стол
-            reservation_check = """
-                SELECT id FROM reservations 
-                WHERE table_id = %s AND status = 'active'
-                AND date = CURRENT_DATE
-                AND start_time <= CURRENT_TIME AND end_time >= CURRENT_TIME
-            """
-            active_reservation = self.execute_query(reservation_check, (table_id,), fetch=True)
-            
-            if active_reservation and self.current_user["role"] == "client":
-                # Для клиента проверяем, его ли это бронь
-                reservation_owner_check = """
-                    SELECT id FROM reservations 
-                    WHERE table_id = %s AND status = 'active'
-                    AND date = CURRENT_DATE
-                    AND start_time <= CURRENT_TIME AND end_time >= CURRENT_TIME
-                    AND client_id = %s
-                """
-                owner_reservation = self.execute_query(
-                    reservation_owner_check, 
-                    (table_id, self.current_user["id"]), 
-                    fetch=True
-                )
-                
-                if not owner_reservation:
-                    messagebox.showerror("Ошибка", "Стол забронирован другим клиентом")
-                    return
-            
-            # Определяем waiter_id в зависимости от роли
-            if self.current_user["role"] == "client":
-                # Для клиента находим официанта, закрепленного за столом
-                waiter_query = """
-                    SELECT waiter_id FROM waiter_tables 
-                    WHERE table_id = %s LIMIT 1
-                """
-                waiter = self.execute_query(waiter_query, (table_id,), fetch=True)
-                if not waiter:
-                    messagebox.showerror("Ошибка", "Не найден официант для этого стола")
-                    return
-                waiter_id = waiter[0][0]
-            else:
-                # Для официанта/админа используем текущего пользователя
-                waiter_id = self.current_user["id"]
-            
-            # Создаем заказ в БД
-            query = """
-                INSERT INTO orders 
-                (table_id, client_id, waiter_id, status, total) 
-                VALUES (%s, %s, %s, 'active', %s)
-                RETURNING id
-            """
-            result = self.execute_query(
-                query,
-                (
-                    table_id,
-                    self.current_user["id"],
-                    waiter_id,
-                    self.current_order["total"]
-                ),
-                fetch=True
-            )
-            
-            if not result:
-                messagebox.showerror("Ошибка", "Не удалось создать заказ")
-                return
-                
-            order_id = result[0][0]
-            
-            # Добавляем элементы заказа
-            for item in self.current_order["items"]:
-                # Добавляем элемент заказа
-                item_query = """
-                    INSERT INTO order_items 
-                    (order_id, dish_id, quantity, price) 
-                    VALUES (%s, %s, %s, %s)
-                """
-                self.execute_query(
-                    item_query,
-                    (order_id, item["dish_id"], item["quantity"], item["price"])
-                )
-                
-                # Уменьшаем количество блюд на складе
-                update_query = """
-                    UPDATE dishes 
-                    SET quantity = quantity - %s 
-                    WHERE id = %s
-                """
-                self.execute_query(update_query, (item["quantity"], item["dish_id"]))
-            
-            messagebox.showinfo("Успех", f"Заказ №{order_id} успешно создан")
-            self.show_orders_screen()
-        
         except ValueError as e:
             messagebox.showerror("Ошибка", f"Ошибка при создании заказа: {str(e)}")
+            return
+        
+        try:
+            order_id = self.run_or_defer(self.service.save_order, self.current_user, table_id,
+                                         self.current_order["items"], self.current_order["cart_id"])
+        except ActiveOrderExists as e:
+            if messagebox.askyesno("Подтверждение", 
+                                "У вас уже есть активный заказ на этот стол. Добавить блюда к существующему заказу?"):
+                self.add_items_to_existing_order(e.order_id)
+            return
+        except ServiceError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
         except Exception as e:
-            messagebox.showerror("Ошибка", f"Неожиданная ошибка: {str(e)}")
+            logging.error(f"Error saving order: {str(e)}")
+            messagebox.showerror("Ошибка", f"Не удалось создать заказ: {str(e)}")
+            return
+        
+        # Резерв корзины перешел в заказ
+        self.current_order = None
+        if isinstance(order_id, Deferred):
+            messagebox.showinfo("Успех", f"Заказ принят{self.deferred_note(order_id)}")
+        else:
+            messagebox.showinfo("Успех", f"Заказ №{order_id} успешно создан")
+        self.mark_screens_stale("orders", "dishes")
+        self.show_orders_screen()
     
     def view_order_details(self):
         """Показывает детали выбранного заказа"""
@@ -1456,64 +3976,18 @@ class RestaurantApp:
     
     def pay_order(self, order_id, window):
         """Обрабатывает оплату заказа"""
-        query = "UPDATE orders SET status = 'paid' WHERE id = %s"
-        if self.execute_query(query, (order_id,)):
-            messagebox.showinfo("Успех", f"Заказ №{order_id} успешно оплачен")
+        result = self.call_service(self.service.pay_order, order_id, "active", defer=True)
+        if result is not False:
+            messagebox.showinfo("Успех", f"Заказ №{order_id} успешно оплачен{self.deferred_note(result)}")
             window.destroy()
-            self.show_orders_screen()
-        else:
-            messagebox.showerror("Ошибка", "Не удалось оплатить заказ")
+            if self.is_visible("orders_tree"):
+                self.update_orders_view()
+            else:
+                self.show_orders_screen()
     
     def generate_receipt(self, order_id):
         """Генерирует чек для заказа"""
-        # Получаем информацию о заказе
-        order_query = """
-            SELECT o.id, t.id, c.full_name, o.total, o.created_at
-            FROM orders o
-            JOIN tables t ON o.table_id = t.id
-            JOIN users c ON o.client_id = c.id
-            WHERE o.id = %s
-        """
-        order = self.execute_query(order_query, (order_id,), fetch=True)
-        
-        if not order:
-            return None
-            
-        order = order[0]
-        
-        # Получаем элементы заказа с группировкой
-        items_query = """
-            SELECT d.name, oi.price, SUM(oi.quantity) as quantity, 
-                SUM(oi.price * oi.quantity) as total
-            FROM order_items oi
-            JOIN dishes d ON oi.dish_id = d.id
-            WHERE oi.order_id = %s
-            GROUP BY d.name, oi.price
-            ORDER BY d.name
-        """
-        items = self.execute_query(items_query, (order_id,), fetch=True) or []
-        
-        # Формируем чек
-        receipt = f"""
-            Ресторан "Гурман"
-            ----------------------------
-            Чек №{order[0]}
-            Стол: №{order[1]}
-            Клиент: {order[2]}
-            Дата: {order[4].strftime('%Y-%m-%d %H:%M') if isinstance(order[4], datetime) else order[4]}
-            ----------------------------
-        """
-        
-        for item in items:
-            receipt += f"{item[0]} - {item[1]} руб. x {item[2]} = {item[3]} руб.\n"
-        
-        receipt += f"""
-            ----------------------------
-            Итого: {order[3]} руб.
-            Спасибо за посещение!
-        """
-        
-        return receipt
+        return self.call_service(self.service.generate_receipt, order_id) or None
     
     def print_receipt(self, order_id):
         """Печатает чек для заказа"""
@@ -1526,15 +4000,13 @@ class RestaurantApp:
         messagebox.showinfo("Чек", receipt)
         
         # Добавляем запись о печати чека в БД
-        self.execute_query(
-            "UPDATE orders SET receipt_printed = TRUE WHERE id = %s",
-            (order_id,)
-        )
+        self.call_service(self.service.mark_receipt_printed, order_id)
     
     def show_menu_screen(self):
         """Показывает экран меню"""
-        self.clear_content_area()
-        
+        self.show_cached_screen("menu", self.build_menu_screen, self.update_menu_view)
+    
+    def build_menu_screen(self):
         title = ttk.Label(self.content_area, text="Меню ресторана", font=('Helvetica', 16))
         title.pack(pady=10)
         
@@ -1555,18 +4027,8 @@ class RestaurantApp:
         self.menu_tree.column("quantity", width=100)
         
         self.menu_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        # Заполняем таблицу из БД
-        query = """
-            SELECT d.id, d.name, dc.name, d.price, d.quantity
-            FROM dishes d
-            JOIN dish_categories dc ON d.category_id = dc.id
-            ORDER BY d.name
-        """
-        dishes = self.execute_query(query, fetch=True) or []
-        
-        for dish in dishes:
-            self.menu_tree.insert("", tk.END, values=dish)
+        self.menu_sync = TreeviewSync(self.menu_tree)
+        self.update_menu_view()
         
         # Кнопки действий (только для администратора)
         if self.current_user and self.current_user["role"] == "admin":
@@ -1577,6 +4039,13 @@ class RestaurantApp:
             ttk.Button(btn_frame, text="Редактировать", command=self.show_edit_dish_screen).pack(side=tk.LEFT, padx=5)
             ttk.Button(btn_frame, text="Удалить", command=self.delete_dish).pack(side=tk.LEFT, padx=5)
     
+    def update_menu_view(self):
+        """Заполняет таблицу из каталога меню"""
+        self.menu_sync.apply(
+            (dish["id"], dish["name"], dish["category"], dish["price"], dish["quantity"])
+            for dish in self.menu.dishes()
+        )
+    
     def show_add_dish_screen(self):
         """Показывает экран добавления блюда"""
         self.clear_content_area()
@@ -1599,9 +4068,7 @@ class RestaurantApp:
         self.dish_category_combobox.grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
         
         # Заполняем список категорий
-        categories_query = "SELECT id, name FROM dish_categories"
-        categories = self.execute_query(categories_query, fetch=True) or []
-        self.dish_categories = {name: id for id, name in categories}
+        self.dish_categories = self.menu.category_ids()
         self.dish_category_combobox["values"] = list(self.dish_categories.keys())
         if self.dish_categories:
             self.dish_category_combobox.current(0)
@@ -1637,27 +4104,15 @@ class RestaurantApp:
             price = float(self.dish_price_entry.get())
             quantity = int(self.dish_quantity_entry.get())
             description = self.dish_description_entry.get()
-            
-            if not all([name, category]) or price <= 0 or quantity < 0:
-                messagebox.showerror("Ошибка", "Заполните все обязательные поля корректно")
-                return
-            
-            category_id = self.dish_categories.get(category)
-            if not category_id:
-                messagebox.showerror("Ошибка", "Выберите корректную категорию")
-                return
-            
-            query = """
-                INSERT INTO dishes 
-                (name, category_id, price, quantity, description) 
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            if self.execute_query(query, (name, category_id, price, quantity, description)):
-                messagebox.showinfo("Успех", f"Блюдо '{name}' успешно добавлено")
-                self.show_menu_screen()
-        
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректные данные в полях")
+            return
+        
+        category_id = self.dish_categories.get(category)
+        if self.call_service(self.service.add_dish, name, category_id, price, quantity, description) is not False:
+            messagebox.showinfo("Успех", f"Блюдо '{name}' успешно добавлено")
+            self.mark_screens_stale("dishes")
+            self.show_menu_screen()
     
     def show_edit_dish_screen(self):
         """Показывает экран редактирования блюда"""
@@ -1669,20 +4124,15 @@ class RestaurantApp:
         item = self.menu_tree.item(selected_item[0])
         dish_id = item["values"][0]
         
-        # Получаем данные блюда из БД
-        query = "SELECT name, category_id, price, quantity, description FROM dishes WHERE id = %s"
-        dish = self.execute_query(query, (dish_id,), fetch=True)
+        # Данные блюда берем из каталога меню
+        dish = self.menu.dish(dish_id)
         
         if not dish:
             messagebox.showerror("Ошибка", "Блюдо не найдено")
             return
-            
-        name, category_id, price, quantity, description = dish[0]
         
-        # Получаем название категории
-        category_query = "SELECT name FROM dish_categories WHERE id = %s"
-        category = self.execute_query(category_query, (category_id,), fetch=True)
-        category_name = category[0][0] if category else ""
+        name, price, quantity, description = dish["name"], dish["price"], dish["quantity"], dish["description"]
+        category_name = dish["category"]
         
         self.clear_content_area()
         
@@ -1705,9 +4155,7 @@ class RestaurantApp:
         self.edit_dish_category_combobox.grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
         
         # Заполняем список категорий
-        categories_query = "SELECT id, name FROM dish_categories"
-        categories = self.execute_query(categories_query, fetch=True) or []
-        self.edit_dish_categories = {name: id for id, name in categories}
+        self.edit_dish_categories = self.menu.category_ids()
         self.edit_dish_category_combobox["values"] = list(self.edit_dish_categories.keys())
         
         # Устанавливаем текущую категорию
@@ -1748,28 +4196,17 @@ class RestaurantApp:
             price = float(self.edit_dish_price_entry.get())
             quantity = int(self.edit_dish_quantity_entry.get())
             description = self.edit_dish_description_entry.get()
-            
-            if not all([name, category]) or price <= 0 or quantity < 0:
-                messagebox.showerror("Ошибка", "Заполните все обязательные поля корректно")
-                return
-            
-            category_id = self.edit_dish_categories.get(category)
-            if not category_id:
-                messagebox.showerror("Ошибка", "Выберите корректную категорию")
-                return
-            
-            query = """
-                UPDATE dishes 
-                SET name = %s, category_id = %s, price = %s, 
-                    quantity = %s, description = %s
-                WHERE id = %s
-            """
-            if self.execute_query(query, (name, category_id, price, quantity, description, dish_id)):
-                messagebox.showinfo("Успех", f"Блюдо '{name}' успешно обновлено")
-                self.show_menu_screen()
-        
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректные данные в полях")
+            return
+        
+        category_id = self.edit_dish_categories.get(category)
+        if self.call_service(
+            self.service.update_dish, dish_id, name, category_id, price, quantity, description
+        ) is not False:
+            messagebox.showinfo("Успех", f"Блюдо '{name}' успешно обновлено")
+            self.mark_screens_stale("dishes")
+            self.show_menu_screen()
     
     def delete_dish(self):
         """Удаляет выбранное блюдо"""
@@ -1782,22 +4219,7 @@ class RestaurantApp:
         dish_id = item["values"][0]
         dish_name = item["values"][1]
         
-        # Проверяем, есть ли это блюдо в заказах
-        check_query = """
-            SELECT COUNT(*) 
-            FROM order_items 
-            WHERE dish_id = %s
-        """
-        result = self.execute_query(check_query, (dish_id,), fetch=True)
-        
-        if result and result[0][0] > 0:
-            messagebox.showerror("Ошибка", 
-                f"Блюдо '{dish_name}' нельзя удалить, так как оно есть в заказах")
-            return
-        
-        # Удаляем блюдо
-        delete_query = "DELETE FROM dishes WHERE id = %s"
-        if self.execute_query(delete_query, (dish_id,)):
+        if self.call_service(self.service.delete_dish, dish_id) is not False:
             messagebox.showinfo("Успех", f"Блюдо '{dish_name}' успешно удалено")
             self.show_menu_screen()
     
@@ -1806,9 +4228,9 @@ class RestaurantApp:
         if not self.current_user or self.current_user["role"] != "admin":
             messagebox.showerror("Ошибка", "Доступ запрещен")
             return
-        
-        self.clear_content_area()
-        
+        self.show_cached_screen("stats", self.build_stats_screen, self.refresh_stats_screen)
+    
+    def build_stats_screen(self):
         title = ttk.Label(self.content_area, text="Статистика", font=('Helvetica', 16))
         title.pack(pady=10)
         
@@ -1922,7 +4344,9 @@ class RestaurantApp:
         
         self.waiters_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        # Обновляем данные
+        self.refresh_stats_screen()
+    
+    def refresh_stats_screen(self):
         self.update_sales_stats()
         self.update_reservations_stats()
         self.update_waiters_stats()
@@ -1932,36 +4356,18 @@ class RestaurantApp:
         try:
             month = int(self.sales_month_combobox.get())
             year = int(self.sales_year_entry.get())
+            query, params = sales_stats_query(month, year)
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректный месяц или год")
             return
         
-        # Очищаем таблицу
-        for item in self.sales_tree.get_children():
-            self.sales_tree.delete(item)
+        def fill_stats(stats):
+            self.clear_loading(self.sales_tree)
+            for row in build_sales_rows(stats):
+                self.sales_tree.insert("", tk.END, values=row)
         
-        # Получаем статистику продаж из БД
-        query = """
-            SELECT dc.name, d.name, SUM(oi.quantity), SUM(oi.price * oi.quantity)
-            FROM order_items oi
-            JOIN dishes d ON oi.dish_id = d.id
-            JOIN dish_categories dc ON d.category_id = dc.id
-            JOIN orders o ON oi.order_id = o.id
-            WHERE EXTRACT(MONTH FROM o.created_at) = %s 
-            AND EXTRACT(YEAR FROM o.created_at) = %s
-            GROUP BY dc.name, d.name
-            ORDER BY dc.name, d.name
-        """
-        stats = self.execute_query(query, (month, year), fetch=True) or []
-        
-        # Заполняем таблицу
-        for category, dish, quantity, total in stats:
-            self.sales_tree.insert("", tk.END, values=(
-                category,
-                dish,
-                quantity,
-                f"{total} руб."
-            ))
+        self.show_loading(self.sales_tree)
+        self.execute_query_async(query, params, fill_stats, widget=self.sales_tree)
     
     def update_reservations_stats(self):
         """Обновляет статистику бронирований"""
@@ -1972,10 +4378,6 @@ class RestaurantApp:
             messagebox.showerror("Ошибка", "Некорректный месяц или год")
             return
         
-        # Очищаем таблицу
-        for item in self.reservations_tree.get_children():
-            self.reservations_tree.delete(item)
-        
         # Получаем статистику бронирований из БД
         query = """
             SELECT t.id, COUNT(r.id)
@@ -1987,58 +4389,71 @@ class RestaurantApp:
             GROUP BY t.id
             ORDER BY t.id
         """
-        stats = self.execute_query(query, (month, year), fetch=True) or []
+        def fill_stats(stats):
+            self.clear_loading(self.reservations_tree)
+            for table_id, count in stats:
+                self.reservations_tree.insert("", tk.END, values=(
+                    f"Стол №{table_id}",
+                    count
+                ))
         
-        # Заполняем таблицу
-        for table_id, count in stats:
-            self.reservations_tree.insert("", tk.END, values=(
-                f"Стол №{table_id}",
-                count
-            ))
+        self.show_loading(self.reservations_tree)
+        self.execute_query_async(query, (month, year), fill_stats, widget=self.reservations_tree)
     
     def update_waiters_stats(self):
         """Обновляет статистику по официантам"""
         try:
             month = int(self.waiter_month_combobox.get())
             year = int(self.waiter_year_entry.get())
+            period_start, period_end = month_range(month, year)
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректный месяц или год")
             return
         
-        # Очищаем таблицу
-        for item in self.waiters_tree.get_children():
-            self.waiters_tree.delete(item)
-        
-        # Исправленный запрос
+        # Заказы и смены агрегируются по официанту отдельно и только потом
+        # соединяются: каждая сторона дает не больше одной строки на официанта,
+        # поэтому суммы не умножаются друг на друга
         query = """
             SELECT 
                 w.full_name,
-                COUNT(o.id) as orders_count,
-                COUNT(o.id) FILTER (WHERE o.status = 'paid') as paid_count,
-                COALESCE(SUM(o.total) FILTER (WHERE o.status = 'paid'), 0) as total_sum,
-                COALESCE(SUM(s.tips), 0) as tips_sum
+                COALESCE(o.orders_count, 0),
+                COALESCE(o.paid_count, 0),
+                COALESCE(o.total_sum, 0),
+                COALESCE(s.tips_sum, 0)
             FROM users w
-            LEFT JOIN orders o ON w.id = o.waiter_id
-            AND EXTRACT(MONTH FROM o.created_at) = %s
-            AND EXTRACT(YEAR FROM o.created_at) = %s
-            LEFT JOIN shifts s ON w.id = s.waiter_id
-            AND EXTRACT(MONTH FROM s.start_time) = %s
-            AND EXTRACT(YEAR FROM s.start_time) = %s
+            LEFT JOIN (
+                SELECT waiter_id,
+                       COUNT(*) AS orders_count,
+                       COUNT(*) FILTER (WHERE status = 'paid') AS paid_count,
+                       SUM(total) FILTER (WHERE status = 'paid') AS total_sum
+                FROM orders
+                WHERE created_at >= %(start)s AND created_at < %(end)s
+                GROUP BY waiter_id
+            ) o ON o.waiter_id = w.id
+            LEFT JOIN (
+                SELECT waiter_id, SUM(tips) AS tips_sum
+                FROM shifts
+                WHERE start_time >= %(start)s AND start_time < %(end)s
+                GROUP BY waiter_id
+            ) s ON s.waiter_id = w.id
             WHERE w.role_id = 2  -- Официанты
-            GROUP BY w.full_name
-            ORDER BY w.full_name
+            ORDER BY w.full_name, w.id
         """
-        stats = self.execute_query(query, (month, year, month, year), fetch=True) or []
-        
-        # Заполняем таблицу
-        for waiter, orders, payments, total, tips in stats:
-            self.waiters_tree.insert("", tk.END, values=(
-                waiter,
-                orders,
-                payments,
-                f"{total} руб.",
-                f"{tips:.2f} руб."
-            ))
+        def fill_stats(stats):
+            self.clear_loading(self.waiters_tree)
+            for waiter, orders, payments, total, tips in stats:
+                self.waiters_tree.insert("", tk.END, values=(
+                    waiter,
+                    orders,
+                    payments,
+                    f"{total} руб.",
+                    f"{tips:.2f} руб."
+                ))
+        
+        self.show_loading(self.waiters_tree)
+        self.execute_query_async(
+            query, {"start": period_start, "end": period_end}, fill_stats, widget=self.waiters_tree
+        )
     
 
     def show_client_receipts(self):
@@ -2061,9 +4476,19 @@ class RestaurantApp:
         client_combobox["values"] = [f"{c[1]} (ID: {c[0]})" for c in clients]
         client_combobox.pack(pady=5)
         
-        # Поля для периода
-        ttk.Label(receipts_window, text="Период:").pack()
-        period_frame = ttk.Frame(receipts_window)
+        def selected_client():
+            client_str = client_var.get()
+            if not client_str:
+                return None
+            return int(client_str.split("ID: ")[1].rstrip(")")), f"Чеки клиента {client_str}"
+        
+        self.receipt_history_panel(receipts_window, selected_client, "Загрузить чеки")
+    
+    def receipt_history_panel(self, window, selected_client, load_text):
+        """Период, текстовое поле и кнопки загрузки/экспорта истории чеков в окне window.
+        selected_client() -> (id клиента, заголовок) или None"""
+        ttk.Label(window, text="Период:").pack()
+        period_frame = ttk.Frame(window)
         period_frame.pack(pady=5)
         
         ttk.Label(period_frame, text="С:").pack(side=tk.LEFT)
@@ -2076,47 +4501,85 @@ class RestaurantApp:
         end_entry.pack(side=tk.LEFT, padx=5)
         end_entry.insert(0, datetime.now().strftime("%Y-%m-%d"))
         
-        text_area = tk.Text(receipts_window, height=20, width=60)
+        text_area = tk.Text(window, height=20, width=60)
         text_area.pack(pady=10)
         
+        # Чтение прерывается, когда окно закрыто или запущена новая загрузка
+        loading = {"cancelled": threading.Event()}
+        window.bind("<Destroy>", lambda event: loading["cancelled"].set(), add="+")
+        
+        def history_request():
+            client = selected_client()
+            if not client:
+                return None
+            start_date, end_date = start_entry.get(), end_entry.get()
+            try:
+                query, params = receipt_history_query(client[0], start_date, end_date)
+            except ValueError:
+                messagebox.showerror("Ошибка", "Некорректная дата (ожидается ГГГГ-ММ-ДД)")
+                return None
+            heading = f"{client[1]}\nПериод: с {start_date} по {end_date}\n\n"
+            return query, params, heading
+        
         def load_receipts():
-            client_str = client_var.get()
-            if not client_str:
+            request = history_request()
+            if not request:
                 return
-                
-            client_id = int(client_str.split("ID: ")[1].rstrip(")"))
-            start_date = start_entry.get()
-            end_date = end_entry.get()
-            
-            query = """
-                SELECT o.id, o.created_at, o.total, 
-                    STRING_AGG(d.name || ' (' || oi.quantity || 'x' || oi.price || ' руб.)', ', ')
-                FROM orders o
-                JOIN order_items oi ON o.id = oi.order_id
-                JOIN dishes d ON oi.dish_id = d.id
-                WHERE o.client_id = %s 
-                AND o.created_at::date BETWEEN %s AND %s
-                GROUP BY o.id
-                ORDER BY o.created_at
-            """
-            orders = self.execute_query(query, (client_id, start_date, end_date), fetch=True) or []
+            query, params, heading = request
+            loading["cancelled"].set()
+            loading["cancelled"] = cancelled = threading.Event()
             
             text_area.delete(1.0, tk.END)
-            if not orders:
-                text_area.insert(tk.END, "Нет заказов за выбранный период")
+            text_area.insert(tk.END, heading)
+            
+            def on_chunk(orders):
+                if not cancelled.is_set():
+                    text_area.insert(tk.END, format_receipt_history(orders))
+            
+            def on_done(count):
+                if not cancelled.is_set() and not count:
+                    text_area.delete(1.0, tk.END)
+                    text_area.insert(tk.END, "Нет заказов за выбранный период")
+            
+            def on_error(error):
+                messagebox.showerror("Ошибка БД", f"Ошибка при загрузке чеков: {str(error)}")
+            
+            self.db.submit_stream(query, params, on_chunk, on_done, on_error, cancelled)
+        
+        def export_receipts():
+            request = history_request()
+            if not request:
                 return
-                
-            text_area.insert(tk.END, f"Чеки клиента {client_str}\n")
-            text_area.insert(tk.END, f"Период: с {start_date} по {end_date}\n\n")
+            path = filedialog.asksaveasfilename(
+                parent=window, title="Экспорт чеков", defaultextension=".txt",
+                filetypes=[("Текст", "*.txt")]
+            )
+            if not path:
+                return
+            query, params, heading = request
+            
+            def work():
+                # Файл пишется пачками прямо из курсора, без окна и без накопления в памяти
+                count = 0
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(heading)
+                    for orders in self.db.stream(query, params):
+                        f.write(format_receipt_history(orders))
+                        count += len(orders)
+                return count
             
-            for order in orders:
-                text_area.insert(tk.END, f"Заказ №{order[0]} от {order[1].strftime('%Y-%m-%d %H:%M')}\n")
-                text_area.insert(tk.END, f"Блюда: {order[3]}\n")
-                text_area.insert(tk.END, f"Сумма: {order[2]:.2f} руб.\n")
-                text_area.insert(tk.END, "-"*50 + "\n")
+            self.db.run_in_background(
+                work,
+                lambda count: messagebox.showinfo("Экспорт чеков", f"Сохранено чеков: {count}\n{path}"),
+                lambda error: messagebox.showerror("Ошибка", f"Не удалось выгрузить чеки: {str(error)}"),
+                query
+            )
         
-        ttk.Button(receipts_window, text="Загрузить чеки", command=load_receipts).pack()
-
+        btn_frame = ttk.Frame(window)
+        btn_frame.pack()
+        ttk.Button(btn_frame, text=load_text, command=load_receipts).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Экспорт в файл...", command=export_receipts).pack(side=tk.LEFT, padx=5)
+    
     def show_create_order_screen(self):
         """Показывает экран создания заказа"""
         if not self.current_user or self.current_user["role"] not in ["waiter", "admin", "client"]:
@@ -2157,27 +4620,40 @@ class RestaurantApp:
         if self.current_user:
             self.order_client_entry.insert(0, self.current_user["name"])
         
-        # Список блюд
-        ttk.Label(form_frame, text="Добавить блюдо:").grid(row=2, column=0, sticky=tk.E, padx=5, pady=5)
-        self.order_dish_combobox = ttk.Combobox(form_frame, state="readonly")
-        self.order_dish_combobox.grid(row=2, column=1, sticky=tk.W, padx=5, pady=5)
-        
-        # Заполняем список блюд
-        dishes_query = "SELECT id, name, price FROM dishes WHERE quantity > 0"
-        dishes = self.execute_query(dishes_query, fetch=True) or []
-        dish_options = [f"{d[1]} ({d[2]} руб.)" for d in dishes]
-        self.order_dish_combobox["values"] = dish_options
-        if dish_options:
-            self.order_dish_combobox.current(0)
+        # Поиск блюда по мере набора: название или категория
+        ttk.Label(form_frame, text="Найти блюдо:").grid(row=2, column=0, sticky=tk.E, padx=5, pady=5)
+        self.order_dish_search = ttk.Entry(form_frame, width=40)
+        self.order_dish_search.grid(row=2, column=1, sticky=tk.W, padx=5, pady=5)
+        self.order_dish_search.bind("<KeyRelease>", self.update_dish_search)
+        self.order_dish_search.bind("<Return>", lambda e: self.add_dish_to_order())
+        self.order_dish_search.bind("<Down>", lambda e: self.order_dish_results.focus_set())
+        
+        # Результаты поиска; iid строки - id блюда
+        self.order_dish_results = ttk.Treeview(form_frame, columns=("id", "dish", "category", "price", "quantity"),
+                                               displaycolumns=("dish", "category", "price", "quantity"),
+                                               show="headings", height=6, selectmode="browse")
+        self.order_dish_results.heading("dish", text="Блюдо")
+        self.order_dish_results.heading("category", text="Категория")
+        self.order_dish_results.heading("price", text="Цена")
+        self.order_dish_results.heading("quantity", text="Осталось")
+        self.order_dish_results.column("dish", width=200)
+        self.order_dish_results.column("category", width=120)
+        self.order_dish_results.column("price", width=80)
+        self.order_dish_results.column("quantity", width=80)
+        self.order_dish_results.grid(row=3, column=0, columnspan=2, sticky=tk.EW, padx=5, pady=5)
+        self.order_dish_results.bind("<Double-1>", lambda e: self.add_dish_to_order())
+        self.order_dish_results.bind("<Return>", lambda e: self.add_dish_to_order())
+        self.order_dish_results_sync = TreeviewSync(self.order_dish_results)
+        self.update_dish_search()
         
         # Количество
-        ttk.Label(form_frame, text="Количество:").grid(row=3, column=0, sticky=tk.E, padx=5, pady=5)
+        ttk.Label(form_frame, text="Количество:").grid(row=4, column=0, sticky=tk.E, padx=5, pady=5)
         self.order_quantity_entry = ttk.Entry(form_frame)
-        self.order_quantity_entry.grid(row=3, column=1, sticky=tk.W, padx=5, pady=5)
+        self.order_quantity_entry.grid(row=4, column=1, sticky=tk.W, padx=5, pady=5)
         self.order_quantity_entry.insert(0, "1")
         
         # Кнопка добавления блюда
-        ttk.Button(form_frame, text="Добавить в заказ", command=self.add_dish_to_order).grid(row=4, column=1, sticky=tk.W, padx=5, pady=5)
+        ttk.Button(form_frame, text="Добавить в заказ", command=self.add_dish_to_order).grid(row=5, column=1, sticky=tk.W, padx=5, pady=5)
         
         # Текущий заказ (список блюд)
         ttk.Label(self.content_area, text="Текущий заказ:").pack(pady=5)
@@ -2206,10 +4682,11 @@ class RestaurantApp:
         ttk.Button(btn_frame, text="Сохранить заказ", command=self.save_order).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Отменить", command=self.show_orders_screen).pack(side=tk.LEFT, padx=5)
         
-        # Инициализируем текущий заказ
+        # Инициализируем текущий заказ; cart_id - ключ резерва порций на складе
         self.current_order = {
             "items": [],
-            "total": 0
+            "total": 0,
+            "cart_id": uuid.uuid4().hex
         }
 
     def show_client_receipts_for_client(self):
@@ -2220,65 +4697,18 @@ class RestaurantApp:
         receipts_window = tk.Toplevel(self.root)
         receipts_window.title("Мои чеки")
         
-        # Поля для периода
-        ttk.Label(receipts_window, text="Период:").pack()
-        period_frame = ttk.Frame(receipts_window)
-        period_frame.pack(pady=5)
-        
-        ttk.Label(period_frame, text="С:").pack(side=tk.LEFT)
-        start_entry = ttk.Entry(period_frame)
-        start_entry.pack(side=tk.LEFT, padx=5)
-        start_entry.insert(0, (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d"))
-        
-        ttk.Label(period_frame, text="По:").pack(side=tk.LEFT)
-        end_entry = ttk.Entry(period_frame)
-        end_entry.pack(side=tk.LEFT, padx=5)
-        end_entry.insert(0, datetime.now().strftime("%Y-%m-%d"))
-        
-        text_area = tk.Text(receipts_window, height=20, width=60)
-        text_area.pack(pady=10)
-        
-        def load_receipts():
-            start_date = start_entry.get()
-            end_date = end_entry.get()
-            
-            query = """
-                SELECT o.id, o.created_at, o.total, 
-                    STRING_AGG(d.name || ' (' || oi.quantity || 'x' || oi.price || ' руб.)', ', ')
-                FROM orders o
-                JOIN order_items oi ON o.id = oi.order_id
-                JOIN dishes d ON oi.dish_id = d.id
-                WHERE o.client_id = %s 
-                AND o.created_at::date BETWEEN %s AND %s
-                GROUP BY o.id
-                ORDER BY o.created_at
-            """
-            orders = self.execute_query(query, (self.current_user["id"], start_date, end_date), fetch=True) or []
-            
-            text_area.delete(1.0, tk.END)
-            if not orders:
-                text_area.insert(tk.END, "Нет заказов за выбранный период")
-                return
-                
-            text_area.insert(tk.END, f"Мои чеки\n")
-            text_area.insert(tk.END, f"Период: с {start_date} по {end_date}\n\n")
-            
-            for order in orders:
-                text_area.insert(tk.END, f"Заказ №{order[0]} от {order[1].strftime('%Y-%m-%d %H:%M')}\n")
-                text_area.insert(tk.END, f"Блюда: {order[3]}\n")
-                text_area.insert(tk.END, f"Сумма: {order[2]:.2f} руб.\n")
-                text_area.insert(tk.END, "-"*50 + "\n")
-        
-        ttk.Button(receipts_window, text="Загрузить мои чеки", command=load_receipts).pack()
+        self.receipt_history_panel(
+            receipts_window, lambda: (self.current_user["id"], "Мои чеки"), "Загрузить мои чеки"
+        )
 
     def show_sessions_screen(self):
         """Показывает экран статистики по сессиям"""
         if not self.current_user or self.current_user["role"] != "admin":
             messagebox.showerror("Ошибка", "Доступ запрещен")
             return
-        
-        self.clear_content_area()
-        
+        self.show_cached_screen("sessions", self.build_sessions_screen, self.update_sessions_stats)
+    
+    def build_sessions_screen(self):
         title = ttk.Label(self.content_area, text="Статистика по сессиям", font=('Helvetica', 16))
         title.pack(pady=10)
         
@@ -2330,35 +4760,12 @@ class RestaurantApp:
             for item in self.sessions_tree.get_children():
                 self.sessions_tree.delete(item)
             
-            # Упрощенный запрос без информации о заказах и суммах
-            query = """
-                SELECT 
-                    u.full_name as client,
-                    t.id as table_id,
-                    r.date + r.start_time as start_time,
-                    r.date + r.end_time as end_time,
-                    EXTRACT(EPOCH FROM (r.end_time - r.start_time))/60 as duration_min
-                FROM reservations r
-                JOIN users u ON r.client_id = u.id
-                JOIN tables t ON r.table_id = t.id
-                WHERE r.date BETWEEN %s AND %s
-                AND r.status = 'active'
-                ORDER BY r.date DESC, r.start_time DESC
-            """
-            stats = self.execute_query(query, (start_date, end_date), fetch=True) or []
+            query, params = sessions_query(start_date, end_date)
+            stats = self.execute_query(query, params, fetch=True) or []
             
             # Заполняем таблицу
-            for row in stats:
-                client, table, start, end, duration = row
-                duration_str = f"{int(duration//60)}ч {int(duration%60)}м" if duration else "0м"
-                
-                self.sessions_tree.insert("", tk.END, values=(
-                    client,
-                    f"№{table}",
-                    start.strftime("%Y-%m-%d %H:%M") if isinstance(start, datetime) else start,
-                    end.strftime("%Y-%m-%d %H:%M") if isinstance(end, datetime) else end,
-                    duration_str
-                ))
+            for row in build_session_rows(stats):
+                self.sessions_tree.insert("", tk.END, values=row)
                 
             if not stats:
                 messagebox.showinfo("Информация", "Нет данных о сессиях за выбранный период")
@@ -2367,6 +4774,102 @@ class RestaurantApp:
             messagebox.showerror("Ошибка", f"Ошибка при загрузке сессий: {str(e)}")
             logging.error(f"Session stats error: {str(e)}")
 
+    def show_query_stats_screen(self):
+        """Показывает телеметрию запросов к БД (только для администратора)"""
+        if not self.current_user or self.current_user["role"] != "admin":
+            messagebox.showerror("Ошибка", "Доступ запрещен")
+            return
+        # Телеметрия в памяти процесса: перечитать ее ничего не стоит
+        self.show_cached_screen("queries", self.build_query_stats_screen, self.update_query_stats, max_age=0)
+    
+    def build_query_stats_screen(self):
+        telemetry = self.db.telemetry
+        
+        title = ttk.Label(self.content_area, text="Запросы к БД", font=('Helvetica', 16))
+        title.pack(pady=10)
+        
+        # Управление сбором
+        control_frame = ttk.Frame(self.content_area)
+        control_frame.pack(fill=tk.X, pady=5)
+        
+        self.telemetry_enabled_var = tk.BooleanVar(value=telemetry.enabled)
+        ttk.Checkbutton(
+            control_frame, text="Собирать статистику", variable=self.telemetry_enabled_var,
+            command=lambda: setattr(telemetry, "enabled", self.telemetry_enabled_var.get())
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(control_frame, text="Медленный запрос от, мс:").pack(side=tk.LEFT, padx=(15, 0))
+        self.slow_query_entry = ttk.Entry(control_frame, width=8)
+        self.slow_query_entry.pack(side=tk.LEFT, padx=5)
+        self.slow_query_entry.insert(0, telemetry.slow_ms)
+        ttk.Button(control_frame, text="Применить", command=self.apply_slow_query_threshold).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Button(control_frame, text="Обновить", command=self.update_query_stats).pack(side=tk.LEFT, padx=15)
+        ttk.Button(control_frame, text="Сбросить", command=self.reset_query_stats).pack(side=tk.LEFT)
+        
+        # Таблица запросов
+        columns = ("statement", "caller", "count", "p50", "p95", "max", "avg", "rows", "reuses", "histogram")
+        self.query_stats_tree = ttk.Treeview(self.content_area, columns=columns, show="headings")
+        
+        self.query_stats_tree.heading("statement", text="Запрос")
+        self.query_stats_tree.heading("caller", text="Откуда")
+        self.query_stats_tree.heading("count", text="Вызовов")
+        self.query_stats_tree.heading("p50", text="p50, мс")
+        self.query_stats_tree.heading("p95", text="p95, мс")
+        self.query_stats_tree.heading("max", text="Макс, мс")
+        self.query_stats_tree.heading("avg", text="Среднее, мс")
+        self.query_stats_tree.heading("rows", text="Строк")
+        self.query_stats_tree.heading("reuses", text="PREPARE/повторно")
+        self.query_stats_tree.heading("histogram", text="Гистограмма (до N мс: вызовов)")
+        
+        self.query_stats_tree.column("statement", width=220)
+        self.query_stats_tree.column("caller", width=200)
+        for column in ("count", "p50", "p95", "max", "avg", "rows"):
+            self.query_stats_tree.column(column, width=70, anchor=tk.E)
+        self.query_stats_tree.column("reuses", width=110)
+        self.query_stats_tree.column("histogram", width=300)
+        
+        self.query_stats_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.query_stats_sync = TreeviewSync(self.query_stats_tree)
+        
+        ttk.Label(self.content_area, text=f"Медленные запросы пишутся в {SLOW_QUERY_LOG}").pack(pady=5)
+        
+        self.update_query_stats()
+    
+    def update_query_stats(self):
+        """Заполняет таблицу сводкой телеметрии"""
+        prepared = {name: (prepares, reuses) for name, prepares, reuses in self.db.statement_stats()}
+        rows = []
+        for label, name, callers, count, p50, p95, max_ms, avg_ms, avg_rows, buckets in self.db.telemetry.snapshot():
+            bounds = [f"{bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+            histogram = "  ".join(f"{bound}: {hits}" for bound, hits in zip(bounds, buckets) if hits)
+            prepares, reuses = prepared.get(name, ("", ""))
+            rows.append((
+                label,
+                callers,
+                count,
+                f"{p50:.1f}",
+                f"{p95:.1f}",
+                f"{max_ms:.1f}",
+                f"{avg_ms:.1f}",
+                f"{avg_rows:.1f}",
+                f"{prepares}/{reuses}" if prepares != "" else "",
+                histogram,
+            ))
+        self.query_stats_sync.apply(rows)
+    
+    def apply_slow_query_threshold(self):
+        try:
+            threshold = float(self.slow_query_entry.get())
+        except ValueError:
+            messagebox.showerror("Ошибка", "Порог должен быть числом")
+            return
+        self.db.telemetry.slow_ms = threshold
+    
+    def reset_query_stats(self):
+        self.db.telemetry.reset()
+        self.update_query_stats()
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = RestaurantApp(root)
@@ -0,0 +1,45 @@
+"""Подбор стола (TableAllocator) без БД и окна.
+
+Запуск: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from datetime import date, datetime, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import TableAllocator  # noqa: E402
+
+DAY = date(2025, 6, 1)
+
+
+def at(day, hour, minute=0):
+    return datetime.combine(day, time(hour, minute))
+
+
+class TableAllocatorMidnightTest(unittest.TestCase):
+    def test_booking_past_midnight_blocks_its_evening(self):
+        # Бронь стола 1 с 22:00 до 01:00 следующего дня
+        allocator = TableAllocator(DAY, [(1, 4), (2, 4)], [(1, 1, DAY, time(22, 0), time(1, 0))])
+        self.assertEqual(allocator.rank(2, at(DAY, 23), at(DAY, 23, 30)), [(2, 4)])
+
+    def test_yesterdays_booking_blocks_the_small_hours(self):
+        yesterday = date(2025, 5, 31)
+        allocator = TableAllocator(DAY, [(1, 4), (2, 4)], [(1, 1, yesterday, time(23, 0), time(2, 0))])
+        self.assertEqual(allocator.rank(2, at(DAY, 0, 30), at(DAY, 1, 30)), [(2, 4)])
+        self.assertEqual(allocator.rank(2, at(DAY, 2), at(DAY, 3)), [(1, 4), (2, 4)])
+
+    def test_request_past_midnight_meets_next_morning(self):
+        tomorrow = date(2025, 6, 2)
+        allocator = TableAllocator(DAY, [(1, 4), (2, 4)], [(1, 1, tomorrow, time(0, 30), time(2, 0))])
+        # 23:00-01:00: конец раньше начала - до часу ночи следующего дня
+        self.assertEqual(allocator.rank(2, at(DAY, 23), at(DAY, 1)), [(2, 4)])
+
+    def test_zero_length_request_finds_nothing(self):
+        allocator = TableAllocator(DAY, [(1, 4)], [])
+        self.assertEqual(allocator.rank(2, at(DAY, 19), at(DAY, 19)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()